@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+from uada.indexer import api
+from .test_sync import indexer, mint, OWNER, STAKE_ADDRESS
+
+
+@pytest.fixture
+def backend():
+    backend = InMemoryBackend()
+    FastAPICache.init(backend, prefix="uada-api")
+    yield backend
+    FastAPICache.reset()
+
+
+def test_positions(indexer, backend):
+    mint(indexer)
+    by_stake_key = asyncio.run(api.positions_by_stake_key(STAKE_ADDRESS))
+    assert [p["lovelace"] for p in by_stake_key] == [5_000_000, 7_000_000]
+    assert asyncio.run(api.positions_by_owner(str(OWNER))) == by_stake_key
+    (position,) = asyncio.run(api.positions_by_nft(b"nft2".hex()))
+    assert position["nft_name"] == b"nft2".hex()
+    assert asyncio.run(api.totals()) == {
+        "circulating_uada": 12_000_000,
+        "total_locked_lovelace": 12_000_000,
+    }
+
+
+@pytest.mark.parametrize(
+    "handler, argument",
+    [(api.positions_by_nft, "not hex"), (api.positions_by_owner, "not an address")],
+)
+def test_invalid_input(indexer, backend, handler, argument: str):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(handler(argument))
+    assert e.value.status_code == 400
+
+
+def test_cache_cleared_on_new_block(indexer, backend):
+    async def cached_after_check(last_tip):
+        await backend.set("uada-api:positions", b"[]")
+        tip = await api.clear_cache_on_new_block(last_tip)
+        return tip, await backend.get("uada-api:positions")
+
+    assert asyncio.run(cached_after_check(None)) == (None, b"[]")
+    mint(indexer, slot=10)
+    assert asyncio.run(cached_after_check(None)) == (10, None)
+    assert asyncio.run(cached_after_check(10)) == (10, b"[]")
+    indexer.roll_backward(5)
+    assert asyncio.run(cached_after_check(10)) == (None, None)
@@ -0,0 +1,274 @@
+import cbor2
+import pycardano
+import pytest
+
+from uada.indexer.models import init_database, Block, Position
+from uada.indexer.queries import (
+    positions_by_nft,
+    positions_by_owner,
+    positions_by_stake_key,
+    nft_utxo,
+    fee_params,
+    protocol_utxo,
+    circulating_uada,
+    total_locked_lovelace,
+)
+from uada.indexer.sync import SPENT_BATCH_SIZE, PositionIndexer
+from uada.onchain import uada
+
+NETWORK = pycardano.Network.TESTNET
+UADA_SCRIPT = pycardano.PlutusV2Script(cbor2.dumps(b"\x01\x02\x03"))
+UADA_SCRIPT_HASH = pycardano.plutus_script_hash(UADA_SCRIPT)
+NFT_POLICY_ID = pycardano.ScriptHash(b"\x02" * 28)
+AUTH_NFT_POLICY_ID = pycardano.ScriptHash(b"\x06" * 28)
+STAKE_KEY = pycardano.VerificationKeyHash(b"\x03" * 28)
+OWNER = pycardano.Address(pycardano.VerificationKeyHash(b"\x04" * 28), network=NETWORK)
+OTHER_OWNER = pycardano.Address(
+    pycardano.VerificationKeyHash(b"\x05" * 28), network=NETWORK
+)
+POSITION_ADDRESS = pycardano.Address(UADA_SCRIPT_HASH, STAKE_KEY, network=NETWORK)
+STAKE_ADDRESS = str(pycardano.Address(staking_part=STAKE_KEY, network=NETWORK))
+
+
+@pytest.fixture
+def indexer(tmp_path):
+    # a file, as the API queries the index from the threads of its thread pool
+    init_database(str(tmp_path / "index.db"))
+    return PositionIndexer(UADA_SCRIPT_HASH, NFT_POLICY_ID, AUTH_NFT_POLICY_ID, NETWORK)
+
+
+def position_output(nft_name: bytes, lovelace: int) -> dict:
+    datum = uada.UAdaStakingPosition(NFT_POLICY_ID.payload, nft_name)
+    return {
+        "address": str(POSITION_ADDRESS),
+        "value": {"ada": {"lovelace": lovelace}},
+        "datum": datum.to_cbor_hex(),
+    }
+
+
+def nft_output(owner: pycardano.Address, *nft_names: bytes) -> dict:
+    return {
+        "address": str(owner),
+        "value": {
+            "ada": {"lovelace": 2_000_000},
+            NFT_POLICY_ID.payload.hex(): {name.hex(): 1 for name in nft_names},
+        },
+    }
+
+
+def tx(tx_id: str, inputs=(), outputs=(), **kwargs) -> dict:
+    return {
+        "id": tx_id * 64,
+        "inputs": [{"transaction": {"id": i * 64}, "index": idx} for i, idx in inputs],
+        "outputs": list(outputs),
+        **kwargs,
+    }
+
+
+def mint(indexer: PositionIndexer, slot: int = 10):
+    indexer.roll_forward(
+        slot,
+        "a" * 64,
+        1,
+        [
+            tx(
+                "1",
+                mint={UADA_SCRIPT_HASH.payload.hex(): {b"uADA".hex(): 12_000_000}},
+                outputs=[
+                    nft_output(OWNER, b"nft1", b"nft2"),
+                    position_output(b"nft1", 5_000_000),
+                    position_output(b"nft2", 7_000_000),
+                    # not a position, the datum refers to a different policy
+                    {
+                        "address": str(POSITION_ADDRESS),
+                        "value": {"ada": {"lovelace": 1}},
+                        "datum": uada.UAdaStakingPosition(
+                            b"\x09" * 28, b"nft3"
+                        ).to_cbor_hex(),
+                    },
+                ],
+            )
+        ],
+    )
+
+
+def test_index_positions(indexer):
+    mint(indexer)
+    assert Position.select().count() == 2
+    (position,) = positions_by_nft(b"nft1")
+    assert position.lovelace == 5_000_000
+    assert position.tx_id == "1" * 64 and position.index == 1
+    assert position.stake_key == STAKE_ADDRESS
+    assert {p.nft_name for p in positions_by_stake_key(STAKE_ADDRESS)} == {
+        b"nft1".hex(),
+        b"nft2".hex(),
+    }
+    assert len(positions_by_owner(OWNER)) == 2
+    assert positions_by_owner(OTHER_OWNER) == []
+    utxo = position.utxo()
+    assert utxo.output.address == POSITION_ADDRESS
+    assert uada.UAdaStakingPosition.from_cbor(utxo.output.datum.cbor).token_name == (
+        b"nft1"
+    )
+    assert nft_utxo(b"nft2").utxo().output.amount.multi_asset[NFT_POLICY_ID] == (
+        pycardano.Asset(
+            {pycardano.AssetName(b"nft1"): 1, pycardano.AssetName(b"nft2"): 1}
+        )
+    )
+
+
+def test_spend_and_roll_back(indexer):
+    mint(indexer)
+    # withdraw the first position and move the remaining NFT to another owner
+    indexer.roll_forward(
+        20,
+        "b" * 64,
+        2,
+        [
+            tx(
+                "2",
+                inputs=[("1", 0), ("1", 1)],
+                outputs=[nft_output(OTHER_OWNER, b"nft2")],
+            )
+        ],
+    )
+    assert positions_by_nft(b"nft1") == []
+    assert positions_by_owner(OWNER) == []
+    assert [p.nft_name for p in positions_by_owner(OTHER_OWNER)] == [b"nft2".hex()]
+    (position,) = Position.select().where(Position.spent_tx_id.is_null(False))
+    assert position.spent_tx_id == "2" * 64 and position.spent_slot == 20
+
+    indexer.roll_backward(10)
+    assert len(positions_by_owner(OWNER)) == 2
+    assert positions_by_owner(OTHER_OWNER) == []
+    assert [b.slot for b in Block.select()] == [10]
+    assert [p.slot for p in indexer.intersection_points()] == [10]
+
+    indexer.roll_backward(-1)
+    assert Position.select().count() == 0
+
+
+def test_spend_many_inputs(indexer):
+    mint(indexer)
+    # the inputs of the block span several batches of updates
+    unrelated = [("9", i) for i in range(SPENT_BATCH_SIZE + 10)]
+    indexer.roll_forward(
+        20,
+        "b" * 64,
+        2,
+        [
+            tx("2", inputs=unrelated + [("1", 1)]),
+            tx("3", inputs=[("1", 2)]),
+        ],
+    )
+    assert {p.index: p.spent_tx_id for p in Position.select()} == {
+        1: "2" * 64,
+        2: "3" * 64,
+    }
+    assert positions_by_stake_key(STAKE_ADDRESS) == []
+    assert positions_by_owner(OWNER) == []
+
+
+def test_failed_tx_spends_collateral(indexer):
+    mint(indexer)
+    indexer.roll_forward(
+        20,
+        "b" * 64,
+        2,
+        [
+            tx(
+                "2",
+                inputs=[("1", 1)],
+                outputs=[nft_output(OTHER_OWNER, b"nft1")],
+                collaterals=[{"transaction": {"id": "1" * 64}, "index": 2}],
+                spends="collaterals",
+            )
+        ],
+    )
+    assert [p.index for p in positions_by_stake_key(STAKE_ADDRESS)] == [1]
+    assert positions_by_owner(OTHER_OWNER) == []
+
+
+FEE_PARAMS = uada.UAdaFeeParams(
+    mint_fee_min=1_000_000,
+    mint_fee_percent=uada.Nothing(),
+    withdrawal_fee_min=2_000_000,
+    withdrawal_fee_percent=uada.Nothing(),
+    treasury_address=uada.Address(
+        uada.PubKeyCredential(b"\x04" * 28), uada.NoStakingCredential()
+    ),
+    treasury_out_datum=uada.NoOutputDatum(),
+)
+
+
+def test_protocol_totals(indexer):
+    mint(indexer)
+    assert circulating_uada() == 12_000_000
+    assert total_locked_lovelace() == 12_000_000
+    indexer.roll_forward(
+        20,
+        "b" * 64,
+        2,
+        [
+            tx(
+                "2",
+                inputs=[("1", 1)],
+                mint={UADA_SCRIPT_HASH.payload.hex(): {b"uADA".hex(): -5_000_000}},
+            )
+        ],
+    )
+    assert circulating_uada() == 7_000_000
+    assert total_locked_lovelace() == 7_000_000
+    indexer.roll_backward(-1)
+    assert circulating_uada() == 0
+    assert total_locked_lovelace() == 0
+
+
+def test_protocol_utxos(indexer):
+    indexer.roll_forward(
+        10,
+        "a" * 64,
+        1,
+        [
+            tx(
+                "1",
+                outputs=[
+                    {
+                        "address": str(OWNER),
+                        "value": {
+                            "ada": {"lovelace": 2_000_000},
+                            AUTH_NFT_POLICY_ID.payload.hex(): {"": 1},
+                        },
+                        "datum": FEE_PARAMS.to_cbor_hex(),
+                    },
+                    # Ogmios provides the script without the outer CBOR byte string
+                    {
+                        "address": str(
+                            pycardano.Address(UADA_SCRIPT_HASH, network=NETWORK)
+                        ),
+                        "value": {"ada": {"lovelace": 10_000_000}},
+                        "script": {"language": "plutus:v2", "cbor": "010203"},
+                    },
+                    # not the uADA contract
+                    {
+                        "address": str(
+                            pycardano.Address(UADA_SCRIPT_HASH, network=NETWORK)
+                        ),
+                        "value": {"ada": {"lovelace": 10_000_000}},
+                        "script": {"language": "plutus:v2", "cbor": "0102"},
+                    },
+                ],
+            )
+        ],
+    )
+    param_utxo, params = fee_params()
+    assert param_utxo.index == 0 and params == FEE_PARAMS
+    ref_utxo = protocol_utxo("uada")
+    assert ref_utxo.index == 1
+    assert ref_utxo.utxo().output.script == UADA_SCRIPT
+    assert protocol_utxo("one_shot_nft") is None
+
+    indexer.roll_forward(20, "b" * 64, 2, [tx("2", inputs=[("1", 0)])])
+    assert fee_params() == (None, None)
+    indexer.roll_backward(10)
+    assert fee_params()[1] == FEE_PARAMS
@@ -0,0 +1,117 @@
+import random
+
+import hypothesis
+import hypothesis.strategies as st
+import pycardano
+import pytest
+
+from uada.offchain.coin_selection import (
+    SELECTION_MARGIN,
+    largest_first,
+    lovelace,
+    random_improve,
+    select_utxos,
+)
+from .test_protocol_state import ADMIN_ADDRESS, tx_in
+
+
+def wallet(*amounts: int):
+    return [
+        pycardano.UTxO(tx_in(i), pycardano.TransactionOutput(ADMIN_ADDRESS, amount))
+        for i, amount in enumerate(amounts)
+    ]
+
+
+def test_largest_first():
+    utxos = wallet(2_000_000, 50_000_000, 3_000_000, 10_000_000)
+    selected = select_utxos(utxos, 10_000_000)
+    assert selected == [utxos[1]]
+    # the required UTxO is kept first, e.g. for the one-shot NFT name
+    selected = select_utxos(utxos, 10_000_000, required_utxos=[utxos[0]])
+    assert selected == [utxos[0], utxos[1]]
+    selected = select_utxos(utxos, 0, min_inputs=2)
+    assert selected == [utxos[1], utxos[3]]
+
+
+def test_input_limit():
+    utxos = wallet(*[2_000_000] * 10)
+    assert len(select_utxos(utxos, 20_000_000, max_inputs=20)) == 10
+    with pytest.raises(AssertionError):
+        select_utxos(utxos + wallet(100_000_000), 20_000_000, max_inputs=0)
+    with pytest.raises(AssertionError):
+        select_utxos(utxos + wallet(2_000_000), 20_000_000, max_inputs=5)
+
+
+@hypothesis.given(
+    st.lists(st.integers(1_000_000, 100_000_000), min_size=1, max_size=30),
+    st.integers(-10_000_000, 200_000_000),
+    st.integers(1, 30),
+    st.integers(),
+)
+def test_strategies_reach_target(amounts, required, max_inputs, seed):
+    utxos = wallet(*amounts)
+    target = required + SELECTION_MARGIN
+    for strategy in (
+        largest_first,
+        lambda *args: random_improve(*args, rng=random.Random(seed)),
+    ):
+        try:
+            selected = select_utxos(
+                utxos, required, max_inputs=max_inputs, strategy=strategy
+            )
+        except AssertionError:
+            # only if the largest UTxOs do not suffice either
+            assert (
+                sum(sorted(amounts, reverse=True)[:max_inputs]) < target
+                and len(amounts) > max_inputs
+            )
+            continue
+        assert len(selected) <= max_inputs
+        assert len(set(u.input for u in selected)) == len(selected)
+        assert sum(lovelace(u) for u in selected) >= target or len(selected) == len(
+            utxos
+        )
+
+
+UADA = pycardano.ScriptHash(b"\x02" * 28)
+UADA_NAME = pycardano.AssetName(b"uADA")
+
+
+def uada_value(coin: int, amount: int) -> pycardano.Value:
+    return pycardano.Value(
+        coin, pycardano.MultiAsset({UADA: pycardano.Asset({UADA_NAME: amount})})
+    )
+
+
+def burned(amount: int) -> pycardano.MultiAsset:
+    return pycardano.MultiAsset({UADA: pycardano.Asset({UADA_NAME: amount})})
+
+
+def test_required_assets_in_small_utxo():
+    utxos = wallet(50_000_000, 40_000_000) + [
+        pycardano.UTxO(
+            tx_in(10),
+            pycardano.TransactionOutput(
+                ADMIN_ADDRESS, uada_value(1_500_000, 5_000_000)
+            ),
+        )
+    ]
+    # the unlocked lovelace pays for the transaction, only the uADA is missing
+    selected = select_utxos(
+        utxos, -5_000_000, required_utxos=[utxos[0]], required_assets=burned(5_000_000)
+    )
+    assert selected == [utxos[0], utxos[2]]
+
+
+def test_required_assets_from_several_utxos():
+    utxos = [
+        pycardano.UTxO(
+            tx_in(i),
+            pycardano.TransactionOutput(ADMIN_ADDRESS, uada_value(2_000_000, amount)),
+        )
+        for i, amount in enumerate((1_000_000, 3_000_000, 2_000_000))
+    ]
+    selected = select_utxos(utxos, -10_000_000, required_assets=burned(4_000_000))
+    assert selected == [utxos[1], utxos[2]]
+    with pytest.raises(AssertionError, match="does not hold"):
+        select_utxos(utxos, -10_000_000, required_assets=burned(7_000_000))
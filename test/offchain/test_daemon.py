@@ -0,0 +1,107 @@
+import threading
+
+import pycardano
+import pytest
+
+from uada.offchain.daemon import StateFollower, TransactionDaemon
+from uada.offchain.protocol_state import ProtocolState
+from uada.offchain.util import SAMPLE_STAKE_KEY
+from uada.utils import network
+from .test_protocol_state import ADMIN_ADDRESS, FakeContext, tx_in
+
+
+class FinishedDaemon(TransactionDaemon):
+    """
+    Skips balancing, which needs protocol parameters and script evaluation
+    """
+
+    def finish(self, builder, change_address, sign):
+        return builder
+
+
+@pytest.fixture
+def daemon():
+    state = ProtocolState.from_contracts(None, ADMIN_ADDRESS)
+    state.context = context = FakeContext(state)
+    return FinishedDaemon(context, state)
+
+
+def test_state_kept_warm(daemon):
+    states = []
+    for _ in range(3):
+        daemon.build(lambda b, s: states.append(s), ADMIN_ADDRESS, False, "test")
+    assert sum(daemon.context.queries.values()) == 3
+    assert all(s.param_utxo.input == tx_in(0) for s in states)
+
+    follower = StateFollower(daemon.state)
+    follower.roll_forward(
+        10, "00" * 32, 1, [{"inputs": [{"transaction": {"id": "00" * 32}, "index": 1}]}]
+    )
+    daemon.build(lambda b, s: None, ADMIN_ADDRESS, False, "test")
+    assert sum(daemon.context.queries.values()) == 6
+
+    follower.roll_backward(5)
+    daemon.build(lambda b, s: None, ADMIN_ADDRESS, False, "test")
+    assert sum(daemon.context.queries.values()) == 9
+
+
+def test_retry_with_fresh_state(daemon):
+    attempts = []
+
+    def add_to_builder(builder, state):
+        attempts.append(state)
+        if len(attempts) == 1:
+            raise ValueError("outdated reference script")
+
+    daemon.build(add_to_builder, ADMIN_ADDRESS, False, "test")
+    assert len(attempts) == 2
+    # the state is loaded again for the second attempt
+    assert sum(daemon.context.queries.values()) == 6
+
+    def fail(builder, state):
+        raise AssertionError("No unique nft found")
+
+    with pytest.raises(AssertionError):
+        daemon.build(fail, ADMIN_ADDRESS, False, "test")
+    assert sum(daemon.context.queries.values()) == 6
+
+
+def test_sign_only_own_wallet(daemon):
+    builder = pycardano.TransactionBuilder(daemon.context)
+    with pytest.raises(AssertionError, match="no wallet"):
+        TransactionDaemon.finish(daemon, builder, ADMIN_ADDRESS, True)
+    daemon.signing_key = pycardano.PaymentSigningKey.generate()
+    with pytest.raises(AssertionError, match="wallet of the daemon"):
+        TransactionDaemon.finish(daemon, builder, ADMIN_ADDRESS, True)
+
+
+def test_sign_only_own_positions(daemon):
+    daemon.signing_key = pycardano.PaymentSigningKey.generate()
+    wallet = pycardano.Address(
+        daemon.signing_key.to_verification_key().hash(), network=network
+    )
+    # the wallet of the daemon would fund a position whose NFT and uADA go to someone else
+    with pytest.raises(AssertionError, match="positions owned by the wallet"):
+        daemon.mint(wallet, [(str(ADMIN_ADDRESS), SAMPLE_STAKE_KEY, 5_000_000)], True)
+    # unsigned transactions are signed by whoever requested them
+    with pytest.raises(AssertionError, match="Need at least 1"):
+        daemon.mint(wallet, [(str(ADMIN_ADDRESS), SAMPLE_STAKE_KEY, 5_000_000)])
+    with pytest.raises(AssertionError, match="Need at least 1"):
+        daemon.mint(wallet, [(str(wallet), SAMPLE_STAKE_KEY, 5_000_000)], True)
+
+
+def test_follower_waits_for_daemon_lock(daemon):
+    daemon.build(lambda b, s: None, ADMIN_ADDRESS, False, "test")
+    follower = StateFollower(daemon.state, lock=daemon._lock)
+    block = [{"inputs": [{"transaction": {"id": "00" * 32}, "index": 1}]}]
+    thread = threading.Thread(
+        target=follower.roll_forward, args=(10, "00" * 32, 1, block)
+    )
+    with daemon._lock:
+        thread.start()
+        thread.join(0.1)
+        # the state is not invalidated while a request refreshes or copies it
+        assert thread.is_alive()
+        assert daemon.state.loaded
+    thread.join()
+    assert not daemon.state.loaded
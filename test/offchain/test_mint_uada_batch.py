@@ -0,0 +1,134 @@
+from typing import List, Optional
+
+import pycardano
+import pytest
+
+from uada.offchain.mint_uada_batch import build_batch_mint
+from uada.offchain.protocol_state import ProtocolState
+from uada.offchain.util import HintingTransactionBuilder, SAMPLE_STAKE_KEY
+from uada.onchain import one_shot_nft, uada
+from uada.utils import network
+from uada.utils.emulator import EmulatorChainContext
+from uada.utils.reservations import ReservingChainContext
+from uada.utils.to_script_context import to_tx_out_ref
+
+from .test_protocol_state import ADMIN_ADDRESS, FEE_PARAMS
+
+SIGNING_KEY = pycardano.PaymentSigningKey.generate()
+WALLET = pycardano.Address(SIGNING_KEY.to_verification_key().hash(), network=network)
+OWNER = pycardano.Address(pycardano.VerificationKeyHash(b"\x03" * 28), network=network)
+
+# the builders invoke the uADA withdrawal script with the pycardano fork pinned in pyproject.toml
+requires_withdrawal_scripts = pytest.mark.skipif(
+    not hasattr(pycardano.TransactionBuilder, "add_withdrawal_script"),
+    reason="the installed pycardano can not add withdrawal scripts",
+)
+
+
+def protocol_emulator(wallet_amounts: List[int]) -> EmulatorChainContext:
+    """
+    An emulated chain with the fee parameters, the reference scripts and the uADA stake key set up
+    and the wallet funded with one UTxO per amount
+    """
+    emulator = EmulatorChainContext(network=network)
+    state = ProtocolState.from_contracts(emulator, ADMIN_ADDRESS)
+    emulator.add_utxo(
+        pycardano.TransactionOutput(
+            ADMIN_ADDRESS,
+            pycardano.Value(
+                2_000_000,
+                pycardano.MultiAsset.from_primitive(
+                    {state.auth_nft_policy_id.payload: {b"": 1}}
+                ),
+            ),
+            datum=pycardano.RawCBOR(FEE_PARAMS.to_cbor()),
+        )
+    )
+    for script in (state.uada_script, state.one_shot_nft_script):
+        emulator.add_utxo(
+            pycardano.TransactionOutput(
+                pycardano.Address(
+                    pycardano.plutus_script_hash(script), network=network
+                ),
+                30_000_000,
+                script=script,
+            )
+        )
+    emulator.register_stake(pycardano.plutus_script_hash(state.uada_script))
+    for amount in wallet_amounts:
+        emulator.add_utxo(pycardano.TransactionOutput(WALLET, amount))
+    return emulator
+
+
+def mint_positions(
+    context, amounts: List[int], payment_utxos: Optional[List[pycardano.UTxO]] = None
+) -> pycardano.Transaction:
+    state = ProtocolState.from_contracts(context, ADMIN_ADDRESS).refresh()
+    builder = HintingTransactionBuilder(context)
+    build_batch_mint(
+        builder,
+        context.utxos(WALLET) if payment_utxos is None else payment_utxos,
+        [(str(OWNER), SAMPLE_STAKE_KEY, amount) for amount in amounts],
+        state.param_utxo,
+        state.fee_params,
+        state.uada_script,
+        state.one_shot_nft_script,
+        state.uada_ref_utxo,
+        state.one_shot_nft_ref_utxo,
+    )
+    tx = builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+    context.submit_tx(tx)
+    return tx
+
+
+@requires_withdrawal_scripts
+def test_mint_batch():
+    emulator = protocol_emulator([100_000_000] * 4)
+    tx = mint_positions(emulator, [5_000_000, 10_000_000, 20_000_000])
+    state = ProtocolState.from_contracts(emulator, ADMIN_ADDRESS)
+    uada_hash = pycardano.plutus_script_hash(state.uada_script)
+    nft_policy_id = pycardano.plutus_script_hash(state.one_shot_nft_script)
+
+    # the treasury is paid once for the total volume
+    treasury = tx.transaction_body.outputs[0]
+    assert treasury.amount.coin == uada.compute_fee(
+        35_000_000, FEE_PARAMS.mint_fee_percent, FEE_PARAMS.mint_fee_min
+    )
+    positions = [
+        o for o in tx.transaction_body.outputs if o.address.payment_part == uada_hash
+    ]
+    assert sorted(o.amount.coin for o in positions) == [
+        5_000_000,
+        10_000_000,
+        20_000_000,
+    ]
+    # every position has its own NFT, named after a spent wallet UTxO
+    spent_names = {
+        one_shot_nft.one_shot_nft_name(to_tx_out_ref(i))
+        for i in tx.transaction_body.inputs
+    }
+    nft_names = {o.datum.token_name for o in positions}
+    assert len(nft_names) == 3 and nft_names <= spent_names
+    owned = sum(
+        (u.output.amount.multi_asset for u in emulator.utxos(OWNER)),
+        pycardano.MultiAsset(),
+    )
+    assert set(owned[nft_policy_id].keys()) == {
+        pycardano.AssetName(n) for n in nft_names
+    }
+    assert owned[uada_hash][pycardano.AssetName(b"uADA")] == 35_000_000
+
+
+def test_mint_batch_not_enough_utxos():
+    emulator = protocol_emulator([100_000_000] * 2)
+    with pytest.raises(AssertionError, match="Need at least 3"):
+        mint_positions(emulator, [5_000_000] * 3)
+
+
+def test_mint_batch_reserved_utxos():
+    emulator = protocol_emulator([100_000_000] * 3)
+    context = ReservingChainContext(emulator)
+    context.reservations.reserve(emulator.utxos(WALLET)[:2])
+    # only one of the given UTxOs is left to name the NFTs after, no position may be dropped
+    with pytest.raises(AssertionError, match="Need at least 2 unreserved UTxOs"):
+        mint_positions(context, [5_000_000] * 2, emulator.utxos(WALLET))
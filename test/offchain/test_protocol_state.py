@@ -0,0 +1,114 @@
+import asyncio
+from collections import Counter
+from typing import List, Union
+
+import pycardano
+
+from uada.offchain.protocol_state import ProtocolState
+from uada.onchain import uada
+from uada.utils.network import AsyncChainContext
+
+NETWORK = pycardano.Network.TESTNET
+ADMIN_ADDRESS = pycardano.Address(
+    pycardano.VerificationKeyHash(b"\x01" * 28), network=NETWORK
+)
+TREASURY_DATUM = uada.Nothing()
+FEE_PARAMS = uada.UAdaFeeParams(
+    mint_fee_min=1_000_000,
+    mint_fee_percent=uada.Fraction(3, 1000),
+    withdrawal_fee_min=1_000_000,
+    withdrawal_fee_percent=uada.Fraction(3, 1000),
+    treasury_address=uada.Address(
+        uada.PubKeyCredential(b"\x02" * 28), uada.NoStakingCredential()
+    ),
+    treasury_out_datum=uada.SomeOutputDatum(TREASURY_DATUM),
+)
+
+
+def tx_in(index: int) -> pycardano.TransactionInput:
+    return pycardano.TransactionInput.from_primitive(["00" * 32, index])
+
+
+class FakeContext(pycardano.ChainContext):
+    def __init__(self, state: ProtocolState):
+        self.queries = Counter()
+        self.script_address = pycardano.Address(
+            pycardano.plutus_script_hash(state.uada_script), network=NETWORK
+        )
+        auth_nft = pycardano.MultiAsset.from_primitive(
+            {state.auth_nft_policy_id.payload: {b"": 1}}
+        )
+        self.utxos_at = {
+            str(ADMIN_ADDRESS): [
+                pycardano.UTxO(
+                    tx_in(0),
+                    pycardano.TransactionOutput(
+                        ADMIN_ADDRESS,
+                        pycardano.Value(2_000_000, auth_nft),
+                        datum=pycardano.RawCBOR(FEE_PARAMS.to_cbor()),
+                    ),
+                )
+            ],
+            str(self.script_address): [
+                pycardano.UTxO(
+                    tx_in(1),
+                    pycardano.TransactionOutput(
+                        self.script_address, 20_000_000, script=state.uada_script
+                    ),
+                )
+            ],
+        }
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        self.queries[str(address)] += 1
+        return self.utxos_at.get(str(address), [])
+
+
+def test_loaded_once():
+    state = ProtocolState.from_contracts(None, ADMIN_ADDRESS)
+    state.context = context = FakeContext(state)
+    for _ in range(3):
+        state.refresh()
+    assert sum(context.queries.values()) == 3
+    assert state.fee_params.to_cbor() == FEE_PARAMS.to_cbor()
+    assert state.param_utxo.input == tx_in(0)
+    assert state.uada_ref_utxo.input == tx_in(1)
+    assert state.one_shot_nft_ref_utxo is None
+    assert state.treasury_out_datum_hash == pycardano.datum_hash(TREASURY_DATUM)
+    assert state.treasury_payout(2_000_000).amount.coin == 2_000_000
+
+    # blocks that do not spend any of the UTxOs keep the state
+    assert not state.spend([tx_in(2)])
+    assert not state.roll_forward(
+        [
+            {
+                "inputs": [{"transaction": {"id": "00" * 32}, "index": 2}],
+                "collaterals": [{"transaction": {"id": "00" * 32}, "index": 0}],
+            }
+        ]
+    )
+    state.refresh()
+    assert sum(context.queries.values()) == 3
+
+    # the fee parameters are updated
+    assert state.roll_forward(
+        [{"inputs": [{"transaction": {"id": "00" * 32}, "index": 0}]}]
+    )
+    state.refresh()
+    assert sum(context.queries.values()) == 6
+
+    state.roll_backward()
+    state.refresh()
+    assert sum(context.queries.values()) == 9
+
+
+def test_load_async():
+    state = ProtocolState.from_contracts(None, ADMIN_ADDRESS)
+    state.context = context = FakeContext(state)
+    async_context = AsyncChainContext(context)
+    asyncio.run(state.refresh_async(async_context))
+    asyncio.run(state.refresh_async(async_context))
+    assert sum(context.queries.values()) == 3
+    assert state.param_utxo.input == tx_in(0)
+    assert state.uada_ref_utxo.input == tx_in(1)
+    assert state.treasury_out_datum_hash == pycardano.datum_hash(TREASURY_DATUM)
@@ -0,0 +1,393 @@
+import dataclasses
+from typing import List
+
+import cbor2
+import pycardano
+import pytest
+
+from uada.offchain import withdraw_uada_batch
+from uada.offchain.coin_selection import select_utxos
+from uada.offchain.protocol_state import ProtocolState
+from uada.offchain.util import (
+    HintingTransactionBuilder,
+    asset_from_token,
+    datum_cbor,
+    within_protocol_limits,
+)
+from uada.offchain.withdraw_or_extend_uada_partial import find_position
+from uada.offchain.withdraw_uada_batch import (
+    build_batch_withdraw,
+    build_batches,
+    find_positions,
+    group_by_nft_utxo,
+)
+from uada.onchain import uada
+from uada.utils import network
+from uada.utils.emulator import PROTOCOL_PARAMETERS, EmulatorChainContext
+from uada.utils.reservations import ReservingChainContext, reservations_of
+from opshin.prelude import Token
+
+from .test_mint_uada_batch import (
+    SIGNING_KEY,
+    WALLET,
+    protocol_emulator,
+    requires_withdrawal_scripts,
+)
+from .test_protocol_state import ADMIN_ADDRESS
+
+POSITION_AMOUNT = 10_000_000
+
+
+def contract_addresses(state: ProtocolState):
+    uada_hash = pycardano.plutus_script_hash(state.uada_script)
+    return (
+        pycardano.Address(uada_hash, network=network),
+        Token(uada_hash.payload, b"uADA"),
+        pycardano.plutus_script_hash(state.one_shot_nft_script),
+    )
+
+
+def add_positions(
+    emulator: EmulatorChainContext, nft_names: List[List[bytes]]
+) -> ProtocolState:
+    """
+    Lock a staking position for every NFT name and give the wallet one UTxO per list of names,
+    holding their NFTs and the uADA minted for the positions
+    """
+    state = ProtocolState.from_contracts(emulator, ADMIN_ADDRESS).refresh()
+    uada_address, uada_token, nft_policy_id = contract_addresses(state)
+    for names in nft_names:
+        assets = asset_from_token(uada_token, POSITION_AMOUNT * len(names))
+        for name in names:
+            emulator.add_utxo(
+                pycardano.TransactionOutput(
+                    uada_address,
+                    POSITION_AMOUNT,
+                    datum=pycardano.RawCBOR(
+                        uada.UAdaStakingPosition(nft_policy_id.payload, name).to_cbor()
+                    ),
+                )
+            )
+            assets += asset_from_token(Token(nft_policy_id.payload, name), 1)
+        emulator.add_utxo(
+            pycardano.TransactionOutput(WALLET, pycardano.Value(2_000_000, assets))
+        )
+    return state
+
+
+def wallet_positions(context, state: ProtocolState):
+    uada_address, _, nft_policy_id = contract_addresses(state)
+    return find_positions(context, [uada_address], context.utxos(WALLET), nft_policy_id)
+
+
+def test_find_positions():
+    emulator = protocol_emulator([100_000_000])
+    state = add_positions(emulator, [[b"a"], [b"b", b"c"]])
+    uada_address, _, nft_policy_id = contract_addresses(state)
+    # positions of NFTs the wallet does not hold, of other policies and without datum are ignored
+    emulator.add_utxo(
+        pycardano.TransactionOutput(
+            uada_address,
+            POSITION_AMOUNT,
+            datum=pycardano.RawCBOR(
+                uada.UAdaStakingPosition(nft_policy_id.payload, b"d").to_cbor()
+            ),
+        )
+    )
+    emulator.add_utxo(
+        pycardano.TransactionOutput(
+            uada_address,
+            POSITION_AMOUNT,
+            datum=pycardano.RawCBOR(
+                uada.UAdaStakingPosition(b"\x00" * 28, b"a").to_cbor()
+            ),
+        )
+    )
+    emulator.add_utxo(pycardano.TransactionOutput(uada_address, POSITION_AMOUNT))
+
+    positions = wallet_positions(emulator, state)
+    assert sorted(datum.token_name for _, datum, _ in positions) == [b"a", b"b", b"c"]
+    for position_utxo, datum, nft_utxo in positions:
+        assert position_utxo.output.address == uada_address
+        assert nft_utxo.output.amount.multi_asset[nft_policy_id][
+            pycardano.AssetName(datum.token_name)
+        ]
+
+
+def test_find_position_decoded_datum():
+    emulator = protocol_emulator([100_000_000])
+    state = ProtocolState.from_contracts(emulator, ADMIN_ADDRESS).refresh()
+    uada_address, _, nft_policy_id = contract_addresses(state)
+    assert find_position(emulator, uada_address, nft_policy_id) == (None, None)
+    # chain contexts may return the inline datum decoded instead of as raw CBOR
+    datum = uada.UAdaStakingPosition(nft_policy_id.payload, b"a")
+    position_utxo = emulator.add_utxo(
+        pycardano.TransactionOutput(uada_address, POSITION_AMOUNT, datum=datum)
+    )
+    assert datum_cbor(position_utxo.output) == datum.to_cbor()
+    assert find_position(emulator, uada_address, nft_policy_id) == (
+        position_utxo,
+        datum,
+    )
+
+
+def test_group_by_nft_utxo():
+    emulator = protocol_emulator([100_000_000])
+    state = add_positions(emulator, [[b"a"], [b"b", b"c"], [b"d"]])
+    groups = group_by_nft_utxo(wallet_positions(emulator, state))
+    assert sorted(sorted(datum.token_name for _, datum, _ in g) for g in groups) == [
+        [b"a"],
+        [b"b", b"c"],
+        [b"d"],
+    ]
+    for group in groups:
+        assert len({nft_utxo for _, _, nft_utxo in group}) == 1
+
+
+def test_size_limited():
+    emulator = protocol_emulator([100_000_000])
+    emulator._protocol_param = dataclasses.replace(PROTOCOL_PARAMETERS, max_tx_size=100)
+    builder = HintingTransactionBuilder(emulator)
+    builder.add_input_address(WALLET)
+    with pytest.raises(pycardano.InvalidTransactionException):
+        builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+
+    builder = HintingTransactionBuilder(emulator, size_limited=False)
+    builder.add_input_address(WALLET)
+    tx = builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+    assert not within_protocol_limits(tx, emulator.protocol_param)
+    assert within_protocol_limits(tx, PROTOCOL_PARAMETERS)
+
+
+def withdraw_kwargs(state: ProtocolState) -> dict:
+    return dict(
+        param_utxo=state.param_utxo,
+        fee_params=state.fee_params,
+        uada_script=state.uada_script,
+        one_shot_nft_script=state.one_shot_nft_script,
+        uada_ref_utxo=state.uada_ref_utxo,
+        one_shot_nft_ref_utxo=state.one_shot_nft_ref_utxo,
+    )
+
+
+@requires_withdrawal_scripts
+def test_build_batch_withdraw():
+    emulator = protocol_emulator([100_000_000])
+    state = add_positions(emulator, [[b"a"], [b"b", b"c"]])
+    positions = wallet_positions(emulator, state)
+    builder = HintingTransactionBuilder(emulator)
+    build_batch_withdraw(
+        builder, emulator.utxos(WALLET), positions, **withdraw_kwargs(state)
+    )
+    tx = builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+    emulator.submit_tx(tx)
+    assert wallet_positions(emulator, state) == []
+    _, _, nft_policy_id = contract_addresses(state)
+    for utxo in emulator.utxos(WALLET):
+        assert nft_policy_id not in utxo.output.amount.multi_asset
+
+
+@requires_withdrawal_scripts
+def test_build_batch_withdraw_uada_in_small_utxo():
+    emulator = protocol_emulator([100_000_000])
+    state = add_positions(emulator, [[b"a"]])
+    _, uada_token, nft_policy_id = contract_addresses(state)
+    # the NFT and the uADA to burn are held apart, the uADA in the smallest UTxO of the wallet
+    (nft_utxo,) = [u for u in emulator.utxos(WALLET) if u.output.amount.multi_asset]
+    del emulator.ledger[nft_utxo.input]
+    emulator.add_utxo(
+        pycardano.TransactionOutput(
+            WALLET,
+            pycardano.Value(
+                2_000_000, asset_from_token(Token(nft_policy_id.payload, b"a"), 1)
+            ),
+        )
+    )
+    uada_utxo = emulator.add_utxo(
+        pycardano.TransactionOutput(
+            WALLET,
+            pycardano.Value(1_500_000, asset_from_token(uada_token, POSITION_AMOUNT)),
+        )
+    )
+    builder = HintingTransactionBuilder(emulator)
+    build_batch_withdraw(
+        builder,
+        emulator.utxos(WALLET),
+        wallet_positions(emulator, state),
+        **withdraw_kwargs(state),
+    )
+    tx = builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+    assert uada_utxo.input in tx.transaction_body.inputs
+    emulator.submit_tx(tx)
+
+
+@requires_withdrawal_scripts
+def test_build_batches_split():
+    nft_names = [[b"a"], [b"b", b"c"], [b"d"], [b"e"]]
+    emulator = protocol_emulator([100_000_000] * 4)
+    state = add_positions(emulator, nft_names)
+    groups = group_by_nft_utxo(wallet_positions(emulator, state))
+    # the execution units of withdrawing all positions at once
+    (single,) = build_batches(
+        emulator,
+        emulator.utxos(WALLET),
+        groups,
+        SIGNING_KEY,
+        WALLET,
+        **withdraw_kwargs(state),
+    )
+    used = sum(r.ex_units.mem for r in single.transaction_witness_set.redeemer)
+
+    emulator = protocol_emulator([100_000_000] * 4)
+    emulator._protocol_param = dataclasses.replace(
+        PROTOCOL_PARAMETERS, max_tx_ex_mem=used - 1
+    )
+    state = add_positions(emulator, nft_names)
+    context = ReservingChainContext(emulator)
+    groups = group_by_nft_utxo(wallet_positions(context, state))
+    txs = build_batches(
+        context,
+        emulator.utxos(WALLET),
+        groups,
+        SIGNING_KEY,
+        WALLET,
+        **withdraw_kwargs(state),
+    )
+    assert len(txs) > 1
+    for tx in txs:
+        assert within_protocol_limits(tx, emulator.protocol_param)
+    # the transactions spend disjoint inputs and can all be submitted
+    for tx in txs:
+        context.submit_tx(tx)
+    assert wallet_positions(emulator, state) == []
+
+
+@requires_withdrawal_scripts
+def test_build_batches_failure_not_split():
+    emulator = protocol_emulator([100_000_000] * 2)
+    state = add_positions(emulator, [[b"a"], [b"b"]])
+    groups = group_by_nft_utxo(wallet_positions(emulator, state))
+
+    evaluated = []
+
+    def failing_evaluate_tx(tx):
+        evaluated.append(tx)
+        raise pycardano.TransactionFailedException("Script failed")
+
+    emulator.evaluate_tx = failing_evaluate_tx
+    with pytest.raises(pycardano.TransactionFailedException, match="Script failed"):
+        build_batches(
+            emulator,
+            emulator.utxos(WALLET),
+            groups,
+            SIGNING_KEY,
+            WALLET,
+            **withdraw_kwargs(state),
+        )
+    # the positions are not split into smaller transactions that fail the same way
+    assert len(evaluated) == 1
+
+
+def stub_build_batch_withdraw(
+    builder: HintingTransactionBuilder,
+    payment_utxos: List[pycardano.UTxO],
+    positions,
+    **kwargs,
+):
+    """
+    Spends the NFT UTxOs and a wallet UTxO like build_batch_withdraw,
+    but pays a padded output per position instead of invoking the uADA scripts
+    """
+    nft_utxos = list({nft_utxo: None for _, _, nft_utxo in positions})
+    for u in select_utxos(
+        payment_utxos,
+        0,
+        required_utxos=nft_utxos,
+        min_inputs=len(nft_utxos) + 1,
+        reservations=reservations_of(builder.context),
+    ):
+        builder.add_input(u)
+    for _ in positions:
+        builder.add_output(
+            pycardano.TransactionOutput(
+                WALLET,
+                2_000_000,
+                datum=pycardano.RawCBOR(cbor2.dumps([bytes(64)] * 16)),
+            )
+        )
+    return builder
+
+
+def stubbed_batches(context, groups) -> List[pycardano.Transaction]:
+    return build_batches(
+        context,
+        context.utxos(WALLET),
+        groups,
+        SIGNING_KEY,
+        WALLET,
+    )
+
+
+def test_build_batches_split_stubbed(monkeypatch):
+    monkeypatch.setattr(
+        withdraw_uada_batch, "build_batch_withdraw", stub_build_batch_withdraw
+    )
+    nft_names = [[b"a"], [b"b", b"c"], [b"d"], [b"e"]]
+    emulator = protocol_emulator([100_000_000] * 4)
+    state = add_positions(emulator, nft_names)
+    groups = group_by_nft_utxo(wallet_positions(emulator, state))
+    (single,) = stubbed_batches(emulator, groups)
+    assert len(single.transaction_body.outputs) > len(groups)
+
+    emulator = protocol_emulator([100_000_000] * 4)
+    state = add_positions(emulator, nft_names)
+    emulator._protocol_param = dataclasses.replace(
+        PROTOCOL_PARAMETERS, max_tx_size=len(single.to_cbor()) - 1
+    )
+    context = ReservingChainContext(emulator)
+    groups = group_by_nft_utxo(wallet_positions(context, state))
+    txs = stubbed_batches(context, groups)
+    assert len(txs) > 1
+    for tx in txs:
+        assert within_protocol_limits(tx, emulator.protocol_param)
+    # the positions sharing a NFT UTxO are withdrawn together
+    spent = [set(tx.transaction_body.inputs) for tx in txs]
+    for group in groups:
+        (nft_utxo,) = {nft_utxo for _, _, nft_utxo in group}
+        assert sum(nft_utxo.input in inputs for inputs in spent) == 1
+    # the split transactions spend disjoint inputs and can all be submitted
+    for tx in txs:
+        context.submit_tx(tx)
+    assert context.utxos(WALLET)
+
+
+def test_build_batches_single_group_too_large(monkeypatch):
+    monkeypatch.setattr(
+        withdraw_uada_batch, "build_batch_withdraw", stub_build_batch_withdraw
+    )
+    emulator = protocol_emulator([100_000_000])
+    state = add_positions(emulator, [[b"a", b"b"]])
+    emulator._protocol_param = dataclasses.replace(
+        PROTOCOL_PARAMETERS, max_tx_size=1000
+    )
+    groups = group_by_nft_utxo(wallet_positions(emulator, state))
+    with pytest.raises(AssertionError, match="single NFT UTxO"):
+        stubbed_batches(emulator, groups)
+
+
+def test_build_batches_failure_not_split_stubbed(monkeypatch):
+    built = []
+
+    def failing_build_batch_withdraw(builder, payment_utxos, positions, **kwargs):
+        built.append(positions)
+        raise ValueError("Position not found")
+
+    monkeypatch.setattr(
+        withdraw_uada_batch, "build_batch_withdraw", failing_build_batch_withdraw
+    )
+    emulator = protocol_emulator([100_000_000] * 2)
+    state = add_positions(emulator, [[b"a"], [b"b"]])
+    groups = group_by_nft_utxo(wallet_positions(emulator, state))
+    with pytest.raises(ValueError, match="Position not found"):
+        stubbed_batches(emulator, groups)
+    assert len(built) == 1
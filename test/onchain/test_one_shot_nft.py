@@ -0,0 +1,97 @@
+import pytest
+from hypothesis import given, strategies as st
+
+from uada.onchain.one_shot_nft import *
+
+OWN_POLICY_ID = b"\x01" * 28
+
+
+def make_context(inputs: List[TxOutRef], mint: Dict[TokenName, int]) -> ScriptContext:
+    tx_info = TxInfo(
+        inputs=[
+            TxInInfo(
+                i,
+                TxOut(
+                    Address(PubKeyCredential(b""), NoStakingCredential()),
+                    {b"": {b"": 1_000_000}},
+                    NoOutputDatum(),
+                    NoScriptHash(),
+                ),
+            )
+            for i in inputs
+        ],
+        reference_inputs=[],
+        outputs=[],
+        fee={b"": {b"": 0}},
+        mint={OWN_POLICY_ID: mint},
+        dcert=[],
+        wdrl={},
+        valid_range=make_range(0, 1),
+        signatories=[],
+        redeemers={},
+        data={},
+        id=TxId(b""),
+    )
+    return ScriptContext(tx_info, Minting(OWN_POLICY_ID))
+
+
+def make_inputs(n: int) -> List[TxOutRef]:
+    return [TxOutRef(TxId(bytes([i]) * 32), i) for i in range(n)]
+
+
+@given(n=st.integers(min_value=1, max_value=10))
+def test_mint_batch(n: int):
+    inputs = make_inputs(n)
+    mint = {one_shot_nft_name(i): 1 for i in inputs}
+    validator(list(range(n)), make_context(inputs, mint))
+
+
+def test_mint_single_among_other_inputs():
+    inputs = make_inputs(3)
+    validator([1], make_context(inputs, {one_shot_nft_name(inputs[1]): 1}))
+
+
+def test_mint_duplicate_index():
+    inputs = make_inputs(2)
+    with pytest.raises(AssertionError):
+        validator([0, 0], make_context(inputs, {one_shot_nft_name(inputs[0]): 1}))
+
+
+def test_mint_duplicate_index_with_other_token():
+    inputs = make_inputs(2)
+    # the duplicate index would make up for the count of the other token
+    mint = {one_shot_nft_name(inputs[0]): 1, b"copied position nft": 1}
+    with pytest.raises(AssertionError):
+        validator([0, 0], make_context(inputs, mint))
+
+
+def test_mint_descending_indices():
+    inputs = make_inputs(2)
+    mint = {one_shot_nft_name(i): 1 for i in inputs}
+    with pytest.raises(AssertionError):
+        validator([1, 0], make_context(inputs, mint))
+
+
+def test_mint_additional_token():
+    inputs = make_inputs(2)
+    mint = {one_shot_nft_name(inputs[0]): 1, one_shot_nft_name(inputs[1]): 1}
+    with pytest.raises(AssertionError):
+        validator([0], make_context(inputs, mint))
+
+
+def test_mint_more_than_one():
+    inputs = make_inputs(1)
+    with pytest.raises(AssertionError):
+        validator([0], make_context(inputs, {one_shot_nft_name(inputs[0]): 2}))
+
+
+def test_burn():
+    inputs = make_inputs(2)
+    mint = {one_shot_nft_name(inputs[0]): -1, one_shot_nft_name(inputs[1]): -1}
+    validator([], make_context(inputs, mint))
+
+
+def test_mint_in_burn():
+    inputs = make_inputs(1)
+    with pytest.raises(AssertionError):
+        validator([], make_context(inputs, {one_shot_nft_name(inputs[0]): 1}))
@@ -0,0 +1,40 @@
+import uplc
+
+from uada import profile
+from uada.build import compile_uplc
+from uada.utils.evaluate import run_script
+
+CONTRACT = """
+from opshin.prelude import *
+
+
+def triple(x: int) -> int:
+    return x * 3
+
+
+def validator(redeemer: List[int], context: ScriptContext) -> None:
+    assert sum([triple(x) for x in redeemer]) > 0, "Empty redeemer"
+"""
+
+
+def test_profile_by_function(tmp_path):
+    contract = tmp_path / "contract.py"
+    contract.write_text(CONTRACT)
+    program = compile_uplc(contract)
+    args = ([1, 2, 3], 0)
+
+    result = profile.profile_program(program, *args)
+    _, ex_units = run_script(uplc.flatten(program), *args)
+    # the whole cost is distributed over the frames
+    assert sum(c["cpu"] for c in result.values()) == ex_units.steps
+    assert sum(c["mem"] for c in result.values()) == ex_units.mem
+    assert {("triple",), ("validator",)} <= set(result)
+
+    functions = {name: cpu for name, cpu, _ in profile.top(result)}
+    assert functions["triple"] > 0 and functions["validator"] > 0
+    # patterns of the compiler are charged to their user
+    assert all(not profile.is_pattern(name) for name in functions)
+
+    stacks = profile.folded(result, "contract").splitlines()
+    assert f"contract;triple {result[('triple',)]['cpu']}" in stacks
+    assert all(line.startswith("contract") for line in stacks)
@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from uada.benchmark import BRANCHES, DIMENSIONS, cost_curves
+from uada.build import compiles_compressed
+from uada.offchain.util import module_name
+from uada.onchain import uada
+
+# regenerate with python3 -m uada.benchmark --output test/onchain/uada_budget.json
+baseline = json.loads(Path(__file__).parent.joinpath("uada_budget.json").read_text())
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["compressed", "plain"])
+def curves(request):
+    compressed = request.param
+    if compressed and not compiles_compressed(module_name(uada)):
+        pytest.skip("plutonomy-cli is not installed")
+    return (
+        baseline[f"uada{'_compressed' if compressed else ''}"],
+        cost_curves(compressed),
+    )
+
+
+def test_script_size(curves):
+    expected, actual = curves
+    assert actual["script_size"] <= expected["script_size"]
+
+
+@pytest.mark.parametrize("branch", BRANCHES)
+@pytest.mark.parametrize("dimension", DIMENSIONS)
+def test_budget_not_increased(curves, branch: str, dimension: str):
+    expected, actual = curves
+    for size, cost in actual[branch][dimension].items():
+        expected_cost = expected[branch][dimension][size]
+        assert (
+            cost["cpu"] <= expected_cost["cpu"]
+        ), f"cpu of {branch} with {size} {dimension} increased"
+        assert (
+            cost["mem"] <= expected_cost["mem"]
+        ), f"mem of {branch} with {size} {dimension} increased"
@@ -0,0 +1,122 @@
+import pytest
+from hypothesis import given, strategies as st
+
+from uada import benchmark
+from uada.build import source_contract
+from uada.onchain.uada import *
+from uada.utils.evaluate import evaluate_script
+
+OWN_SCRIPT_CREDENTIAL = ScriptCredential(b"\x01" * 28)
+OTHER_SCRIPT_CREDENTIAL = ScriptCredential(b"\x02" * 28)
+
+
+def make_tx_out(credential: PubKeyCredential, amount: int) -> TxOut:
+    return TxOut(
+        Address(credential, NoStakingCredential()),
+        {b"": {b"": amount}},
+        NoOutputDatum(),
+        NoScriptHash(),
+    )
+
+
+def make_tx_info(outputs: List[TxOut]) -> TxInfo:
+    return TxInfo(
+        inputs=[],
+        reference_inputs=[],
+        outputs=outputs,
+        fee={b"": {b"": 0}},
+        mint={},
+        dcert=[],
+        wdrl={},
+        valid_range=make_range(0, 1),
+        signatories=[],
+        redeemers={},
+        data={},
+        id=TxId(b""),
+    )
+
+
+@given(
+    owners=st.lists(
+        st.sampled_from(
+            [OWN_SCRIPT_CREDENTIAL, OTHER_SCRIPT_CREDENTIAL, PubKeyCredential(b"")]
+        ),
+        max_size=10,
+    )
+)
+def test_hinted_matches_scan(owners: List[PubKeyCredential]):
+    tx_info = make_tx_info(
+        [make_tx_out(owner, 1_000_000 + i) for i, owner in enumerate(owners)]
+    )
+    hints = [i for i, owner in enumerate(owners) if owner == OWN_SCRIPT_CREDENTIAL]
+    assert hinted_lovelace_locked_in_script(
+        OWN_SCRIPT_CREDENTIAL, tx_info, hints
+    ) == all_lovelace_locked_in_script(OWN_SCRIPT_CREDENTIAL, tx_info)
+
+
+def test_hinted_output_not_in_script():
+    tx_info = make_tx_info([make_tx_out(OTHER_SCRIPT_CREDENTIAL, 1_000_000)])
+    with pytest.raises(AssertionError, match="not in script"):
+        hinted_lovelace_locked_in_script(OWN_SCRIPT_CREDENTIAL, tx_info, [0])
+
+
+def test_hinted_output_counted_twice():
+    tx_info = make_tx_info([make_tx_out(OWN_SCRIPT_CREDENTIAL, 1_000_000)])
+    with pytest.raises(AssertionError):
+        hinted_lovelace_locked_in_script(OWN_SCRIPT_CREDENTIAL, tx_info, [0, 0])
+
+
+def test_hinted_outputs_descending():
+    tx_info = make_tx_info(
+        [
+            make_tx_out(OWN_SCRIPT_CREDENTIAL, 1_000_000),
+            make_tx_out(OWN_SCRIPT_CREDENTIAL, 2_000_000),
+        ]
+    )
+    with pytest.raises(AssertionError):
+        hinted_lovelace_locked_in_script(OWN_SCRIPT_CREDENTIAL, tx_info, [1, 0])
+
+
+@pytest.mark.parametrize("hints", [[], [1], [0]])
+def test_unhinted_output_fails(hints: List[int]):
+    # locking lovelace in an unhinted output would not mint uADA for it
+    tx_info = make_tx_info(
+        [
+            make_tx_out(OWN_SCRIPT_CREDENTIAL, 1_000_000),
+            make_tx_out(OWN_SCRIPT_CREDENTIAL, 2_000_000),
+        ]
+    )
+    with pytest.raises((AssertionError, IndexError)):
+        hinted_lovelace_locked_in_script(OWN_SCRIPT_CREDENTIAL, tx_info, hints)
+
+
+@given(
+    owners=st.lists(
+        st.sampled_from([OWN_SCRIPT_CREDENTIAL, PubKeyCredential(b"")]),
+        min_size=1,
+        max_size=10,
+    ),
+    data=st.data(),
+)
+def test_incomplete_hints_fail(owners: List[PubKeyCredential], data):
+    tx_info = make_tx_info(
+        [make_tx_out(owner, 1_000_000 + i) for i, owner in enumerate(owners)]
+    )
+    hints = [i for i, owner in enumerate(owners) if owner == OWN_SCRIPT_CREDENTIAL]
+    other_hints = data.draw(
+        st.lists(st.integers(0, len(owners) - 1), unique=True).map(sorted)
+    )
+    if other_hints == hints:
+        return
+    with pytest.raises((AssertionError, IndexError)):
+        hinted_lovelace_locked_in_script(OWN_SCRIPT_CREDENTIAL, tx_info, other_hints)
+
+
+def test_unhinted_output_fails_in_contract():
+    uada_script, _ = source_contract("uada")
+    datum, redeemer, context = benchmark.script_context("rewarding", hinted=True)
+    evaluate_script(uada_script, datum, redeemer, context)
+    # the position output is no longer hinted
+    redeemer.script_output_indices = []
+    with pytest.raises(RuntimeError):
+        evaluate_script(uada_script, datum, redeemer, context)
@@ -0,0 +1,26 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from uada.benchmark_util import HELPERS, helper_costs, merge_crossover
+from uada.onchain.util import VALUE_MERGE_THRESHOLD
+
+# regenerate with python3 -m uada.benchmark_util --output test/onchain/util_budget.json
+baseline = json.loads(Path(__file__).parent.joinpath("util_budget.json").read_text())
+
+
+def test_all_helpers_tracked():
+    assert set(baseline) == set(HELPERS)
+
+
+@pytest.mark.parametrize("name", HELPERS)
+def test_helper_budget_not_increased(name: str):
+    # also asserts that the compiled helper computes the same as in Python
+    costs = helper_costs(name)
+    assert costs["cpu"] <= baseline[name]["cpu"], f"cpu of {name} increased"
+    assert costs["mem"] <= baseline[name]["mem"], f"mem of {name} increased"
+
+
+def test_value_merge_threshold():
+    assert merge_crossover(max_policies=VALUE_MERGE_THRESHOLD) == VALUE_MERGE_THRESHOLD
@@ -0,0 +1,117 @@
+from hypothesis import given, strategies as st
+
+from uada.onchain.util import *
+from uada.onchain.util import (
+    _add_value_unsorted,
+    _subtract_value_unsorted,
+    _merge_values,
+    _value_ascending,
+)
+
+policy_ids = st.sampled_from([b""] + [bytes([i]) * 28 for i in range(1, 6)])
+token_names = st.sampled_from([b"", b"a", b"ab", b"b", b"token"])
+token_maps = st.dictionaries(token_names, st.integers(-100, 100), min_size=1)
+values = st.dictionaries(policy_ids, token_maps)
+
+
+def sort_value(v: Value) -> Value:
+    return {pid: dict(sorted(v[pid].items())) for pid in sorted(v)}
+
+
+def reference_combine(a: Value, b: Value, sign: int) -> Value:
+    return {
+        pid: {
+            tn: a.get(pid, {}).get(tn, 0) + sign * b.get(pid, {}).get(tn, 0)
+            for tn in {**a.get(pid, {}), **b.get(pid, {})}
+        }
+        for pid in {**a, **b}
+    }
+
+
+def is_sorted(v: Value) -> bool:
+    return list(v) == sorted(v) and all(list(t) == sorted(t) for t in v.values())
+
+
+def tx_out(v: Value) -> TxOut:
+    return TxOut(
+        Address(PubKeyCredential(b""), NoStakingCredential()),
+        v,
+        NoOutputDatum(),
+        NoScriptHash(),
+    )
+
+
+@given(a=values, b=values, sort=st.booleans())
+def test_add_value(a: Value, b: Value, sort: bool):
+    if sort:
+        a, b = sort_value(a), sort_value(b)
+    assert add_value(a, b) == reference_combine(a, b, 1)
+
+
+@given(a=values, b=values, sort=st.booleans())
+def test_subtract_value(a: Value, b: Value, sort: bool):
+    if sort:
+        a, b = sort_value(a), sort_value(b)
+    assert subtract_value(a, b) == reference_combine(a, b, -1)
+
+
+@given(vs=st.lists(values, max_size=5), sort=st.booleans())
+def test_total_value(vs: List[Value], sort: bool):
+    if sort:
+        vs = [sort_value(v) for v in vs]
+    expected = {}
+    for v in vs:
+        expected = reference_combine(expected, v, 1)
+    assert total_value([tx_out(v) for v in vs]) == expected
+
+
+@given(a=values, b=values)
+def test_merge_matches_quadratic(a: Value, b: Value):
+    a, b = sort_value(a), sort_value(b)
+    assert _merge_values(a, b, 1) == _add_value_unsorted(a, b)
+    assert _merge_values(a, b, -1) == _subtract_value_unsorted(a, b)
+
+
+@given(a=values, b=values, sign=st.sampled_from([1, -1]))
+def test_merge_values(a: Value, b: Value, sign: int):
+    a, b = sort_value(a), sort_value(b)
+    res = _merge_values(a, b, sign)
+    assert res == reference_combine(a, b, sign)
+    assert is_sorted(res)
+
+
+@given(v=values)
+def test_value_ascending(v: Value):
+    assert _value_ascending(v) == is_sorted(v)
+
+
+def large_value(policies: int, offset: int = 0) -> Value:
+    return sort_value(
+        {
+            bytes([i % 256, i // 256]) * 14: {b"": i, b"a": 1}
+            for i in range(offset, offset + policies)
+        }
+    )
+
+
+def test_merge_without_duplicates_dict_keys():
+    # the value helpers pass the keys of their dicts, which are views in Python
+    a, b = {b"a": 1, b"b": 1}, {b"b": 2, b"c": 2}
+    assert merge_without_duplicates(a.keys(), b.keys()) == [b"a", b"b", b"c"]
+
+
+def test_add_value_large():
+    a, b = large_value(VALUE_MERGE_THRESHOLD), large_value(VALUE_MERGE_THRESHOLD, 10)
+    assert add_value(a, b) == reference_combine(a, b, 1)
+    assert subtract_value(a, b) == reference_combine(a, b, -1)
+    assert is_sorted(add_value(a, b))
+
+
+def test_total_value_large():
+    vs = [large_value(VALUE_MERGE_THRESHOLD // 2, 10 * i) for i in range(3)]
+    expected = {}
+    for v in vs:
+        expected = reference_combine(expected, v, 1)
+    res = total_value([tx_out(v) for v in vs])
+    assert res == expected
+    assert is_sorted(res)
@@ -0,0 +1,91 @@
+import pytest
+
+from opshin.prelude import Minting, Rewarding, Spending
+
+from uada import autotune
+from uada.build import source_contract
+from uada.onchain import one_shot_nft
+from uada.onchain.uada import HintedContractInteractionRedeemer
+
+CONTRACT = """
+from opshin.prelude import *
+
+
+def validator(redeemer: int, context: ScriptContext) -> None:
+    assert redeemer * 2 + 1 == 7, "Wrong redeemer"
+"""
+
+
+@pytest.fixture
+def contract(tmp_path):
+    script = tmp_path / "contract.py"
+    script.write_text(CONTRACT)
+    return script
+
+
+def test_score_variants(contract):
+    scores = autotune.score_variants(
+        contract, [[(3, 0), (3, 1)]], plutonomy_option_sets=(None,)
+    )
+    assert len(scores) == len(autotune.OPSHIN_OPTION_SETS)
+    assert all("error" not in s for s in scores)
+    assert [s["fee"] for s in scores] == sorted(s["fee"] for s in scores)
+    best = autotune.best_variant(scores)
+    # the execution units of both runs add up, the reference script fee is paid once by their transaction
+    assert best["fee"] == autotune.script_fee(
+        best["size"],
+        [autotune.pycardano.ExecutionUnits(best["mem"], best["cpu"])],
+    )
+    (separate,) = [
+        s
+        for s in autotune.score_variants(
+            contract, [[(3, 0)], [(3, 1)]], plutonomy_option_sets=(None,)
+        )
+        if s["cli_options"] == best["cli_options"]
+    ]
+    assert (separate["cpu"], separate["mem"]) == (best["cpu"], best["mem"])
+    assert (
+        separate["fee"] - best["fee"] == autotune.REF_SCRIPT_FEE_PER_BYTE * best["size"]
+    )
+
+
+def test_reference_script_fee_per_transaction():
+    ex_units = autotune.pycardano.ExecutionUnits(10_000, 5_000_000)
+    nothing = autotune.pycardano.ExecutionUnits(0, 0)
+    assert (
+        autotune.script_fee(1000, [ex_units, nothing])
+        - autotune.script_fee(1000, [ex_units])
+        == autotune.REF_SCRIPT_FEE_PER_BYTE * 1000
+    )
+
+
+def test_failing_variants_rejected(contract):
+    scores = autotune.score_variants(
+        contract, [[(3, 0)], [(4, 0)]], plutonomy_option_sets=(None,)
+    )
+    assert all("error" in s for s in scores)
+    with pytest.raises(ValueError):
+        autotune.best_variant(scores)
+
+
+def test_one_shot_nft_transactions():
+    scores = autotune.score_variants(
+        one_shot_nft.__file__,
+        autotune.one_shot_nft_transactions(),
+        opshin_option_sets=(("--cf",),),
+        plutonomy_option_sets=(None,),
+    )
+    assert "error" not in autotune.best_variant(scores)
+
+
+def test_uada_transactions():
+    # minting and rewarding when minting, spending, minting and rewarding when withdrawing
+    mint, withdraw = autotune.uada_transactions()
+    assert [type(c.purpose) for _, _, c in mint] == [Minting, Rewarding]
+    assert [type(c.purpose) for _, _, c in withdraw] == [Spending, Minting, Rewarding]
+    # the off-chain code only uses the hinted redeemer
+    assert isinstance(mint[-1][1], HintedContractInteractionRedeemer)
+    assert isinstance(withdraw[-1][1], HintedContractInteractionRedeemer)
+    uada_script, _ = source_contract("uada")
+    for transaction in (mint, withdraw):
+        autotune.transaction_ex_units(uada_script, transaction)
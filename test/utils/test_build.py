@@ -0,0 +1,261 @@
+import datetime
+import json
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pycardano
+import pytest
+from uplc.ast import PlutusByteString, PlutusInteger, plutus_cbor_dumps
+
+from uada import autotune, build
+from uada.utils import contracts
+from uada.utils.evaluate import run_script
+
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, "build_dir", tmp_path)
+    monkeypatch.setattr(contracts, "build_dir", tmp_path)
+    return tmp_path
+
+
+class FakeBuild:
+    """
+    Writes a distinct script for every contract and records which builds overlap
+    """
+
+    def __init__(self, build_dir, fail=()):
+        self.build_dir = build_dir
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.running = set()
+        self.overlapping = set()
+        self.calls = []
+
+    def __call__(self, type, script, cli_options=(), args=()):
+        with self.lock:
+            self.calls.append((script, list(args)))
+            self.overlapping.update(frozenset((script, s)) for s in self.running)
+            self.running.add(script)
+        time.sleep(0.05)
+        with self.lock:
+            self.running.remove(script)
+        if script in self.fail:
+            raise RuntimeError(f"opshin failed for {script}")
+        out = self.build_dir / f"{script}_compressed"
+        out.mkdir(exist_ok=True)
+        # a CBOR byte string, distinct for each contract
+        out.joinpath("script.cbor").write_text("41" + script.encode().hex()[:2])
+        return {"args": list(args)}
+
+
+CONTRACTS = {
+    "a": build.ContractBuild("minting", "a"),
+    "b": build.ContractBuild("minting", "b"),
+    "c": build.ContractBuild(
+        "any",
+        "c",
+        dependencies=["b"],
+        args=lambda policy_ids: [policy_ids["b"].payload.hex()],
+    ),
+}
+
+
+def test_independent_contracts_built_concurrently(build_dir):
+    fake = FakeBuild(build_dir)
+    parameters = build.build_all(CONTRACTS, fake, ThreadPoolExecutor(3))
+    assert fake.overlapping == {frozenset(("a", "b"))}
+    # the dependent contract is built with the policy id of its dependency
+    assert parameters["c"] == {"args": [build.built_policy_id("b").payload.hex()]}
+    assert [script for script, _ in fake.calls][-1] == "c"
+
+
+def test_failed_build_fails(build_dir):
+    fake = FakeBuild(build_dir, fail=("b",))
+    with pytest.raises(RuntimeError, match="opshin failed"):
+        build.build_all(CONTRACTS, fake, ThreadPoolExecutor(3))
+    # nothing depending on the failed contract is built
+    assert "c" not in [script for script, _ in fake.calls]
+
+
+def test_unresolvable_dependencies(build_dir):
+    fake = FakeBuild(build_dir)
+    with pytest.raises(ValueError, match="Unresolvable"):
+        build.build_all(
+            {"c": build.ContractBuild("any", "c", dependencies=["missing"])},
+            fake,
+            ThreadPoolExecutor(1),
+        )
+
+
+@pytest.fixture
+def contract(tmp_path):
+    script = tmp_path / "contract.py"
+    script.write_text("from uada.onchain.util import *\n")
+    return script
+
+
+def test_build_cache(build_dir, contract, monkeypatch):
+    fake = FakeBuild(build_dir)
+
+    def build_compressed(type, script, cli_options=(), args=()):
+        fake(type, Path(script).stem, cli_options, args)
+        build_dir.joinpath("contract").mkdir(exist_ok=True)
+        return {"args": list(args)}
+
+    monkeypatch.setattr(build, "build_compressed", build_compressed)
+    parameters = build.cached_build("minting", contract, args=["01"])
+    built = (build_dir / "contract_compressed" / "script.cbor").read_text()
+
+    # restored from the cache, without building
+    shutil.rmtree(build_dir / "contract_compressed")
+    assert build.cached_build("minting", contract, args=["01"]) == parameters
+    assert (build_dir / "contract_compressed" / "script.cbor").read_text() == built
+    assert len(fake.calls) == 1
+
+    # other parameters are built again
+    assert build.cached_build("minting", contract, args=["02"]) != parameters
+    assert len(fake.calls) == 2
+
+
+def test_build_key(contract):
+    sources = build.onchain_sources(contract)
+    assert [s.name for s in sources] == ["contract.py", "util.py", "ext_interval.py"]
+    key = build.build_key("minting", contract)
+    assert build.build_key("minting", contract) == key
+    assert build.build_key("minting", contract, args=["01"]) != key
+    assert build.build_key("any", contract) != key
+    contract.write_text("from uada.onchain.util import *\n\n")
+    assert build.build_key("minting", contract) != key
+
+
+PARAMETERIZED_CONTRACT = """
+from opshin.prelude import *
+
+
+def validator(expected: int, redeemer: int, context: ScriptContext) -> None:
+    assert redeemer == expected, "Unexpected redeemer"
+"""
+
+
+def test_compile_in_process(tmp_path):
+    contract = tmp_path / "contract.py"
+    contract.write_text(PARAMETERIZED_CONTRACT)
+    args = [plutus_cbor_dumps(PlutusInteger(3)).hex()]
+    script, script_hash = build.compile_contract(contract, args=args)
+    assert script_hash == pycardano.plutus_script_hash(script)
+    run_script(script, 3, 0)
+    with pytest.raises(RuntimeError):
+        run_script(script, 4, 0)
+
+    # the same script as built by the opshin command line
+    subprocess.run(
+        [sys.executable, "-m", "opshin", "--cf", "build", "minting", contract, *args]
+        + ["-o", tmp_path / "cli"],
+        check=True,
+        capture_output=True,
+    )
+    assert script.hex() == (tmp_path / "cli" / "script.cbor").read_text()
+    artifacts = build.contract_artifacts("minting", contract, args=args)
+    assert artifacts(build.compile_uplc(contract, args=args)).contract == script
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["plain", "compressed"])
+@pytest.mark.parametrize("name", build.SOURCES)
+def test_build_matches_sources(name: str, compressed: bool):
+    # the benchmarks measure the sources, the off-chain code uses the build
+    if name not in contracts.load_manifest():
+        pytest.skip("build/ predates the manifest and is rebuilt with plutonomy-cli")
+    if compressed and not build.compiles_compressed(name):
+        pytest.skip("plutonomy-cli is not installed")
+    script, _, _ = contracts.get_contract(name, compressed)
+    assert (
+        build.source_contract(name, compressed)[0] == script
+    ), "build/ is out of date, python3 -m uada.build"
+
+
+def test_latest_mint_time_kept(build_dir, monkeypatch):
+    deadline = datetime.datetime(2024, 3, 30, 9, 53, 27)
+    build_dir.joinpath(contracts.MANIFEST_NAME).write_text(
+        json.dumps(
+            {
+                "parameter_auth_nft": {
+                    "parameters": {
+                        "args": [
+                            plutus_cbor_dumps(PlutusByteString(b"\x01" * 28)).hex(),
+                            plutus_cbor_dumps(
+                                PlutusInteger(int(deadline.timestamp()) * 1000)
+                            ).hex(),
+                        ]
+                    }
+                }
+            }
+        )
+    )
+    contracts.load_manifest.cache_clear()
+    used = []
+    monkeypatch.setattr(
+        build,
+        "contract_builds",
+        lambda admin_wallet, latest_mint_time: used.append(latest_mint_time) or {},
+    )
+    monkeypatch.setattr(build, "build_all", lambda builds, build_compressed: {})
+    monkeypatch.setattr(build, "write_manifest", lambda parameters: None)
+    # the deadline of the previous build is part of the cache key and must not move
+    build.main()
+    assert used == [deadline]
+    # without a previous build, the deadline is 30 days from now
+    contracts.load_manifest.cache_clear()
+    build.main()
+    assert used[1] - datetime.datetime.now() > datetime.timedelta(days=29)
+    contracts.load_manifest.cache_clear()
+
+
+def test_latest_mint_time_without_manifest(build_dir):
+    # build/ of the deployed contracts predates the manifest
+    shutil.copytree(
+        Path(build.__file__).parent.parent / "build" / "parameter_auth_nft",
+        build_dir / "parameter_auth_nft",
+    )
+    contracts.load_manifest.cache_clear()
+    assert build.built_latest_mint_time() == datetime.datetime.fromtimestamp(
+        1711788807000 / 1000
+    )
+    contracts.load_manifest.cache_clear()
+
+
+def test_autotune_kept(build_dir, monkeypatch):
+    tuned = []
+    monkeypatch.setattr(autotune, "main", lambda: tuned.append(True))
+    monkeypatch.setattr(build, "contract_builds", lambda *args: {})
+    monkeypatch.setattr(build, "build_all", lambda builds, build_compressed: {})
+    monkeypatch.setattr(build, "write_manifest", lambda parameters: None)
+
+    def previous_build(compressed_variant: bool):
+        parameters = {"args": []}
+        if compressed_variant:
+            parameters["compressed_variant"] = {
+                "cli_options": ["--cf"],
+                "plutonomy_options": None,
+            }
+        build_dir.joinpath(contracts.MANIFEST_NAME).write_text(
+            json.dumps({"uada_compressed": {"parameters": parameters}})
+        )
+        contracts.load_manifest.cache_clear()
+
+    # the cache restores the plain compressed build, which replaces the tuned one only if asked to
+    previous_build(True)
+    build.main()
+    assert tuned == [True]
+    previous_build(True)
+    build.main(autotune=False)
+    assert tuned == [True]
+    previous_build(False)
+    build.main()
+    assert tuned == [True]
+    contracts.load_manifest.cache_clear()
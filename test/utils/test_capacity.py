@@ -0,0 +1,90 @@
+import dataclasses
+
+import pytest
+
+from uada import capacity
+from uada.offchain.coin_selection import max_selected_inputs
+from uada.offchain.util import HintingTransactionBuilder
+from uada.utils.emulator import PROTOCOL_PARAMETERS
+
+from ..offchain.test_mint_uada_batch import requires_withdrawal_scripts
+
+
+@pytest.fixture(scope="module")
+def contracts():
+    return capacity.Contracts.from_sources()
+
+
+def test_planner_smoke(contracts, monkeypatch):
+    # the uADA withdrawal script is left out, so this runs with the released pycardano
+    monkeypatch.setattr(
+        HintingTransactionBuilder,
+        "add_withdrawal_script",
+        lambda self, script, redeemer=None: self,
+        raising=False,
+    )
+    for operation in capacity.OPERATIONS:
+        used = capacity.usage(operation, contracts)
+        assert capacity.exceeded_limit(used, PROTOCOL_PARAMETERS) is None
+        larger = capacity.usage(operation, contracts, inputs=3, outputs=3)
+        assert larger["size"] > used["size"]
+    protocol_param = dataclasses.replace(
+        PROTOCOL_PARAMETERS,
+        max_tx_size=capacity.usage("mint", contracts, outputs=3)["size"],
+    )
+    assert capacity.max_dimension("mint", "outputs", contracts, protocol_param) == (
+        3,
+        "size",
+    )
+
+
+@requires_withdrawal_scripts
+@pytest.mark.parametrize("operation", capacity.OPERATIONS)
+def test_operations_succeed(contracts, operation: str):
+    used = capacity.usage(operation, contracts)
+    assert capacity.exceeded_limit(used, PROTOCOL_PARAMETERS) is None
+    larger = capacity.usage(operation, contracts, inputs=3, outputs=3)
+    assert all(larger[k] > used[k] for k in used)
+
+
+@requires_withdrawal_scripts
+def test_attached_scripts_count_towards_size(contracts):
+    referenced = capacity.usage("mint", contracts)
+    attached = capacity.usage("mint", contracts, reference_scripts=False)
+    assert attached["size"] > referenced["size"] + len(contracts.uada)
+
+
+@requires_withdrawal_scripts
+def test_max_positions_by_mem(contracts):
+    protocol_param = dataclasses.replace(
+        PROTOCOL_PARAMETERS,
+        max_tx_ex_mem=capacity.usage("withdraw", contracts, positions=3)["mem"],
+    )
+    assert capacity.max_dimension(
+        "withdraw", "positions", contracts, protocol_param
+    ) == (3, "mem")
+
+
+@requires_withdrawal_scripts
+def test_max_outputs_by_size(contracts):
+    protocol_param = dataclasses.replace(
+        PROTOCOL_PARAMETERS,
+        max_tx_size=capacity.usage("extend", contracts, outputs=5)["size"],
+    )
+    assert capacity.max_dimension("extend", "outputs", contracts, protocol_param) == (
+        5,
+        "size",
+    )
+    too_small = dataclasses.replace(PROTOCOL_PARAMETERS, max_tx_size=100)
+    assert capacity.max_dimension("extend", "outputs", contracts, too_small) == (
+        0,
+        "size",
+    )
+
+
+@requires_withdrawal_scripts
+def test_max_inputs_by_selection(contracts):
+    assert capacity.max_dimension("mint", "inputs", contracts) == (
+        max_selected_inputs,
+        "selection",
+    )
@@ -0,0 +1,223 @@
+import json
+from typing import Dict, List, Union
+
+import pycardano
+import pytest
+
+from uada.indexer.models import IndexedUtxo
+from uada.utils import chaining
+from uada.utils.chaining import ChainingContext, ogmios_utxo_json
+
+NETWORK = pycardano.Network.TESTNET
+WALLET = pycardano.Address(pycardano.VerificationKeyHash(b"\x01" * 28), network=NETWORK)
+OTHER = pycardano.Address(pycardano.VerificationKeyHash(b"\x02" * 28), network=NETWORK)
+SCRIPT = pycardano.PlutusV2Script(b"\x41\x01")
+
+
+def tx_spending(
+    inputs: List[pycardano.TransactionInput],
+    outputs: List[pycardano.TransactionOutput],
+    reference_inputs: List[pycardano.TransactionInput] = (),
+) -> pycardano.Transaction:
+    return pycardano.Transaction(
+        pycardano.TransactionBody(
+            inputs=list(inputs),
+            outputs=outputs,
+            fee=200_000,
+            reference_inputs=list(reference_inputs) or None,
+        ),
+        pycardano.TransactionWitnessSet(),
+    )
+
+
+class FakeContext:
+    def __init__(self):
+        self.utxos_at: Dict[str, List[pycardano.UTxO]] = {
+            str(WALLET): [
+                pycardano.UTxO(
+                    pycardano.TransactionInput.from_primitive(["00" * 32, 0]),
+                    pycardano.TransactionOutput(WALLET, 100_000_000),
+                )
+            ]
+        }
+        self.submitted = []
+        self.evaluated = []
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        return self.utxos_at.get(str(address), [])
+
+    def submit_tx(self, tx: pycardano.Transaction):
+        self.submitted.append(tx)
+
+    def evaluate_tx(self, tx: pycardano.Transaction):
+        self.evaluated.append(tx)
+        return {}
+
+
+def test_chained_transactions():
+    chain = FakeContext()
+    evaluated_with = []
+    context = ChainingContext(
+        chain, evaluate=lambda tx, utxos: evaluated_with.append(utxos) or {}
+    )
+    (funds,) = context.utxos(WALLET)
+
+    # the first transaction pays another address and returns change with a reference script
+    tx1 = tx_spending(
+        [funds.input],
+        [
+            pycardano.TransactionOutput(OTHER, 10_000_000),
+            pycardano.TransactionOutput(WALLET, 89_000_000, script=SCRIPT),
+        ],
+    )
+    context.submit_tx(tx1)
+    (change,) = context.utxos(WALLET)
+    assert change.input == pycardano.TransactionInput(tx1.id, 1)
+    assert change.output.script == SCRIPT
+    (paid,) = context.utxos(OTHER)
+    assert paid.input == pycardano.TransactionInput(tx1.id, 0)
+
+    # the second transaction spends the unconfirmed change and references its script
+    tx2 = tx_spending(
+        [paid.input],
+        [pycardano.TransactionOutput(OTHER, 9_000_000)],
+        reference_inputs=[change.input],
+    )
+    context.evaluate_tx(tx2)
+    assert evaluated_with == [[paid, change]]
+    context.submit_tx(tx2)
+    assert [u.input.transaction_id for u in context.utxos(OTHER)] == [tx2.id]
+    assert chain.submitted == [tx1, tx2]
+
+    # transactions spending only confirmed UTxOs are evaluated by the chain context
+    context.evaluate_tx(tx_spending([funds.input], []))
+    assert len(chain.evaluated) == 1
+
+    # the first transaction is confirmed once its outputs are on chain
+    chain.utxos_at[str(WALLET)] = [change]
+    assert context.utxos(WALLET) == [change]
+    assert list(context.pending) == [tx2.id]
+
+    # the second one once chain-sync reports it
+    context.roll_forward([{"id": str(tx2.id), "inputs": []}])
+    assert context.pending == {}
+
+
+def test_conflicting_pending_dropped():
+    chain = FakeContext()
+    context = ChainingContext(chain)
+    (funds,) = context.utxos(WALLET)
+    context.submit_tx(
+        tx_spending([funds.input], [pycardano.TransactionOutput(WALLET, 99_000_000)])
+    )
+    context.roll_forward(
+        [
+            {
+                "id": "11" * 32,
+                "inputs": [{"transaction": {"id": "00" * 32}, "index": 0}],
+            }
+        ]
+    )
+    assert context.pending == {}
+
+
+def test_ogmios_utxo_json():
+    datum = pycardano.RawCBOR(bytes.fromhex("d87980"))
+    utxo = pycardano.UTxO(
+        pycardano.TransactionInput.from_primitive(["ab" * 32, 3]),
+        pycardano.TransactionOutput(
+            WALLET,
+            pycardano.Value(
+                2_000_000,
+                pycardano.MultiAsset.from_primitive({b"\x03" * 28: {b"uADA": 5}}),
+            ),
+            datum=datum,
+            script=SCRIPT,
+        ),
+    )
+    output = ogmios_utxo_json(utxo)
+    assert output["datum"] == "d87980"
+    assert output["script"]["language"] == "plutus:v2"
+    # the indexer reads back the same UTxO
+    indexed = IndexedUtxo(
+        tx_id="ab" * 32, index=3, address=str(WALLET), output=json.dumps(output)
+    )
+    assert indexed.utxo() == utxo
+
+
+class FakeWebSocket:
+    def __init__(self, response: dict):
+        self.response = response
+        self.sent = []
+
+    def send(self, message: str):
+        self.sent.append(json.loads(message))
+
+    def recv(self) -> str:
+        return json.dumps(self.response)
+
+    def close(self):
+        pass
+
+
+def test_evaluator_of_ogmios_version():
+    # pycardano connects to Ogmios v5 only
+    v5 = pycardano.OgmiosChainContext.__new__(pycardano.OgmiosChainContext)
+    assert ChainingContext(v5).evaluate is chaining.evaluate_with_ogmios_v5
+    assert ChainingContext(FakeContext()).evaluate is chaining.evaluate_with_ogmios
+
+
+def test_evaluate_with_ogmios_v5(monkeypatch):
+    ws = FakeWebSocket(
+        {
+            "type": "jsonwsp/response",
+            "result": {
+                "EvaluationResult": {
+                    "spend:0": {"memory": 1, "steps": 2},
+                    "withdrawal:0": {"memory": 3, "steps": 4},
+                }
+            },
+        }
+    )
+    monkeypatch.setattr(chaining.websocket, "create_connection", lambda url: ws)
+    utxo = pycardano.UTxO(
+        pycardano.TransactionInput.from_primitive(["ab" * 32, 3]),
+        pycardano.TransactionOutput(
+            WALLET,
+            pycardano.Value(
+                2_000_000,
+                pycardano.MultiAsset.from_primitive(
+                    {b"\x03" * 28: {b"uADA": 5, b"": 1}}
+                ),
+            ),
+            script=SCRIPT,
+        ),
+    )
+    tx = tx_spending([utxo.input], [])
+    assert chaining.evaluate_with_ogmios_v5(tx, [utxo]) == {
+        "spend:0": pycardano.ExecutionUnits(1, 2),
+        "reward:0": pycardano.ExecutionUnits(3, 4),
+    }
+    (request,) = ws.sent
+    assert request["methodname"] == "EvaluateTx"
+    assert request["args"]["evaluate"] == tx.to_cbor_hex()
+    assert request["args"]["additionalUtxoSet"] == [
+        [
+            {"txId": "ab" * 32, "index": 3},
+            {
+                "address": str(WALLET),
+                "value": {
+                    "coins": 2_000_000,
+                    "assets": {
+                        "03" * 28 + "." + b"uADA".hex(): 5,
+                        "03" * 28: 1,
+                    },
+                },
+                "script": {"plutus:v2": bytes(SCRIPT).hex()},
+            },
+        ]
+    ]
+
+    ws.response = {"result": {"EvaluationFailure": {"ScriptFailures": {}}}}
+    with pytest.raises(pycardano.TransactionFailedException):
+        chaining.evaluate_with_ogmios_v5(tx, [utxo])
@@ -0,0 +1,49 @@
+import json
+import shutil
+
+import pytest
+
+from uada.utils import contracts
+
+CONTRACTS = ["uada", "one_shot_nft", "parameter_auth_nft"]
+
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    shutil.copytree(contracts.build_dir, tmp_path, dirs_exist_ok=True)
+    (tmp_path / contracts.MANIFEST_NAME).unlink(missing_ok=True)
+    monkeypatch.setattr(contracts, "build_dir", tmp_path)
+    contracts.load_manifest.cache_clear()
+    contracts.get_contract.cache_clear()
+    yield tmp_path
+    contracts.load_manifest.cache_clear()
+    contracts.get_contract.cache_clear()
+
+
+def test_manifest_matches_artifacts(build_dir):
+    without_manifest = {
+        (name, compressed): contracts.get_contract(name, compressed)
+        for name in CONTRACTS
+        for compressed in (False, True)
+    }
+    contracts.write_manifest({name: {"args": [name]} for name in CONTRACTS})
+    manifest = json.loads((build_dir / contracts.MANIFEST_NAME).read_text())
+    for (name, compressed), contract in without_manifest.items():
+        assert contracts.get_contract(name, compressed) == contract
+        entry = manifest[f"{name}{'_compressed' if compressed else ''}"]
+        assert entry["size"] == len(contract[0])
+        assert entry["parameters"] == {"args": [name]}
+        with open(build_dir / f"{name}_compressed" / "mainnet.addr") as f:
+            assert manifest[f"{name}_compressed"]["mainnet_address"] == f.read().strip()
+
+
+def test_manifest_loaded_once(build_dir):
+    contracts.write_manifest({name: {} for name in CONTRACTS})
+    contracts.get_contract("uada", True)
+    # the artifacts are not read again
+    shutil.rmtree(build_dir / "uada_compressed")
+    (build_dir / contracts.MANIFEST_NAME).unlink()
+    assert contracts.get_contract("one_shot_nft", True)[1].payload.hex() == (
+        contracts.load_manifest()["one_shot_nft_compressed"]["policy_id"]
+    )
+    assert contracts.get_contract("uada", True) is contracts.get_contract("uada", True)
@@ -0,0 +1,150 @@
+import copy
+
+import pycardano
+import pytest
+from uplc.tools import flatten, parse
+
+from uada.offchain.util import asset_from_token
+from uada.utils import network
+from uada.utils.emulator import EmulatorChainContext
+from opshin.prelude import Token
+
+SIGNING_KEY = pycardano.PaymentSigningKey.generate()
+WALLET = pycardano.Address(SIGNING_KEY.to_verification_key().hash(), network=network)
+OTHER = pycardano.Address(pycardano.VerificationKeyHash(b"\x01" * 28), network=network)
+
+
+def uplc_script(program: str) -> pycardano.PlutusV2Script:
+    return pycardano.PlutusV2Script(flatten(parse(program)))
+
+
+ALWAYS_SUCCEEDS = uplc_script("(program 1.0.0 (lam d (lam r (lam c (con unit ())))))")
+ALWAYS_FAILS = uplc_script("(program 1.0.0 (lam d (lam r (lam c (error)))))")
+# minting policies are passed the redeemer and the script context only
+MINT_SUCCEEDS = uplc_script("(program 1.0.0 (lam r (lam c (con unit ()))))")
+
+
+@pytest.fixture
+def emulator():
+    context = EmulatorChainContext(network=network)
+    for _ in range(3):
+        context.add_utxo(pycardano.TransactionOutput(WALLET, 100_000_000))
+    return context
+
+
+def mint_tx(context: EmulatorChainContext) -> pycardano.Transaction:
+    policy_id = pycardano.plutus_script_hash(MINT_SUCCEEDS)
+    token = asset_from_token(Token(policy_id.payload, b"token"), 1)
+    builder = pycardano.TransactionBuilder(context)
+    builder.add_input_address(WALLET)
+    builder.add_minting_script(MINT_SUCCEEDS, pycardano.Redeemer(0))
+    builder.mint = token
+    builder.add_output(
+        pycardano.TransactionOutput(OTHER, pycardano.Value(2_000_000, token))
+    )
+    return builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+
+
+def lock_tx(
+    context: EmulatorChainContext, script: pycardano.PlutusV2Script
+) -> pycardano.Transaction:
+    builder = pycardano.TransactionBuilder(context)
+    builder.add_input_address(WALLET)
+    builder.add_output(
+        pycardano.TransactionOutput(
+            pycardano.Address(pycardano.plutus_script_hash(script), network=network),
+            10_000_000,
+            datum=42,
+        )
+    )
+    return builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+
+
+def unlock_tx(
+    context: EmulatorChainContext, script: pycardano.PlutusV2Script
+) -> pycardano.Transaction:
+    (locked,) = context.utxos(
+        pycardano.Address(pycardano.plutus_script_hash(script), network=network)
+    )
+    builder = pycardano.TransactionBuilder(context)
+    builder.add_script_input(locked, script, None, pycardano.Redeemer(0))
+    builder.add_input_address(WALLET)
+    return builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+
+
+def test_mint_with_contract(emulator):
+    tx = mint_tx(emulator)
+    assert emulator.submit_tx(tx) == tx.id
+    assert emulator.slot == 1
+    assert emulator.transactions == [tx]
+    (paid,) = emulator.utxos(OTHER)
+    assert paid.input == pycardano.TransactionInput(tx.id, 0)
+    assert pycardano.TransactionInput(tx.id, 1) in [
+        u.input for u in emulator.utxos(WALLET)
+    ]
+    for i in tx.transaction_body.inputs:
+        assert i not in emulator.ledger
+
+
+def test_spend_from_contract(emulator):
+    emulator.submit_tx(lock_tx(emulator, ALWAYS_SUCCEEDS))
+    tx = unlock_tx(emulator, ALWAYS_SUCCEEDS)
+    assert list(emulator.evaluate_tx(tx)) == ["spend:0"]
+    emulator.submit_tx(tx)
+    assert sum(u.output.amount.coin for u in emulator.utxos(WALLET)) == (
+        300_000_000 - sum(t.transaction_body.fee for t in emulator.transactions)
+    )
+
+
+def test_rejects_failing_contract(emulator):
+    emulator.submit_tx(lock_tx(emulator, ALWAYS_FAILS))
+    with pytest.raises(pycardano.TransactionFailedException, match="failed"):
+        unlock_tx(emulator, ALWAYS_FAILS)
+
+
+def test_rejects_invalid(emulator):
+    tx = mint_tx(emulator)
+    witnesses = tx.transaction_witness_set
+    unsigned = pycardano.Transaction(
+        tx.transaction_body,
+        pycardano.TransactionWitnessSet(
+            redeemer=witnesses.redeemer,
+            plutus_v2_script=witnesses.plutus_v2_script,
+        ),
+    )
+    with pytest.raises(pycardano.TransactionFailedException, match="signatures"):
+        emulator.submit_tx(unsigned)
+    # the budget of the redeemer is below the evaluated execution units
+    over_budget = copy.deepcopy(tx)
+    for r in over_budget.transaction_witness_set.redeemer:
+        r.ex_units = pycardano.ExecutionUnits(1, 1)
+    with pytest.raises(pycardano.TransactionFailedException, match="budget"):
+        emulator.submit_tx(over_budget)
+    # nothing was applied
+    assert len(emulator.utxos(WALLET)) == 3
+    assert emulator.transactions == []
+
+    emulator.submit_tx(tx)
+    with pytest.raises(pycardano.TransactionFailedException, match="spent"):
+        emulator.submit_tx(tx)
+
+
+def test_rejects_unbalanced(emulator):
+    (utxo, *_) = emulator.utxos(WALLET)
+    body = pycardano.TransactionBody(
+        inputs=[utxo.input],
+        outputs=[pycardano.TransactionOutput(OTHER, 100_000_000)],
+        fee=200_000,
+    )
+    tx = pycardano.Transaction(
+        body,
+        pycardano.TransactionWitnessSet(
+            vkey_witnesses=[
+                pycardano.VerificationKeyWitness(
+                    SIGNING_KEY.to_verification_key(), SIGNING_KEY.sign(body.hash())
+                )
+            ]
+        ),
+    )
+    with pytest.raises(pycardano.TransactionFailedException, match="not preserved"):
+        emulator.submit_tx(tx)
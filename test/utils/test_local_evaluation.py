@@ -0,0 +1,144 @@
+import pycardano
+import pytest
+
+from uada.offchain.util import asset_from_token
+from uada.utils import network
+from uada.utils.emulator import EmulatorChainContext
+from uada.utils.local_evaluation import (
+    MARGIN,
+    LocalEvaluationContext,
+    shape_key,
+    with_margin,
+)
+from opshin.prelude import Token
+
+from .test_emulator import (
+    ALWAYS_FAILS,
+    MINT_SUCCEEDS,
+    OTHER,
+    SIGNING_KEY,
+    WALLET,
+    lock_tx,
+    mint_tx,
+    uplc_script,
+)
+
+
+@pytest.fixture
+def emulator():
+    context = EmulatorChainContext(network=network)
+    for _ in range(6):
+        context.add_utxo(pycardano.TransactionOutput(WALLET, 100_000_000))
+    context.evaluated = []
+    evaluate_tx = context.evaluate_tx
+
+    def counting_evaluate_tx(tx):
+        context.evaluated.append(tx)
+        return evaluate_tx(tx)
+
+    context.evaluate_tx = counting_evaluate_tx
+    return context
+
+
+def test_evaluated_locally(emulator):
+    context = LocalEvaluationContext(emulator)
+    tx = mint_tx(context)
+    assert emulator.evaluated == []
+    assert (context.hits, context.misses) == (0, 1)
+    (redeemer,) = tx.transaction_witness_set.redeemer
+    # the execution units the emulator evaluates, plus the margin and the buffer of pycardano
+    (expected,) = with_margin(emulator.evaluate_tx(tx), MARGIN).values()
+    assert redeemer.ex_units.mem == int(expected.mem * 1.2)
+    assert redeemer.ex_units.steps == int(expected.steps * 1.2)
+    emulator.submit_tx(tx)
+
+
+def test_same_shape_cached(emulator):
+    context = LocalEvaluationContext(emulator, margin=0.1)
+    first = mint_tx(context)
+    emulator.submit_tx(first)
+    second = mint_tx(context)
+    assert shape_key(second) == shape_key(first)
+    assert (context.hits, context.misses) == (1, 1)
+    assert emulator.evaluated == [first]
+    (evaluated,) = emulator.evaluate_tx(second).values()
+    (redeemer,) = second.transaction_witness_set.redeemer
+    assert redeemer.ex_units.mem >= int(evaluated.mem * 1.1 * 1.2)
+    assert redeemer.ex_units.steps >= int(evaluated.steps * 1.1 * 1.2)
+    # the margin is added whether the execution units were evaluated or cached
+    assert redeemer.ex_units == first.transaction_witness_set.redeemer[0].ex_units
+    emulator.submit_tx(second)
+
+
+def test_other_shape_evaluated(emulator):
+    context = LocalEvaluationContext(emulator)
+    emulator.submit_tx(mint_tx(context))
+    policy_id = pycardano.plutus_script_hash(MINT_SUCCEEDS)
+    token = asset_from_token(Token(policy_id.payload, b"token"), 1)
+    builder = pycardano.TransactionBuilder(context)
+    builder.add_input_address(WALLET)
+    builder.add_minting_script(MINT_SUCCEEDS, pycardano.Redeemer(1))
+    builder.mint = token
+    builder.add_output(
+        pycardano.TransactionOutput(OTHER, pycardano.Value(2_000_000, token))
+    )
+    builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+    assert (context.hits, context.misses) == (0, 2)
+
+
+def test_unknown_inputs_evaluated_by_context(emulator):
+    context = LocalEvaluationContext(emulator)
+    # the wallet UTxOs were not handed out by the local context
+    tx = mint_tx(emulator)
+    emulator.evaluated.clear()
+    assert context.evaluate_tx(tx) == with_margin(emulator.evaluate_tx(tx), MARGIN)
+    assert len(emulator.evaluated) == 2
+
+
+def test_failing_script_not_cached(emulator):
+    context = LocalEvaluationContext(emulator)
+    emulator.submit_tx(lock_tx(context, ALWAYS_FAILS))
+    (locked,) = context.utxos(
+        pycardano.Address(pycardano.plutus_script_hash(ALWAYS_FAILS), network=network)
+    )
+    builder = pycardano.TransactionBuilder(context)
+    builder.add_script_input(locked, ALWAYS_FAILS, None, pycardano.Redeemer(0))
+    builder.add_input_address(WALLET)
+    with pytest.raises(pycardano.TransactionFailedException, match="failed"):
+        builder.build_and_sign([SIGNING_KEY], change_address=WALLET)
+    assert context.cache == {}
+
+
+def test_cache_bounded(emulator):
+    context = LocalEvaluationContext(emulator, cache_size=2)
+    for i in range(3):
+        script = uplc_script(f"(program 1.0.0 (lam r (lam c (con integer {i}))))")
+        policy_id = pycardano.plutus_script_hash(script)
+        token = asset_from_token(Token(policy_id.payload, b"token"), 1)
+        builder = pycardano.TransactionBuilder(context)
+        builder.add_input_address(WALLET)
+        builder.add_minting_script(script, pycardano.Redeemer(0))
+        builder.mint = token
+        builder.add_output(
+            pycardano.TransactionOutput(OTHER, pycardano.Value(2_000_000, token))
+        )
+        emulator.submit_tx(builder.build_and_sign([SIGNING_KEY], change_address=WALLET))
+    assert len(context.cache) == 2
+    assert context.misses == 3
+
+
+def test_values_of_other_shape_evaluated(emulator):
+    context = LocalEvaluationContext(emulator)
+    emulator.submit_tx(mint_tx(context))
+    # the wallet only holds a UTxO with many tokens, which the scripts see in the input and the change
+    for utxo in emulator.utxos(WALLET):
+        del emulator.ledger[utxo.input]
+    tokens = pycardano.MultiAsset.from_primitive(
+        {bytes([i]) * 28: {b"token": 1} for i in range(20)}
+    )
+    emulator.add_utxo(
+        pycardano.TransactionOutput(WALLET, pycardano.Value(100_000_000, tokens))
+    )
+    tx = mint_tx(context)
+    assert (context.hits, context.misses) == (0, 2)
+    emulator.submit_tx(tx)
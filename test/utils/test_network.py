@@ -0,0 +1,75 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+from uada.utils.network import AsyncChainContext, ChainContextProvider
+
+
+class FakeContext:
+    def utxos(self, address):
+        return [address]
+
+
+def test_connects_on_first_use_only():
+    connections = []
+
+    def connect():
+        connections.append(FakeContext())
+        return connections[-1]
+
+    context = ChainContextProvider(connect)
+    assert connections == []
+    assert context.utxos("addr") == ["addr"]
+    assert context.get() is context.get()
+    assert len(connections) == 1
+
+
+def test_retry_after_failed_connection():
+    results = [None, FakeContext()]
+    context = ChainContextProvider(lambda: results.pop(0))
+    with pytest.raises(ConnectionError):
+        context.utxos("addr")
+    assert context.utxos("addr") == ["addr"]
+
+
+def test_stand_in():
+    context = ChainContextProvider(lambda: pytest.fail("must not connect"))
+    context.set(FakeContext())
+    assert context.utxos("addr") == ["addr"]
+
+
+def test_import_does_not_connect():
+    res = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import uada.build, uada.offchain.mint_uada;"
+            "from uada.utils.network import context;"
+            "assert context._context is None",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert res.returncode == 0, res.stderr
+    assert "No ogmios available" not in res.stdout
+
+
+class SlowContext:
+    def utxos(self, address):
+        time.sleep(0.2)
+        return [address]
+
+
+def test_async_queries_concurrent():
+    async_context = AsyncChainContext(SlowContext(), max_workers=4)
+
+    async def query_all():
+        return await asyncio.gather(*(async_context.utxos(i) for i in range(4)))
+
+    start = time.perf_counter()
+    assert asyncio.run(query_all()) == [[0], [1], [2], [3]]
+    # bounded by the slowest query, not the sum of all of them
+    assert time.perf_counter() - start < 0.6
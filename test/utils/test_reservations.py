@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+import pycardano
+import pytest
+
+from uada.offchain.coin_selection import select_utxos
+from uada.utils.reservations import (
+    ReservingChainContext,
+    UtxoReservations,
+    reservations_of,
+)
+
+ADDRESS = pycardano.Address(
+    pycardano.VerificationKeyHash(b"\x01" * 28), network=pycardano.Network.TESTNET
+)
+
+
+def utxo(index: int, amount: int = 10_000_000) -> pycardano.UTxO:
+    return pycardano.UTxO(
+        pycardano.TransactionInput.from_primitive(["00" * 32, index]),
+        pycardano.TransactionOutput(ADDRESS, amount),
+    )
+
+
+def spending_tx(utxos: List[pycardano.UTxO]) -> pycardano.Transaction:
+    return pycardano.Transaction(
+        pycardano.TransactionBody(
+            inputs=[u.input for u in utxos],
+            outputs=[pycardano.TransactionOutput(ADDRESS, 1_000_000)],
+            fee=200_000,
+        ),
+        pycardano.TransactionWitnessSet(),
+    )
+
+
+class FakeContext:
+    def __init__(self, utxos: List[pycardano.UTxO]):
+        self.utxos_at = utxos
+        self.fail_submit = False
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        return list(self.utxos_at)
+
+    def submit_tx(self, tx: pycardano.Transaction):
+        if self.fail_submit:
+            raise ValueError("rejected")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_concurrent_selections_are_disjoint():
+    context = ReservingChainContext(FakeContext([utxo(i) for i in range(20)]))
+    assert reservations_of(context) is context.reservations
+
+    def select(_):
+        return select_utxos(
+            context.utxos(ADDRESS),
+            10_000_000,
+            reservations=reservations_of(context),
+        )
+
+    with ThreadPoolExecutor(8) as pool:
+        selections = list(pool.map(select, range(10)))
+    inputs = [u.input for s in selections for u in s]
+    assert len(inputs) == 20 and len(set(inputs)) == 20
+    assert context.utxos(ADDRESS) == []
+    # the builder reports that the wallet is exhausted
+    assert select(None) == []
+
+
+def test_reservations_held_until_confirmed_or_expired():
+    clock = Clock()
+    utxos = [utxo(i) for i in range(3)]
+    chain = FakeContext(utxos)
+    context = ReservingChainContext(
+        chain, UtxoReservations(build_timeout=10, pending_timeout=100, clock=clock)
+    )
+
+    # reserved for a transaction that is never submitted
+    context.reservations.reserve(utxos[:1])
+    assert context.utxos(ADDRESS) == utxos[1:]
+    clock.now = 10
+    assert context.utxos(ADDRESS) == utxos
+
+    # submitted transactions keep their inputs until the pending timeout
+    context.reservations.reserve(utxos[:1])
+    context.submit_tx(spending_tx(utxos[:1]))
+    clock.now = 50
+    assert context.utxos(ADDRESS) == utxos[1:]
+    clock.now = 110
+    assert context.utxos(ADDRESS) == utxos
+
+    # failed submissions release their inputs
+    context.reservations.reserve(utxos[:1])
+    chain.fail_submit = True
+    with pytest.raises(ValueError):
+        context.submit_tx(spending_tx(utxos[:1]))
+    assert context.utxos(ADDRESS) == utxos
+    chain.fail_submit = False
+
+    # confirmed once the UTxO is spent on chain
+    context.reservations.reserve(utxos[:1])
+    context.submit_tx(spending_tx(utxos[:1]))
+    chain.utxos_at = utxos[1:]
+    assert context.utxos(ADDRESS) == utxos[1:]
+    chain.utxos_at = utxos
+    assert context.utxos(ADDRESS) == utxos
+
+
+def test_chain_sync():
+    utxos = [utxo(i) for i in range(3)]
+    context = ReservingChainContext(FakeContext(utxos))
+    context.reservations.reserve(utxos)
+    context.submit_tx(spending_tx(utxos[1:]))
+
+    context.reservations.roll_forward(
+        [{"inputs": [{"transaction": {"id": "00" * 32}, "index": 2}]}]
+    )
+    assert context.utxos(ADDRESS) == utxos[2:]
+    # the reservations of submitted transactions are released on rollback
+    context.reservations.roll_backward()
+    assert context.utxos(ADDRESS) == utxos[1:]
@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pycardano
+
+from opshin.prelude import *
+from uada import benchmark
+from uada.utils import to_script_context
+from uada.utils.to_script_context import LazyTxInfo, to_tx_info
+
+
+def test_tx_info_converted_lazily():
+    tx, resolved_inputs, resolved_reference_inputs = benchmark.shape_tx(withdraw=True)
+    tx_info = to_tx_info(tx, resolved_inputs, resolved_reference_inputs)
+    assert isinstance(tx_info, LazyTxInfo)
+    assert set(tx_info.__dict__) == {"_converters"}
+    assert len(tx_info.inputs) == len(resolved_inputs)
+    assert set(tx_info.__dict__) == {"_converters", "inputs"}
+    # the id of the serialized transaction can be passed instead
+    tx_id = pycardano.TransactionId(b"\x01" * 32)
+    assert to_tx_info(
+        tx, resolved_inputs, resolved_reference_inputs, tx_id=tx_id
+    ).id == TxId(tx_id.payload)
+    assert tx_info.id == TxId(tx.transaction_body.id.payload)
+
+
+def test_conversions_shared():
+    tx, resolved_inputs, resolved_reference_inputs = benchmark.shape_tx(withdraw=True)
+    a = to_tx_info(tx, resolved_inputs, resolved_reference_inputs)
+    b = to_tx_info(tx, resolved_inputs, resolved_reference_inputs)
+    assert all(x is y for x, y in zip(a.inputs, b.inputs))
+    assert a.reference_inputs[0] is b.reference_inputs[0]
+    # a different output at the same input is converted again
+    changed = [
+        pycardano.TransactionOutput(o.address, o.amount.coin + 1, datum=o.datum)
+        for o in resolved_inputs
+    ]
+    c = to_tx_info(tx, changed, resolved_reference_inputs)
+    assert c.inputs[0] is not a.inputs[0]
+    assert c.inputs[0].resolved.value[b""][b""] == (
+        a.inputs[0].resolved.value[b""][b""] + 1
+    )
+    # outputs to the same address share the converted address
+    assert a.outputs[-1].address is b.outputs[-1].address
+
+
+def test_serialized_like_eager_tx_info():
+    tx, resolved_inputs, resolved_reference_inputs = benchmark.shape_tx(
+        withdraw=True, reference_inputs=2, mint=2
+    )
+    lazy = to_tx_info(tx, resolved_inputs, resolved_reference_inputs)
+    eager = TxInfo(*(getattr(lazy, f) for f in TxInfo.__dataclass_fields__))
+    purpose = Minting(b"")
+    assert (
+        ScriptContext(
+            to_tx_info(tx, resolved_inputs, resolved_reference_inputs), purpose
+        ).to_cbor()
+        == ScriptContext(eager, purpose).to_cbor()
+    )
+    assert eager.data == {
+        pycardano.datum_hash(o.datum).payload: o.datum
+        for o in resolved_inputs + resolved_reference_inputs
+        if o.datum is not None
+    }
+
+
+def test_identity_cache_bounded():
+    cache = to_script_context.IdentityCache(maxsize=2)
+    objects = [[i] for i in range(3)]
+    converted = [cache.get("key", o, object) for o in objects]
+    assert len(cache.entries) == 2
+    # the oldest entry was evicted, so it is converted again
+    assert cache.get("key", objects[0], lambda: "again") == "again"
+    assert cache.get("key", objects[2], lambda: "again") is converted[2]
+
+
+class SlowEntries(OrderedDict):
+    """
+    Gives other threads the time to evict an entry while it is being moved to the end
+    """
+
+    def move_to_end(self, key, last=True):
+        time.sleep(0.05)
+        super().move_to_end(key, last)
+
+
+def test_identity_cache_concurrent():
+    cache = to_script_context.IdentityCache(maxsize=1)
+    cache.entries = SlowEntries()
+    first, second = [1], [2]
+    cache.get("key", first, lambda: "first")
+    with ThreadPoolExecutor(2) as executor:
+        hit = executor.submit(cache.get, "key", first, lambda: "again")
+        time.sleep(0.01)
+        # evicts the entry of the first object
+        miss = executor.submit(cache.get, "key", second, lambda: "second")
+        assert hit.result() == "first"
+        assert miss.result() == "second"
+    assert [o for o, _ in cache.entries.values()] == [second]
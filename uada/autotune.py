@@ -0,0 +1,226 @@
+"""
+Selection of the cheapest compilation pipeline for each contract.
+
+Every contract is compiled with several sets of opshin optimisation options, with and without
+plutonomy, and each variant is scored by the fees it causes in a set of representative transactions:
+the execution units of all its runs in a transaction plus the fee for the size of its reference script,
+which every transaction pays once.
+Variants that fail in any of the transactions are rejected.
+"""
+import json
+from math import ceil
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import fire
+import pycardano
+import uplc
+from opshin.prelude import Minting, ScriptContext
+
+from uada import benchmark
+from uada.build import compile_uplc, contract_artifacts, plutonomy, source_contract
+from uada.offchain.util import module_name
+from uada.onchain import uada, one_shot_nft
+from uada.utils.contracts import build_dir, load_manifest, write_manifest
+from uada.utils.emulator import PROTOCOL_PARAMETERS
+from uada.utils.evaluate import evaluate_script
+from uada.utils.to_script_context import to_tx_info
+
+# the opshin options that only change how the contract is optimised
+OPTIMISATION_OPTIONS = ("--cf", "--no-optimize-patterns")
+OPSHIN_OPTION_SETS = ((), ("--cf",), ("--cf", "--no-optimize-patterns"))
+# None skips plutonomy
+PLUTONOMY_OPTION_SETS = (None, ("--default",))
+# fee per byte of reference scripts, introduced with the Conway era
+REF_SCRIPT_FEE_PER_BYTE = 15
+REPORT_NAME = "autotune.json"
+
+Arguments = Tuple[Any, ...]
+# the arguments of every run of the contract in one transaction
+Transaction = List[Arguments]
+
+
+def uada_transactions() -> List[Transaction]:
+    """
+    The arguments of the uADA validator in a transaction minting a position (minting and rewarding)
+    and in one withdrawing it (spending, minting and rewarding), with the hinted redeemer of the off-chain code
+    """
+    return [
+        [
+            benchmark.script_context(branch, withdraw=withdraw, hinted=True)
+            for branch in branches
+        ]
+        for withdraw, branches in (
+            (False, ("minting", "rewarding")),
+            (True, ("spending", "minting", "rewarding")),
+        )
+    ]
+
+
+def one_shot_nft_transactions() -> List[Transaction]:
+    """
+    The arguments of the one-shot NFT policy in a transaction minting a position NFT and in one burning it
+    """
+    _, policy_id = source_contract(module_name(one_shot_nft))
+    transactions = []
+    for withdraw in (False, True):
+        tx, resolved_inputs, resolved_reference_inputs = benchmark.shape_tx(
+            withdraw=withdraw
+        )
+        tx_info = to_tx_info(tx, resolved_inputs, resolved_reference_inputs)
+        transactions.append(
+            [
+                (
+                    tx.transaction_witness_set.redeemer[1].data,
+                    ScriptContext(tx_info, Minting(policy_id.payload)),
+                )
+            ]
+        )
+    return transactions
+
+
+# the contracts used in every transaction, with the transactions to score them in
+TUNED_CONTRACTS: Dict[str, Tuple[str, Callable[[], List[Transaction]]]] = {
+    module_name(uada): (uada.__file__, uada_transactions),
+    module_name(one_shot_nft): (one_shot_nft.__file__, one_shot_nft_transactions),
+}
+
+
+def script_fee(
+    size: int,
+    ex_units: List[pycardano.ExecutionUnits],
+    protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+) -> int:
+    """
+    The fees caused by a script of the given size in transactions that run it with the given execution units,
+    one entry per transaction. Every transaction pays the reference script fee for the size once.
+    """
+    return ceil(
+        sum(
+            protocol_param.price_mem * e.mem + protocol_param.price_step * e.steps
+            for e in ex_units
+        )
+    ) + REF_SCRIPT_FEE_PER_BYTE * size * len(ex_units)
+
+
+def transaction_ex_units(
+    contract: pycardano.PlutusV2Script, transaction: Transaction
+) -> pycardano.ExecutionUnits:
+    """
+    The execution units of all runs of the contract in the transaction
+    """
+    ex_units = [evaluate_script(contract, *run) for run in transaction]
+    return pycardano.ExecutionUnits(
+        sum(e.mem for e in ex_units), sum(e.steps for e in ex_units)
+    )
+
+
+def score_variants(
+    script: Union[Path, str],
+    transactions: List[Transaction],
+    required_options: Sequence[str] = (),
+    args: Sequence[str] = (),
+    opshin_option_sets: Sequence[Sequence[str]] = OPSHIN_OPTION_SETS,
+    plutonomy_option_sets: Sequence[Optional[Sequence[str]]] = PLUTONOMY_OPTION_SETS,
+) -> List[dict]:
+    """
+    Compile the contract in every variant and score it in the transactions
+    :return: the scores, the cheapest working variant first
+    """
+    scores = []
+    for opshin_options in opshin_option_sets:
+        options = [*required_options, *opshin_options]
+        program = compile_uplc(script, options, args)
+        for plutonomy_options in plutonomy_option_sets:
+            variant = (
+                program
+                if plutonomy_options is None
+                else plutonomy(program, plutonomy_options)
+            )
+            contract = pycardano.PlutusV2Script(uplc.flatten(variant))
+            score = {
+                "cli_options": options,
+                "plutonomy_options": None
+                if plutonomy_options is None
+                else list(plutonomy_options),
+                "size": len(contract),
+            }
+            try:
+                ex_units = [transaction_ex_units(contract, t) for t in transactions]
+            except Exception as e:
+                score["error"] = str(e)
+            else:
+                score["cpu"] = sum(e.steps for e in ex_units)
+                score["mem"] = sum(e.mem for e in ex_units)
+                score["fee"] = script_fee(len(contract), ex_units)
+            scores.append(score)
+    return sorted(scores, key=lambda s: ("error" in s, s.get("fee", 0)))
+
+
+def best_variant(scores: List[dict]) -> dict:
+    if not scores or "error" in scores[0]:
+        raise ValueError("No variant of the contract succeeds in all transactions")
+    return scores[0]
+
+
+def main(
+    opshin_option_sets: Sequence[Sequence[str]] = OPSHIN_OPTION_SETS,
+    plutonomy_option_sets: Sequence[Optional[Sequence[str]]] = PLUTONOMY_OPTION_SETS,
+):
+    """
+    Replace the compressed build of the contracts with their cheapest variant
+    and write the scores of all variants to build/autotune.json
+    """
+    parameters = {
+        name: entry["parameters"]
+        for name, entry in load_manifest().items()
+        if not name.endswith("_compressed")
+    }
+    assert parameters, "Build the contracts first, python3 -m uada.build"
+    transactions = {name: t() for name, (_, t) in TUNED_CONTRACTS.items()}
+
+    report = {}
+    for name, (script, _) in TUNED_CONTRACTS.items():
+        contract_parameters = parameters[name]
+        required_options = [
+            o
+            for o in contract_parameters["cli_options"]
+            if o not in OPTIMISATION_OPTIONS
+        ]
+        scores = score_variants(
+            script,
+            transactions[name],
+            required_options,
+            contract_parameters["args"],
+            opshin_option_sets,
+            plutonomy_option_sets,
+        )
+        best = best_variant(scores)
+        report[name] = scores
+        print(
+            f"{name}: {best['cli_options']} plutonomy {best['plutonomy_options']}, "
+            f"{best['size']} bytes, {best['fee']} lovelace in {len(transactions[name])} transactions"
+        )
+
+        artifacts = contract_artifacts(
+            contract_parameters["purpose"],
+            script,
+            best["cli_options"],
+            contract_parameters["args"],
+        )
+        program = compile_uplc(script, best["cli_options"], contract_parameters["args"])
+        if best["plutonomy_options"] is not None:
+            program = plutonomy(program, best["plutonomy_options"])
+        artifacts(program).dump(build_dir.joinpath(f"{name}_compressed"))
+        contract_parameters["compressed_variant"] = {
+            "cli_options": best["cli_options"],
+            "plutonomy_options": best["plutonomy_options"],
+        }
+
+    write_manifest(parameters)
+    build_dir.joinpath(REPORT_NAME).write_text(json.dumps(report, indent=2) + "\n")
+    print(f"wrote the scores of all variants to {build_dir.joinpath(REPORT_NAME)}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,311 @@
+"""
+Execution budget benchmark of the uADA validator.
+
+Builds synthetic transactions of growing shape, converts them with to_tx_info
+and evaluates every branch of the validator on the contracts compiled from the current sources,
+with the build parameters of build/ (see uada.build.source_contract).
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import fire
+import pycardano
+from opshin.prelude import *
+
+from uada.offchain.util import module_name, script_indices
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.build import source_contract
+from uada.utils.contracts import get_contract
+from uada.utils.evaluate import evaluate_script
+from uada.utils.network import network
+from uada.utils.to_script_context import to_address, to_tx_info, to_tx_out_ref
+
+BRANCHES = ("minting", "spending", "rewarding")
+DIMENSIONS = ("inputs", "outputs", "reference_inputs", "mint")
+SIZES = (1, 5, 10, 20)
+
+POSITION_AMOUNT = 5_000_000
+WALLET_INPUT_AMOUNT = 10_000_000
+
+
+def _hash(kind: str, i: int, length: int) -> bytes:
+    return hashlib.sha256(f"{kind}{i}".encode()).digest()[:length]
+
+
+def wallet_address(i: int = 0) -> pycardano.Address:
+    return pycardano.Address(
+        pycardano.VerificationKeyHash(_hash("wallet", i, 28)), network=network
+    )
+
+
+def tx_input(kind: str, i: int) -> pycardano.TransactionInput:
+    return pycardano.TransactionInput(pycardano.TransactionId(_hash(kind, i, 32)), 0)
+
+
+def redeemer(data, tag: pycardano.RedeemerTag, index: int) -> pycardano.Redeemer:
+    r = pycardano.Redeemer(data)
+    r.tag = tag
+    r.index = index
+    return r
+
+
+def fee_params() -> uada.UAdaFeeParams:
+    return uada.UAdaFeeParams(
+        mint_fee_min=1_000_000,
+        mint_fee_percent=uada.Fraction(3, 1000),
+        withdrawal_fee_min=1_000_000,
+        withdrawal_fee_percent=uada.Fraction(3, 1000),
+        treasury_address=to_address(wallet_address(-1)),
+        treasury_out_datum=uada.NoOutputDatum(),
+    )
+
+
+def shape_tx(
+    compressed: bool = False,
+    withdraw: bool = False,
+    inputs: int = 1,
+    outputs: int = 1,
+    reference_inputs: int = 0,
+    mint: int = 0,
+    hinted: bool = False,
+) -> Tuple[
+    pycardano.Transaction,
+    List[pycardano.TransactionOutput],
+    List[pycardano.TransactionOutput],
+]:
+    """
+    Build a transaction that mints (or withdraws, if withdraw is set) a single staking position.
+    :param inputs: number of wallet inputs
+    :param outputs: number of wallet outputs, next to the treasury and position outputs
+    :param reference_inputs: number of reference inputs, next to the fee parameters
+    :param mint: number of unrelated policies minting a token
+    :param hinted: whether to use the redeemer with hinted script input and output indices
+    :return: the transaction, its resolved inputs and resolved reference inputs
+    """
+    _, uada_policy_id = source_contract(module_name(uada), compressed)
+    uada_address = pycardano.Address(uada_policy_id, network=network)
+    _, one_shot_nft_policy_id = source_contract(module_name(one_shot_nft), compressed)
+    # uada is always parameterized with the compressed auth nft, see uada.build
+    _, auth_nft_policy_id, _ = get_contract(module_name(parameter_auth_nft), True)
+
+    utxos = [
+        pycardano.UTxO(
+            tx_input("wallet", i),
+            pycardano.TransactionOutput(wallet_address(i), WALLET_INPUT_AMOUNT),
+        )
+        for i in range(inputs)
+    ]
+    unique_nft_name = one_shot_nft.one_shot_nft_name(to_tx_out_ref(utxos[0].input))
+    position_datum = uada.UAdaStakingPosition(
+        one_shot_nft_policy_id.payload, unique_nft_name
+    )
+    if withdraw:
+        utxos[0].output.amount.multi_asset = pycardano.MultiAsset.from_primitive(
+            {one_shot_nft_policy_id.payload: {unique_nft_name: 1}}
+        )
+        utxos.append(
+            pycardano.UTxO(
+                tx_input("position", 0),
+                pycardano.TransactionOutput(
+                    uada_address, POSITION_AMOUNT, datum=position_datum
+                ),
+            )
+        )
+    utxos.sort(key=lambda u: (u.input.transaction_id.payload, u.input.index))
+    seed_index = [u.input for u in utxos].index(tx_input("wallet", 0))
+
+    ref_utxos = [
+        pycardano.UTxO(
+            tx_input("params", 0),
+            pycardano.TransactionOutput(
+                wallet_address(0),
+                pycardano.Value(
+                    2_000_000,
+                    pycardano.MultiAsset.from_primitive(
+                        {auth_nft_policy_id.payload: {b"": 1}}
+                    ),
+                ),
+                datum=fee_params(),
+            ),
+        )
+    ] + [
+        pycardano.UTxO(
+            tx_input("reference", i),
+            pycardano.TransactionOutput(wallet_address(i), 2_000_000),
+        )
+        for i in range(reference_inputs)
+    ]
+    ref_utxos.sort(key=lambda u: (u.input.transaction_id.payload, u.input.index))
+    params_index = [u.input for u in ref_utxos].index(tx_input("params", 0))
+
+    sign = -1 if withdraw else 1
+    tx_outputs = [
+        # treasury payout
+        pycardano.TransactionOutput(wallet_address(-1), 1_000_000),
+    ]
+    if not withdraw:
+        tx_outputs.append(
+            pycardano.TransactionOutput(
+                uada_address, POSITION_AMOUNT, datum=position_datum
+            )
+        )
+    tx_outputs += [
+        pycardano.TransactionOutput(wallet_address(i), 2_000_000)
+        for i in range(outputs)
+    ]
+
+    mint_value = {
+        uada_policy_id.payload: {b"uADA": sign * POSITION_AMOUNT},
+        one_shot_nft_policy_id.payload: {unique_nft_name: sign},
+    }
+    for i in range(mint):
+        mint_value[_hash("policy", i, 28)] = {b"": 1}
+    multi_asset = pycardano.MultiAsset.from_primitive(mint_value)
+    sorted_policies = sorted(p.payload for p in multi_asset.keys())
+
+    redeemers = [
+        redeemer(
+            uada.Nothing(),
+            pycardano.RedeemerTag.MINT,
+            sorted_policies.index(uada_policy_id.payload),
+        ),
+        redeemer(
+            [] if withdraw else [seed_index],
+            pycardano.RedeemerTag.MINT,
+            sorted_policies.index(one_shot_nft_policy_id.payload),
+        ),
+        redeemer(
+            uada.HintedContractInteractionRedeemer(
+                parameter_auth_nft_ref_utxo_index=params_index,
+                treasury_payout_tx_out_index=0,
+                script_output_indices=script_indices(tx_outputs, uada_policy_id),
+            )
+            if hinted
+            else uada.ContractInteractionRedeemer(
+                parameter_auth_nft_ref_utxo_index=params_index,
+                treasury_payout_tx_out_index=0,
+            ),
+            pycardano.RedeemerTag.REWARD,
+            0,
+        ),
+    ]
+    if withdraw:
+        nft_input_index = next(
+            i for i, u in enumerate(utxos) if u.output.amount.multi_asset
+        )
+        position_input_index = next(
+            i for i, u in enumerate(utxos) if u.output.address == uada_address
+        )
+        redeemers.append(
+            redeemer(
+                uada.WithdrawUAdaStakingPosition(
+                    unique_nft_input_index=nft_input_index
+                ),
+                pycardano.RedeemerTag.SPEND,
+                position_input_index,
+            )
+        )
+
+    tx_body = pycardano.TransactionBody(
+        inputs=[u.input for u in utxos],
+        outputs=tx_outputs,
+        fee=200_000,
+        mint=multi_asset,
+        withdraws=pycardano.Withdrawals(
+            {bytes(pycardano.Address(staking_part=uada_policy_id, network=network)): 0}
+        ),
+        reference_inputs=[u.input for u in ref_utxos],
+        certificates=[],
+        required_signers=[],
+    )
+    tx = pycardano.Transaction(
+        tx_body,
+        pycardano.TransactionWitnessSet(plutus_data=[], redeemer=redeemers),
+    )
+    return tx, [u.output for u in utxos], [u.output for u in ref_utxos]
+
+
+def script_context(
+    branch: str, compressed: bool = False, withdraw: Optional[bool] = None, **shape
+) -> Tuple[Datum, Redeemer, ScriptContext]:
+    """
+    Return the arguments that the uADA validator receives in the given branch
+    :param withdraw: whether the transaction withdraws the position, by default only in the spending branch
+    """
+    _, uada_policy_id = source_contract(module_name(uada), compressed)
+    tx, resolved_inputs, resolved_reference_inputs = shape_tx(
+        compressed,
+        withdraw=branch == "spending" if withdraw is None else withdraw,
+        **shape,
+    )
+    tx_info = to_tx_info(tx, resolved_inputs, resolved_reference_inputs)
+    redeemers = tx.transaction_witness_set.redeemer
+    if branch == "minting":
+        purpose = Minting(uada_policy_id.payload)
+        redeemer = redeemers[0].data
+        datum = uada.Nothing()
+    elif branch == "spending":
+        spend_redeemer = redeemers[-1]
+        purpose = Spending(tx_info.inputs[spend_redeemer.index].out_ref)
+        redeemer = spend_redeemer.data
+        datum = resolved_inputs[spend_redeemer.index].datum
+    elif branch == "rewarding":
+        purpose = Rewarding(StakingHash(ScriptCredential(uada_policy_id.payload)))
+        redeemer = redeemers[2].data
+        datum = uada.Nothing()
+    else:
+        raise ValueError(f"Unknown branch {branch}")
+    return datum, redeemer, ScriptContext(tx_info, purpose)
+
+
+def measure(branch: str, compressed: bool = True, **shape) -> Dict[str, int]:
+    uada_script, _ = source_contract(module_name(uada), compressed)
+    ex_units = evaluate_script(
+        uada_script, *script_context(branch, compressed, **shape)
+    )
+    return {"cpu": ex_units.steps, "mem": ex_units.mem}
+
+
+def cost_curves(compressed: bool = True) -> dict:
+    """
+    Execution units of every branch when growing each dimension of the transaction shape
+    """
+    uada_script, _ = source_contract(module_name(uada), compressed)
+    curves = {"script_size": len(uada_script)}
+    for branch in BRANCHES:
+        curves[branch] = {
+            dimension: {
+                str(size): measure(branch, compressed, **{dimension: size})
+                for size in SIZES
+            }
+            for dimension in DIMENSIONS
+        }
+    return curves
+
+
+def main(output: Optional[str] = None):
+    """
+    Print the cost curves of the compressed and uncompressed uADA contract
+    :param output: if given, write the curves as JSON to this file (i.e. to update the regression baseline)
+    """
+    results = {}
+    for compressed in (True, False):
+        name = f"{module_name(uada)}{'_compressed' if compressed else ''}"
+        results[name] = curves = cost_curves(compressed)
+        print(f"{name} (script size {curves['script_size']} bytes)")
+        for branch in BRANCHES:
+            for dimension in DIMENSIONS:
+                row = " ".join(
+                    f"{size}: {c['cpu']:>11} cpu {c['mem']:>8} mem"
+                    for size, c in curves[branch][dimension].items()
+                )
+                print(f"  {branch:<10} {dimension:<17} {row}")
+    if output is not None:
+        Path(output).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"wrote cost curves to {output}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
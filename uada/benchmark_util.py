@@ -0,0 +1,367 @@
+"""
+Execution budget benchmark of the helpers shared by the contracts,
+in uada.onchain.util, uada.onchain.utils.ext_interval and uada.onchain.utils.ext_fraction.
+
+Every helper is compiled into a small wrapper contract, evaluated on generated inputs
+and its result is compared against running the helper in Python.
+The value arithmetic is additionally measured on inputs of growing size.
+"""
+import functools
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import fire
+import pycardano
+from opshin.builder import _build, _compile
+from opshin.prelude import *
+from opshin.std.fractions import Fraction
+
+from uada.onchain import util
+from uada.onchain.utils import ext_fraction, ext_interval
+from uada.utils.emulator import PROTOCOL_PARAMETERS
+from uada.utils.evaluate import run_script, to_uplc_data
+
+POLICY_COUNTS = (1, 10, 100)
+
+BINARY_VALUE_SOURCE = """
+from uada.onchain.util import *
+
+
+def validator(a: Value, b: Value) -> Value:
+    return {function}(a, b)
+"""
+
+TOTAL_VALUE_SOURCE = """
+from uada.onchain.util import *
+
+
+def validator(outputs: List[TxOut]) -> Value:
+    return {function}(outputs)
+"""
+
+MERGE_VALUE_SOURCE = """
+from uada.onchain.util import *
+
+
+def validator(a: Value, b: Value) -> Value:
+    assert _value_ascending(a) and _value_ascending(b)
+    return _merge_values(a, b, 1)
+"""
+
+
+# benchmarked helper and its quadratic implementation for maps in any order
+VALUE_FUNCTIONS: Dict[str, Tuple[Callable, str, str]] = {
+    "add_value": (util.add_value, BINARY_VALUE_SOURCE, "_add_value_unsorted"),
+    "subtract_value": (
+        util.subtract_value,
+        BINARY_VALUE_SOURCE,
+        "_subtract_value_unsorted",
+    ),
+    "total_value": (
+        util.total_value,
+        TOTAL_VALUE_SOURCE,
+        "_total_value_unsorted",
+    ),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(source: str) -> pycardano.PlutusV2Script:
+    return _build(_compile(source))
+
+
+def value(policies: int, offset: int = 0) -> Value:
+    """
+    A value holding lovelace and one token of each of the given number of policies,
+    sorted like values provided by the ledger
+    """
+    v = {b"": {b"": 2_000_000}}
+    for i in range(offset, offset + policies):
+        policy_id = hashlib.sha256(f"policy{i}".encode()).digest()[:28]
+        v[policy_id] = {b"token": i + 1}
+    return dict(sorted(v.items()))
+
+
+def tx_out(v: Value) -> TxOut:
+    return TxOut(
+        Address(PubKeyCredential(b"\x00" * 28), NoStakingCredential()),
+        v,
+        NoOutputDatum(),
+        NoScriptHash(),
+    )
+
+
+def arguments(name: str, policies: int) -> list:
+    # the values share half of their policies
+    a, b = value(policies), value(policies, offset=policies // 2)
+    if name == "total_value":
+        return [[tx_out(a), tx_out(b), tx_out(value(policies, offset=policies))]]
+    return [a, b]
+
+
+def measure(name: str, policies: int, unsorted: bool = False) -> Dict[str, int]:
+    """
+    Execution units of the compiled helper, asserting that it computes the same as in Python
+    :param unsorted: measure the quadratic implementation for maps in any order instead
+    """
+    function, source, unsorted_function = VALUE_FUNCTIONS[name]
+    script = compiled(source.format(function=unsorted_function if unsorted else name))
+    args = arguments(name, policies)
+    result, ex_units = run_script(script, *args)
+    assert result == to_uplc_data(
+        function(*args)
+    ), f"{name} computes a different result on chain"
+    return {"cpu": ex_units.steps, "mem": ex_units.mem}
+
+
+def value_cost_curves() -> dict:
+    return {
+        name: {
+            str(policies): {
+                "current": measure(name, policies),
+                "quadratic": measure(name, policies, unsorted=True),
+            }
+            for policies in POLICY_COUNTS
+        }
+        for name in VALUE_FUNCTIONS
+    }
+
+
+def merge_crossover(
+    protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+    max_policies: int = 100,
+) -> Optional[int]:
+    """
+    The smallest number of policies in both values together (as in util.VALUE_MERGE_THRESHOLD)
+    from which checking the order and merging costs less fees than the quadratic addition,
+    None if merging is more expensive up to max_policies per value
+    """
+    merge = compiled(MERGE_VALUE_SOURCE)
+    quadratic = compiled(BINARY_VALUE_SOURCE.format(function="_add_value_unsorted"))
+    for policies in range(1, max_policies + 1):
+        a, b = arguments("add_value", policies)
+        fees = [
+            protocol_param.price_mem * e.mem + protocol_param.price_step * e.steps
+            for e in (run_script(merge, a, b)[1], run_script(quadratic, a, b)[1])
+        ]
+        if fees[0] < fees[1]:
+            return len(a) + len(b)
+    return None
+
+
+HELPER_SOURCE = """
+from uada.onchain.util import *
+from uada.onchain.utils.ext_fraction import *
+
+
+def validator({parameters}) -> {result}:
+    return {function}({arguments})
+"""
+
+# benchmarked helper and the parameters and result type of its wrapper
+HELPERS: Dict[str, Tuple[Callable, str, str]] = {
+    "compare_upper_lower_bound": (
+        ext_interval.compare_upper_lower_bound,
+        "a: UpperBoundPOSIXTime, b: LowerBoundPOSIXTime",
+        "int",
+    ),
+    "compare_lower_upper_bound": (
+        ext_interval.compare_lower_upper_bound,
+        "a: LowerBoundPOSIXTime, b: UpperBoundPOSIXTime",
+        "int",
+    ),
+    "entirely_after": (
+        ext_interval.entirely_after,
+        "a: POSIXTimeRange, b: POSIXTimeRange",
+        "bool",
+    ),
+    "entirely_before": (
+        ext_interval.entirely_before,
+        "a: POSIXTimeRange, b: POSIXTimeRange",
+        "bool",
+    ),
+    "before_ext": (
+        ext_interval.before_ext,
+        "a: POSIXTimeRange, b: ExtendedPOSIXTime",
+        "bool",
+    ),
+    "after_ext": (
+        ext_interval.after_ext,
+        "a: POSIXTimeRange, b: ExtendedPOSIXTime",
+        "bool",
+    ),
+    "ext_after_ext": (
+        ext_interval.ext_after_ext,
+        "a: ExtendedPOSIXTime, b: ExtendedPOSIXTime",
+        "bool",
+    ),
+    "mul_fraction_int": (
+        ext_fraction.mul_fraction_int,
+        "a: Fraction, b: int",
+        "Fraction",
+    ),
+    "merge_without_duplicates": (
+        util.merge_without_duplicates,
+        "a: List[bytes], b: List[bytes]",
+        "List[bytes]",
+    ),
+    "token_present_in_output": (
+        util.token_present_in_output,
+        "a: Token, b: TxOut",
+        "bool",
+    ),
+    "only_one_output_to_address": (
+        util.only_one_output_to_address,
+        "a: Address, b: List[TxOut]",
+        "bool",
+    ),
+    "add_value": (util.add_value, "a: Value, b: Value", "Value"),
+    "subtract_value": (util.subtract_value, "a: Value, b: Value", "Value"),
+    "total_value": (util.total_value, "a: List[TxOut]", "Value"),
+}
+
+
+def helper_strategies() -> dict:
+    """
+    The hypothesis strategies for the arguments of every helper.
+    hypothesis is a development dependency, so it is only imported when arguments are generated
+    """
+    from hypothesis import strategies as st
+
+    times = st.integers(-(2**64), 2**64)
+    extended_times = st.one_of(
+        st.just(NegInfPOSIXTime()),
+        st.builds(FinitePOSIXTime, times),
+        st.just(PosInfPOSIXTime()),
+    )
+    closures = st.sampled_from([TrueData(), FalseData()])
+    lower_bounds = st.builds(LowerBoundPOSIXTime, extended_times, closures)
+    upper_bounds = st.builds(UpperBoundPOSIXTime, extended_times, closures)
+    ranges = st.builds(POSIXTimeRange, lower_bounds, upper_bounds)
+    fractions = st.builds(Fraction, times, st.integers(1, 2**64))
+
+    policy_ids = st.sampled_from(
+        [hashlib.sha256(f"policy{i}".encode()).digest()[:28] for i in range(5)]
+    )
+    token_names = st.sampled_from([b"", b"a", b"token", b"uada"])
+    tokens = st.builds(Token, policy_ids, token_names)
+    # values as provided by the ledger, sorted and with lovelace first
+    values = st.dictionaries(
+        policy_ids,
+        st.dictionaries(token_names, st.integers(1, 2**64), min_size=1).map(
+            lambda t: dict(sorted(t.items()))
+        ),
+        max_size=4,
+    ).map(lambda v: {b"": {b"": 2_000_000}, **dict(sorted(v.items()))})
+    addresses = st.builds(
+        Address,
+        st.builds(PubKeyCredential, st.sampled_from([b"\x00" * 28, b"\x01" * 28])),
+        st.just(NoStakingCredential()),
+    )
+    tx_outs = st.builds(
+        TxOut, addresses, values, st.just(NoOutputDatum()), st.just(NoScriptHash())
+    )
+    tx_out_lists = st.lists(tx_outs, max_size=4)
+
+    return {
+        "compare_upper_lower_bound": (upper_bounds, lower_bounds),
+        "compare_lower_upper_bound": (lower_bounds, upper_bounds),
+        "entirely_after": (ranges, ranges),
+        "entirely_before": (ranges, ranges),
+        "before_ext": (ranges, extended_times),
+        "after_ext": (ranges, extended_times),
+        "ext_after_ext": (extended_times, extended_times),
+        "mul_fraction_int": (fractions, times),
+        "merge_without_duplicates": (
+            st.lists(policy_ids, max_size=4),
+            st.lists(policy_ids, max_size=4),
+        ),
+        "token_present_in_output": (tokens, tx_outs),
+        "only_one_output_to_address": (addresses, tx_out_lists),
+        "add_value": (values, values),
+        "subtract_value": (values, values),
+        "total_value": (tx_out_lists,),
+    }
+
+
+def helper_source(name: str) -> str:
+    _, parameters, result = HELPERS[name]
+    return HELPER_SOURCE.format(
+        parameters=parameters,
+        result=result,
+        function=name,
+        arguments=", ".join("ab"[: len(parameters.split(", "))]),
+    )
+
+
+def measure_helper(name: str, *args) -> Dict[str, int]:
+    """
+    Execution units of the compiled helper on the arguments,
+    asserting that it computes the same as in Python
+    """
+    function = HELPERS[name][0]
+    result, ex_units = run_script(compiled(helper_source(name)), *args)
+    assert result == to_uplc_data(
+        function(*args)
+    ), f"{name} computes a different result on chain for {args}"
+    return {"cpu": ex_units.steps, "mem": ex_units.mem}
+
+
+def helper_costs(name: str, examples: int = 50) -> Dict[str, int]:
+    """
+    The highest execution units of the helper over generated arguments.
+    The arguments are derandomized, so the costs are comparable between runs
+    """
+    from hypothesis import HealthCheck, Phase, given, settings, strategies as st
+
+    costs = []
+
+    @settings(
+        max_examples=examples,
+        derandomize=True,
+        database=None,
+        phases=[Phase.generate],
+        deadline=None,
+        suppress_health_check=list(HealthCheck),
+    )
+    @given(st.tuples(*helper_strategies()[name]))
+    def run(args):
+        costs.append(measure_helper(name, *args))
+
+    run()
+    return {d: max(c[d] for c in costs) for d in ("cpu", "mem")}
+
+
+def main(output: Optional[str] = None, examples: int = 50):
+    """
+    Print the execution units of the helpers and of the value helpers next to their quadratic implementations
+    :param output: if given, write the helper costs as JSON to this file (i.e. to update the regression baseline)
+    :param examples: number of generated arguments every helper is run on
+    """
+    results = {}
+    print(f"highest cost over {examples} generated arguments")
+    for name in HELPERS:
+        results[name] = costs = helper_costs(name, examples)
+        print(f"  {name:<28} {costs['cpu']:>11} cpu {costs['mem']:>8} mem")
+    for name, curve in value_cost_curves().items():
+        print(name)
+        for policies, costs in curve.items():
+            current, quadratic = costs["current"], costs["quadratic"]
+            print(
+                f"  {policies:>3} policies: "
+                f"{current['cpu']:>13} cpu {current['mem']:>10} mem  "
+                f"(quadratic: {quadratic['cpu']:>13} cpu {quadratic['mem']:>10} mem)"
+            )
+    print(
+        f"merging values is cheaper from {merge_crossover()} policies "
+        f"(VALUE_MERGE_THRESHOLD is {util.VALUE_MERGE_THRESHOLD})"
+    )
+    if output is not None:
+        Path(output).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"wrote helper costs to {output}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -1,17 +1,49 @@
+import ast
 import datetime
+import functools
+import hashlib
+import importlib.metadata
+import importlib.util
+import inspect
+import json
+import shutil
 import subprocess
+import tempfile
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
 from math import ceil
 
 import fire
 import sys
 from pathlib import Path
-from typing import Union
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 
+import opshin.__main__
+import opshin.builder
+import opshin.compiler
+import uplc
+import uplc.ast
+from opshin import prelude
+from opshin.builder import PlutusContract, Purpose
+from pycardano import PlutusV2Script, ScriptHash, plutus_script_hash
 from uplc.ast import PlutusByteString, plutus_cbor_dumps, PlutusInteger
 
 from uada.offchain.util import module_name
 from uada.utils import get_signing_info, network
-from .utils.contracts import get_contract
+from .utils.contracts import (
+    MANIFEST_NAME,
+    build_dir,
+    get_contract,
+    load_manifest,
+    manifest_entry,
+    write_manifest,
+)
 
 from uada.onchain import (
     uada,
@@ -20,83 +52,421 @@ from uada.onchain import (
 )
 
 
+# keyword arguments of the opshin compiler for the opshin command line options we use
+OPSHIN_OPTIONS = {
+    "--cf": {"constant_folding": True},
+    "--force-three-params": {"force_three_params": True},
+    "--no-optimize-patterns": {"optimize_patterns": False},
+}
+
+
+def compile_uplc(
+    script: Union[Path, str], cli_options=("--cf",), args=()
+) -> uplc.ast.Program:
+    """
+    Compile the contract within this process, like opshin compile does, and apply the parameters
+    :param args: the parameters as hex encoded CBOR, like on the opshin command line
+    """
+    # same as the --recursion-limit of the command line tools
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 2000))
+    options = {}
+    for option in cli_options:
+        options.update(OPSHIN_OPTIONS[option])
+    script = Path(script)
+    source_ast = opshin.compiler.parse(script.read_text(), filename=str(script))
+    code = opshin.builder.compile(
+        source_ast, contract_filename=str(script), **options
+    ).term
+    for arg in args:
+        code = uplc.ast.Apply(code, uplc.ast.data_from_cbor(bytes.fromhex(arg)))
+    return uplc.ast.Program((1, 0, 0), code)
+
+
+def plutonomy(
+    program: uplc.ast.Program, options: Sequence[str] = ("--default",)
+) -> uplc.ast.Program:
+    """
+    Optimize the contract with plutonomy-cli, the only part of the build that runs externally
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        contract = Path(tmp_dir).joinpath("script.cbor")
+        contract.write_text(uplc.flatten(program).hex())
+        compressed = subprocess.run(
+            ["plutonomy-cli", contract, *options],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+    return uplc.unflatten(bytes.fromhex(compressed.strip()))
+
+
+def compile_contract(
+    script: Union[Path, str], cli_options=("--cf",), args=(), compressed=False
+) -> Tuple[PlutusV2Script, ScriptHash]:
+    """
+    Compile the contract without touching the build directory
+    :return: the script and its hash
+    """
+    program = compile_uplc(script, cli_options, args)
+    if compressed:
+        program = plutonomy(program)
+    contract = PlutusV2Script(uplc.flatten(program))
+    return contract, plutus_script_hash(contract)
+
+
+# the contracts that can be compiled from their sources with the build parameters of the manifest
+SOURCES = {
+    module_name(uada): uada.__file__,
+    module_name(one_shot_nft): one_shot_nft.__file__,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def source_contract(
+    name: str, compressed: bool = False
+) -> Tuple[PlutusV2Script, ScriptHash]:
+    """
+    Compile the current sources of the contract with the options and parameters it was built with,
+    i.e. uada is parameterized with the built parameter auth NFT.
+    The compressed contract is compiled like the variant chosen by uada.autotune, if any.
+    :return: the script and its hash
+    """
+    parameters = build_parameters(name)
+    variant = parameters.get("compressed_variant") if compressed else None
+    if variant is None:
+        return compile_contract(
+            SOURCES[name], parameters["cli_options"], parameters["args"], compressed
+        )
+    program = compile_uplc(SOURCES[name], variant["cli_options"], parameters["args"])
+    if variant["plutonomy_options"] is not None:
+        program = plutonomy(program, variant["plutonomy_options"])
+    contract = PlutusV2Script(uplc.flatten(program))
+    return contract, plutus_script_hash(contract)
+
+
+def compiles_compressed(name: str) -> bool:
+    """
+    Whether the compressed contract can be compiled from its sources here, i.e. plutonomy-cli is installed
+    or the compressed variant does not use plutonomy
+    """
+    variant = build_parameters(name).get("compressed_variant")
+    if variant is not None and variant["plutonomy_options"] is None:
+        return True
+    return shutil.which("plutonomy-cli") is not None
+
+
+def contract_artifacts(
+    type: str, script: Union[Path, str], cli_options=("--cf",), args=()
+) -> Callable[[uplc.ast.Program], PlutusContract]:
+    """
+    Attach the datum, redeemer and parameter types of the contract to compiled programs,
+    for the blueprint written by opshin build
+    """
+    spec = importlib.util.spec_from_file_location(Path(script).stem, script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    annotations = [
+        (p.name, p.annotation or prelude.Anything)
+        for p in inspect.signature(module.validator).parameters.values()
+    ]
+    onchain_params, param_types = opshin.__main__.check_params(
+        opshin.__main__.Command.build,
+        Purpose(type),
+        annotations,
+        inspect.signature(module.validator).return_annotation or prelude.Anything,
+        [],
+        "--force-three-params" in cli_options,
+    )
+    return lambda program: PlutusContract(
+        PlutusV2Script(uplc.flatten(program)),
+        datum_type=onchain_params[0] if len(onchain_params) == 3 else None,
+        redeemer_type=onchain_params[1 if len(onchain_params) == 3 else 0],
+        parameter_types=param_types[len(args) :],
+        purpose=(Purpose(type),),
+    )
+
+
 def build_compressed(
     type: str, script: Union[Path, str], cli_options=("--cf",), args=()
-):
+) -> dict:
+    """
+    Build the plain and compressed contract
+    :return: the build parameters, for the manifest
+    """
     script = Path(script)
-    command = [
-        sys.executable,
-        "-m",
-        "opshin",
-        *cli_options,
-        "build",
-        type,
-        script,
-        *args,
-        "--recursion-limit",
-        "2000",
-    ]
-    subprocess.run(command)
-
-    built_contract = Path(f"build/{script.stem}/script.cbor")
-    built_contract_compressed_cbor = Path(f"build/tmp.cbor")
-
-    with built_contract_compressed_cbor.open("wb") as fp:
-        subprocess.run(["plutonomy-cli", built_contract, "--default"], stdout=fp)
-
-    subprocess.run(
-        [
-            sys.executable,
-            "-m",
-            "uplc",
-            "build",
-            "--from-cbor",
-            built_contract_compressed_cbor,
-            "-o",
-            f"build/{script.stem}_compressed",
-            "--recursion-limit",
-            "2000",
-        ]
+    artifacts = contract_artifacts(type, script, cli_options, args)
+    program = compile_uplc(script, cli_options, args)
+    artifacts(program).dump(build_dir.joinpath(script.stem))
+    artifacts(plutonomy(program)).dump(build_dir.joinpath(f"{script.stem}_compressed"))
+    return {"purpose": type, "cli_options": list(cli_options), "args": list(args)}
+
+
+CACHE_DIR_NAME = ".cache"
+
+
+def onchain_sources(script: Union[Path, str]) -> List[Path]:
+    """
+    The contract and all onchain modules it imports, recursively.
+    Modules of opshin itself are covered by the opshin version.
+    """
+    sources = [Path(script)]
+    for source in sources:
+        for node in ast.walk(ast.parse(source.read_text())):
+            if isinstance(node, ast.ImportFrom) and (node.module or "").startswith(
+                "uada.onchain"
+            ):
+                module = Path(importlib.util.find_spec(node.module).origin)
+                if module not in sources:
+                    sources.append(module)
+    return sources
+
+
+def tool_versions() -> dict:
+    plutonomy = shutil.which("plutonomy-cli")
+    return {
+        "opshin": importlib.metadata.version("opshin"),
+        "uplc": importlib.metadata.version("uplc"),
+        # plutonomy has no version flag, the binary identifies it
+        "plutonomy": hashlib.sha256(Path(plutonomy).read_bytes()).hexdigest()
+        if plutonomy
+        else None,
+    }
+
+
+def build_key(
+    type: str, script: Union[Path, str], cli_options=("--cf",), args=()
+) -> str:
+    """
+    Hash of everything the built contract depends on
+    """
+    key = hashlib.sha256()
+    for source in onchain_sources(script):
+        key.update(hashlib.sha256(source.read_bytes()).digest())
+    key.update(
+        json.dumps(
+            [tool_versions(), type, list(cli_options), [str(a) for a in args]]
+        ).encode()
     )
+    return key.hexdigest()
 
 
-def main(
-    admin_wallet: str = "admin",
-    latest_mint_time: datetime.datetime = datetime.datetime.now()
-    + datetime.timedelta(days=30),
-):
-    build_compressed(
-        "minting",
-        one_shot_nft.__file__,
+def cached_build(
+    type: str, script: Union[Path, str], cli_options=("--cf",), args=()
+) -> dict:
+    """
+    Build the plain and compressed contract, or restore them from the cache
+    if the same sources were built before with the same tools and parameters
+    :return: the build parameters, for the manifest
+    """
+    stem = Path(script).stem
+    key = build_key(type, script, cli_options, args)
+    cache_entry = build_dir.joinpath(CACHE_DIR_NAME, key)
+    build_names = (stem, f"{stem}_compressed")
+    if not cache_entry.exists():
+        parameters = build_compressed(type, script, cli_options, args)
+        tmp_entry = build_dir.joinpath(CACHE_DIR_NAME, f"{key}.tmp")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        for build_name in build_names:
+            shutil.copytree(build_dir.joinpath(build_name), tmp_entry / build_name)
+        tmp_entry.joinpath("parameters.json").write_text(json.dumps(parameters))
+        tmp_entry.rename(cache_entry)
+    for build_name in build_names:
+        shutil.rmtree(build_dir.joinpath(build_name), ignore_errors=True)
+        shutil.copytree(cache_entry / build_name, build_dir.joinpath(build_name))
+    parameters = json.loads(cache_entry.joinpath("parameters.json").read_text())
+    return {**parameters, "build_key": key}
+
+
+@dataclass
+class ContractBuild:
+    """
+    How to build one contract. The parameters of the contract are derived from the
+    policy ids of the (compressed) contracts it depends on, by name.
+    """
+
+    type: str
+    script: Union[Path, str]
+    cli_options: Sequence[str] = ("--cf",)
+    dependencies: Sequence[str] = ()
+    args: Callable[[Dict[str, ScriptHash]], List[str]] = field(
+        default=lambda policy_ids: []
+    )
+
+
+def built_policy_id(name: str) -> ScriptHash:
+    return ScriptHash.from_primitive(
+        manifest_entry(f"{name}_compressed", {})["policy_id"]
     )
 
+
+def build_all(
+    contracts: Dict[str, ContractBuild],
+    build: Callable[..., dict] = cached_build,
+    executor: Optional[Executor] = None,
+) -> Dict[str, dict]:
+    """
+    Build all contracts, each as soon as the contracts it depends on are built,
+    and independent contracts concurrently
+    :return: the build parameters of each contract, by name
+    """
+    executor = executor or ProcessPoolExecutor(len(contracts))
+    parameters: Dict[str, dict] = {}
+    policy_ids: Dict[str, ScriptHash] = {}
+    running: Dict[Future, str] = {}
+    with executor:
+        while len(parameters) < len(contracts):
+            for name, contract in contracts.items():
+                if name in parameters or name in running.values():
+                    continue
+                if not all(d in policy_ids for d in contract.dependencies):
+                    continue
+                args = contract.args({d: policy_ids[d] for d in contract.dependencies})
+                running[
+                    executor.submit(
+                        build,
+                        contract.type,
+                        contract.script,
+                        cli_options=tuple(contract.cli_options),
+                        args=args,
+                    )
+                ] = name
+            if not running:
+                missing = set(contracts) - set(parameters)
+                raise ValueError(f"Unresolvable dependencies of {sorted(missing)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # a failed build fails the whole build
+                parameters[name] = future.result()
+                policy_ids[name] = built_policy_id(name)
+    return parameters
+
+
+def source_builds() -> Dict[str, ContractBuild]:
+    """
+    How to build the contracts in SOURCES, which do not depend on the admin wallet
+    """
+    return {
+        module_name(one_shot_nft): ContractBuild("minting", one_shot_nft.__file__),
+        module_name(uada): ContractBuild(
+            "any",
+            uada.__file__,
+            cli_options=("--cf", "--force-three-params"),
+            dependencies=[module_name(parameter_auth_nft)],
+            args=lambda policy_ids: [
+                plutus_cbor_dumps(
+                    PlutusByteString(
+                        policy_ids[module_name(parameter_auth_nft)].payload
+                    )
+                ).hex(),
+            ],
+        ),
+    }
+
+
+def contract_builds(
+    admin_wallet: str, latest_mint_time: datetime.datetime
+) -> Dict[str, ContractBuild]:
     admin_vkey, admin_skey, admin_address = get_signing_info(
         admin_wallet, network=network
     )
-    build_compressed(
-        "minting",
-        parameter_auth_nft.__file__,
-        args=[
-            plutus_cbor_dumps(PlutusByteString(admin_vkey.hash().payload)).hex(),
-            plutus_cbor_dumps(
-                PlutusInteger(ceil(latest_mint_time.timestamp()) * 1000)
-            ).hex(),
-        ],
-    )
+    return {
+        **source_builds(),
+        module_name(parameter_auth_nft): ContractBuild(
+            "minting",
+            parameter_auth_nft.__file__,
+            args=lambda policy_ids: [
+                plutus_cbor_dumps(PlutusByteString(admin_vkey.hash().payload)).hex(),
+                plutus_cbor_dumps(
+                    PlutusInteger(ceil(latest_mint_time.timestamp()) * 1000)
+                ).hex(),
+            ],
+        ),
+    }
+
+
+def build_parameters(name: str) -> dict:
+    """
+    The options and parameters the contract in build/ was built with, as recorded in the manifest.
+    Without a manifest, those that uada.build uses, applied to the contracts it depends on in build/.
+    """
+    entry = load_manifest().get(name)
+    if entry is not None:
+        return entry["parameters"]
+    contract = source_builds()[name]
+    return {
+        "cli_options": list(contract.cli_options),
+        "args": contract.args({d: built_policy_id(d) for d in contract.dependencies}),
+    }
+
+
+def built_latest_mint_time() -> Optional[datetime.datetime]:
+    """
+    The latest mint time that the built parameter auth NFT is parameterized with, None if it was not built
+    """
+    name = module_name(parameter_auth_nft)
+    entry = load_manifest().get(name)
+    if entry is not None:
+        _, latest_mint_time = entry["parameters"]["args"]
+        latest_mint_time = uplc.ast.data_from_cbor(bytes.fromhex(latest_mint_time))
+    elif build_dir.joinpath(name, "script.cbor").exists():
+        # built before the manifest, the last parameter is applied outermost to the plain contract
+        program = uplc.unflatten(
+            bytes.fromhex(build_dir.joinpath(name, "script.cbor").read_text().strip())
+        )
+        latest_mint_time = program.term.x
+    else:
+        return None
+    return datetime.datetime.fromtimestamp(latest_mint_time.value / 1000)
+
 
-    _, parameter_auth_nft_policy_id, _ = get_contract(
-        module_name(parameter_auth_nft), True
+def built_autotuned() -> bool:
+    """
+    Whether a compressed contract of the previous build was replaced by its cheapest variant
+    """
+    return any(
+        "compressed_variant" in entry["parameters"]
+        for entry in load_manifest().values()
     )
-    build_compressed(
-        "any",
-        uada.__file__,
-        args=[
-            plutus_cbor_dumps(
-                PlutusByteString(parameter_auth_nft_policy_id.payload)
-            ).hex(),
-        ],
-        cli_options=("--cf", "--force-three-params"),
+
+
+def main(
+    admin_wallet: str = "admin",
+    latest_mint_time: Optional[datetime.datetime] = None,
+    cache: bool = True,
+    autotune: Optional[bool] = None,
+):
+    """
+    Build all contracts and write the manifest.
+    Contracts whose sources, tools and parameters did not change are restored from build/.cache
+    unless cache is False.
+    With autotune, the compressed contracts are replaced by their cheapest variant, see uada.autotune.
+    :param latest_mint_time: until when the parameter auth NFT can be minted. By default the time of the previous build
+        is kept, so that the cached parameter auth NFT and uada are reused, or 30 days from now on the first build.
+    :param autotune: by default, only if the previous build was autotuned, as the cache restores the plain
+        compressed contracts
+    """
+    if latest_mint_time is None:
+        latest_mint_time = built_latest_mint_time() or (
+            datetime.datetime.now() + datetime.timedelta(days=30)
+        )
+    if autotune is None:
+        autotune = built_autotuned()
+    # the hashes of the previous build must not be used while building
+    build_dir.joinpath(MANIFEST_NAME).unlink(missing_ok=True)
+    load_manifest.cache_clear()
+    get_contract.cache_clear()
+
+    parameters = build_all(
+        contract_builds(admin_wallet, latest_mint_time),
+        cached_build if cache else build_compressed,
     )
+    write_manifest(parameters)
+    if autotune:
+        # uada.autotune compiles with the functions of this module
+        from . import autotune as autotune_module
+
+        autotune_module.main()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,510 @@
+"""
+Capacity planner: the largest transactions of every operation that fit the protocol limits.
+
+For minting, withdrawing, extending and partially withdrawing staking positions, transactions
+of growing shape (positions, wallet inputs, wallet outputs) are built with the builders of the off-chain code
+on an emulated chain, every script is evaluated on the compiled contracts and the shape is searched
+for the largest one within the maximum transaction size and execution units,
+and within the number of wallet UTxOs the coin selection spends (UADA_MAX_SELECTED_INPUTS).
+"""
+import hashlib
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import fire
+import pycardano
+
+from uada.benchmark import (
+    POSITION_AMOUNT,
+    WALLET_INPUT_AMOUNT,
+    fee_params,
+    tx_input,
+    wallet_address,
+)
+from uada.build import source_contract
+from uada.offchain.coin_selection import SELECTION_MARGIN
+from uada.offchain.mint_uada_batch import build_batch_mint
+from uada.offchain.util import (
+    HintingTransactionBuilder,
+    asset_from_token,
+    module_name,
+)
+from uada.offchain.withdraw_or_extend_uada_partial import (
+    build_extend_or_withdraw_partial,
+    find_position,
+)
+from uada.offchain.withdraw_uada_batch import build_batch_withdraw, find_positions
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.utils.contracts import get_contract
+from uada.utils.emulator import PROTOCOL_PARAMETERS, EmulatorChainContext
+from uada.utils.network import network
+from opshin.prelude import Token
+
+OPERATIONS = ("mint", "withdraw", "extend", "partial")
+DIMENSIONS = ("positions", "inputs", "outputs")
+# extend and partial withdraw always interact with a single position
+SINGLE_POSITION_OPERATIONS = ("extend", "partial")
+# lovelace added to the position when extending, removed when partially withdrawing
+EXTEND_AMOUNT = 5_000_000
+PARTIAL_AMOUNT = 2_000_000
+# lovelace of the wallet UTxOs holding NFTs or uADA, and of the additional wallet outputs
+FUNDING_AMOUNT = 2_000_000
+# lovelace of the wallet UTxO that is set aside as collateral
+COLLATERAL_AMOUNT = 5_000_000
+# the search stops at this size, even if larger transactions would fit
+MAX_SEARCHED = 512
+
+# the wallet that pays for the transactions and owns the positions
+WALLET_KEY = pycardano.PaymentSigningKey.generate()
+WALLET = pycardano.Address(WALLET_KEY.to_verification_key().hash(), network=network)
+
+
+@dataclass
+class Contracts:
+    uada: pycardano.PlutusV2Script
+    one_shot_nft: pycardano.PlutusV2Script
+    auth_nft_policy_id: pycardano.ScriptHash
+
+    @classmethod
+    def from_build(cls, compressed: bool = True) -> "Contracts":
+        uada_script, _, _ = get_contract(module_name(uada), compressed)
+        one_shot_nft_script, _, _ = get_contract(module_name(one_shot_nft), compressed)
+        # uada is always parameterized with the compressed auth nft, see uada.build
+        _, auth_nft_policy_id, _ = get_contract(module_name(parameter_auth_nft), True)
+        return cls(uada_script, one_shot_nft_script, auth_nft_policy_id)
+
+    @classmethod
+    def from_sources(cls, compressed: bool = False) -> "Contracts":
+        """
+        Compile the current sources in memory, with the options and parameters of the build, see uada.build.source_contract
+        """
+        uada_script, _ = source_contract(module_name(uada), compressed)
+        one_shot_nft_script, _ = source_contract(module_name(one_shot_nft), compressed)
+        _, auth_nft_policy_id, _ = get_contract(module_name(parameter_auth_nft), True)
+        return cls(uada_script, one_shot_nft_script, auth_nft_policy_id)
+
+
+def stake_key_hash(i: int) -> pycardano.VerificationKeyHash:
+    return pycardano.VerificationKeyHash(
+        hashlib.sha256(f"stake{i}".encode()).digest()[:28]
+    )
+
+
+def stake_key(i: int) -> str:
+    return pycardano.Address(staking_part=stake_key_hash(i), network=network).encode()
+
+
+def protocol_utxos(
+    emulator: EmulatorChainContext, contracts: Contracts, reference_scripts: bool
+) -> dict:
+    """
+    Place the fee parameters and the reference scripts on the emulated chain
+    :return: the keyword arguments of the transaction builders for them
+    """
+    params = fee_params()
+    param_utxo = emulator.add_utxo(
+        pycardano.TransactionOutput(
+            wallet_address(1),
+            pycardano.Value(
+                2_000_000,
+                pycardano.MultiAsset.from_primitive(
+                    {contracts.auth_nft_policy_id.payload: {b"": 1}}
+                ),
+            ),
+            datum=params,
+        )
+    )
+    ref_utxos = {}
+    for name, script in (
+        ("uada_ref_utxo", contracts.uada),
+        ("one_shot_nft_ref_utxo", contracts.one_shot_nft),
+    ):
+        ref_utxos[name] = (
+            emulator.add_utxo(
+                pycardano.TransactionOutput(
+                    pycardano.Address(
+                        pycardano.plutus_script_hash(script), network=network
+                    ),
+                    30_000_000,
+                    script=script,
+                )
+            )
+            if reference_scripts
+            else None
+        )
+    return dict(param_utxo=param_utxo, fee_params=params, **ref_utxos)
+
+
+def add_operation(
+    builder: HintingTransactionBuilder,
+    operation: str,
+    contracts: Contracts,
+    protocol: dict,
+    payment_utxos: List[pycardano.UTxO],
+    positions: int,
+    position_addresses: List[pycardano.Address],
+):
+    """
+    Add the operation to the builder with the builder of the off-chain code
+    """
+    one_shot_nft_hash = pycardano.plutus_script_hash(contracts.one_shot_nft)
+    if operation == "mint":
+        build_batch_mint(
+            builder,
+            payment_utxos,
+            [(str(WALLET), stake_key(i), POSITION_AMOUNT) for i in range(positions)],
+            uada_script=contracts.uada,
+            one_shot_nft_script=contracts.one_shot_nft,
+            **protocol,
+        )
+    elif operation == "withdraw":
+        build_batch_withdraw(
+            builder,
+            payment_utxos,
+            find_positions(
+                builder.context, position_addresses, payment_utxos, one_shot_nft_hash
+            ),
+            uada_script=contracts.uada,
+            one_shot_nft_script=contracts.one_shot_nft,
+            **protocol,
+        )
+    else:
+        (position_address,) = position_addresses
+        position_utxo, position_datum = find_position(
+            builder.context, position_address, one_shot_nft_hash
+        )
+        build_extend_or_withdraw_partial(
+            builder,
+            payment_utxos,
+            position_utxo,
+            position_datum,
+            EXTEND_AMOUNT if operation == "extend" else -PARTIAL_AMOUNT,
+            protocol["param_utxo"],
+            protocol["fee_params"],
+            contracts.uada,
+            protocol["uada_ref_utxo"],
+        )
+
+
+def operation_tx(
+    operation: str,
+    contracts: Contracts,
+    positions: int = 1,
+    inputs: int = 1,
+    outputs: int = 1,
+    reference_scripts: bool = True,
+    protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+) -> pycardano.Transaction:
+    """
+    Build and sign a transaction of the operation with the builders of the off-chain code,
+    on an emulated chain that evaluates the scripts.
+    The transaction may exceed the protocol limits, see exceeded_limit
+    :param positions: number of positions minted or withdrawn, ignored for extend and partial
+    :param inputs: number of wallet UTxOs that the coin selection has to spend to pay for the transaction,
+        i.e. the lovelace (or the burned uADA) is spread over them. When minting they include one UTxO per NFT,
+        otherwise the UTxOs holding the NFTs are spent on top
+    :param outputs: number of wallet outputs including the change, next to the treasury and position outputs.
+        The outputs next to the change are paid from a wallet input of their own
+    :param reference_scripts: whether the scripts are referenced, otherwise they are attached to the transaction
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation {operation}")
+    if operation in SINGLE_POSITION_OPERATIONS:
+        positions = 1
+    uada_hash = pycardano.plutus_script_hash(contracts.uada)
+    one_shot_nft_hash = pycardano.plutus_script_hash(contracts.one_shot_nft)
+    uada_token = Token(uada_hash.payload, b"uADA")
+    emulator = EmulatorChainContext(protocol_param, network=network)
+    protocol = protocol_utxos(emulator, contracts, reference_scripts)
+
+    nft_utxos, position_utxos, burned = [], [], 0
+    if operation == "mint":
+        inputs = max(inputs, positions)
+    else:
+        for i in range(positions):
+            nft = Token(
+                one_shot_nft_hash.payload, hashlib.sha256(f"nft{i}".encode()).digest()
+            )
+            position_utxos.append(
+                emulator.add_utxo(
+                    pycardano.TransactionOutput(
+                        pycardano.Address(
+                            uada_hash, stake_key_hash(i), network=network
+                        ),
+                        POSITION_AMOUNT,
+                        datum=pycardano.RawCBOR(
+                            uada.UAdaStakingPosition(
+                                nft.policy_id, nft.token_name
+                            ).to_cbor()
+                        ),
+                    )
+                )
+            )
+            nft_utxos.append(
+                emulator.add_utxo(
+                    pycardano.TransactionOutput(
+                        WALLET,
+                        pycardano.Value(FUNDING_AMOUNT, asset_from_token(nft, 1)),
+                    )
+                )
+            )
+        if operation == "withdraw":
+            burned = positions * POSITION_AMOUNT
+        elif operation == "partial":
+            burned = PARTIAL_AMOUNT
+    position_addresses = list(
+        {str(u.output.address): u.output.address for u in position_utxos}.values()
+    )
+
+    # the lovelace the wallet pays, from the outputs of a builder that is not built
+    dry_run = HintingTransactionBuilder(emulator)
+    add_operation(
+        dry_run,
+        operation,
+        contracts,
+        protocol,
+        nft_utxos
+        + [
+            pycardano.UTxO(
+                tx_input("dry_run", i),
+                pycardano.TransactionOutput(
+                    WALLET,
+                    pycardano.Value(
+                        WALLET_INPUT_AMOUNT * (positions + 1),
+                        asset_from_token(uada_token, burned),
+                    ),
+                ),
+            )
+            for i in range(positions)
+        ],
+        positions,
+        position_addresses,
+    )
+    required = sum(o.amount.coin for o in dry_run.outputs) - sum(
+        u.output.amount.coin for u in position_utxos
+    )
+    # the selection stops once the target is reached, so equal shares of it are all spent
+    target = required + SELECTION_MARGIN - sum(u.output.amount.coin for u in nft_utxos)
+    funding_utxos = [
+        emulator.add_utxo(
+            pycardano.TransactionOutput(
+                WALLET,
+                pycardano.Value(
+                    FUNDING_AMOUNT,
+                    asset_from_token(uada_token, math.ceil(burned / inputs)),
+                )
+                if burned
+                else math.ceil(max(target, inputs) / inputs),
+            )
+        )
+        for _ in range(inputs)
+    ]
+
+    builder = HintingTransactionBuilder(emulator, size_limited=False)
+    # the funding UTxOs may be too small to serve as collateral
+    builder.collaterals.append(
+        emulator.add_utxo(pycardano.TransactionOutput(WALLET, COLLATERAL_AMOUNT))
+    )
+    add_operation(
+        builder,
+        operation,
+        contracts,
+        protocol,
+        nft_utxos + funding_utxos,
+        positions,
+        position_addresses,
+    )
+    if outputs > 1:
+        # the input sorts after all inputs of the operation, so the input indices in its redeemers stay valid
+        output_funding = pycardano.UTxO(
+            pycardano.TransactionInput(pycardano.TransactionId(b"\xff" * 32), 0),
+            pycardano.TransactionOutput(WALLET, (outputs - 1) * FUNDING_AMOUNT),
+        )
+        emulator.ledger[output_funding.input] = output_funding.output
+        builder.add_input(output_funding)
+        for _ in range(outputs - 1):
+            builder.add_output(pycardano.TransactionOutput(WALLET, FUNDING_AMOUNT))
+    return builder.build_and_sign([WALLET_KEY], change_address=WALLET)
+
+
+def usage(
+    operation: str,
+    contracts: Contracts,
+    protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+    reference_scripts: bool = True,
+    **shape,
+) -> Dict[str, int]:
+    """
+    Size and execution units of the transaction of the operation of the given shape,
+    as declared by the transaction builder
+    """
+    tx = operation_tx(
+        operation,
+        contracts,
+        reference_scripts=reference_scripts,
+        protocol_param=protocol_param,
+        **shape,
+    )
+    redeemers = tx.transaction_witness_set.redeemer or []
+    return {
+        "size": len(tx.to_cbor()),
+        "mem": sum(r.ex_units.mem for r in redeemers),
+        "steps": sum(r.ex_units.steps for r in redeemers),
+    }
+
+
+def exceeded_limit(
+    used: Dict[str, int], protocol_param: pycardano.ProtocolParameters
+) -> Optional[str]:
+    """
+    The first protocol limit that the usage exceeds, None if it fits
+    """
+    limits = {
+        "size": protocol_param.max_tx_size,
+        "mem": protocol_param.max_tx_ex_mem,
+        "steps": protocol_param.max_tx_ex_steps,
+    }
+    return next((k for k, limit in limits.items() if used[k] > limit), None)
+
+
+def max_dimension(
+    operation: str,
+    dimension: str,
+    contracts: Contracts,
+    protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+    reference_scripts: bool = True,
+) -> Tuple[int, Optional[str]]:
+    """
+    The largest size of one dimension of the transaction shape that fits the protocol limits,
+    with all other dimensions at their minimum
+    :return: the size and the limit that the next larger size exceeds
+        (None if the search stopped at MAX_SEARCHED), the size is 0 if not even the smallest fits
+    """
+
+    def exceeded_at(size: int) -> Optional[str]:
+        try:
+            used = usage(
+                operation,
+                contracts,
+                protocol_param,
+                reference_scripts,
+                **{dimension: size},
+            )
+        except AssertionError as e:
+            # the coin selection spends at most UADA_MAX_SELECTED_INPUTS wallet UTxOs
+            if "inputs" not in str(e):
+                raise
+            return "selection"
+        return exceeded_limit(used, protocol_param)
+
+    # the costs grow with every dimension, so the largest fitting size is found by bisection
+    low, high, exceeded = 0, 1, None
+    while high <= MAX_SEARCHED:
+        exceeded = exceeded_at(high)
+        if exceeded is not None:
+            break
+        low, high = high, high * 2
+    else:
+        return low, None
+    while high - low > 1:
+        middle = (low + high) // 2
+        limit = exceeded_at(middle)
+        if limit is None:
+            low = middle
+        else:
+            high, exceeded = middle, limit
+    return low, exceeded
+
+
+def capacity(
+    contracts: Contracts,
+    protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+    reference_scripts: bool = True,
+    operations: Tuple[str, ...] = OPERATIONS,
+) -> dict:
+    """
+    For every operation, the share of the limits used by the smallest transaction
+    and the largest size of every dimension of the transaction shape
+    """
+    results = {}
+    for operation in operations:
+        used = usage(operation, contracts, protocol_param, reference_scripts)
+        results[operation] = {
+            "headroom": {
+                "size": 1 - used["size"] / protocol_param.max_tx_size,
+                "mem": 1 - used["mem"] / protocol_param.max_tx_ex_mem,
+                "steps": 1 - used["steps"] / protocol_param.max_tx_ex_steps,
+            },
+            "max": {
+                dimension: dict(
+                    zip(
+                        ("size", "limit"),
+                        max_dimension(
+                            operation,
+                            dimension,
+                            contracts,
+                            protocol_param,
+                            reference_scripts,
+                        ),
+                    )
+                )
+                for dimension in DIMENSIONS
+                if dimension != "positions"
+                or operation not in SINGLE_POSITION_OPERATIONS
+            },
+        }
+    return results
+
+
+def main(
+    live: bool = False,
+    reference_scripts: bool = True,
+    build: bool = False,
+    output: Optional[str] = None,
+):
+    """
+    Print the largest number of positions, wallet inputs and wallet outputs per transaction
+    of every operation, for the compressed and uncompressed build of the contracts
+    :param live: use the protocol parameters of the connected chain instead of the mainnet defaults
+    :param reference_scripts: whether the scripts are referenced, otherwise they are attached to the transaction
+    :param build: use the contracts in build/ instead of compiling the current sources
+    :param output: if given, write the results as JSON to this file
+    """
+    if live:
+        from uada.utils.network import context
+
+        protocol_param = context.protocol_param
+    else:
+        protocol_param = PROTOCOL_PARAMETERS
+    print(
+        f"limits: {protocol_param.max_tx_size} bytes, "
+        f"{protocol_param.max_tx_ex_mem} mem, {protocol_param.max_tx_ex_steps} steps"
+    )
+    results = {}
+    for compressed in (True, False):
+        name = "compressed" if compressed else "uncompressed"
+        contracts = (
+            Contracts.from_build(compressed)
+            if build
+            else Contracts.from_sources(compressed)
+        )
+        results[name] = capacity(contracts, protocol_param, reference_scripts)
+        print(name)
+        for operation, c in results[name].items():
+            headroom = " ".join(f"{k} {v:.0%}" for k, v in c["headroom"].items())
+            maxima = " ".join(
+                f"{dimension} {m['size']}"
+                + (f" ({m['limit']})" if m["limit"] is not None else "+")
+                for dimension, m in c["max"].items()
+            )
+            print(f"  {operation:<9} headroom: {headroom:<28} max: {maxima}")
+    if output is not None:
+        Path(output).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"wrote capacity to {output}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
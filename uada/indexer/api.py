@@ -0,0 +1,148 @@
+"""
+HTTP service answering queries about staking positions and the protocol from the position index.
+
+Responses are cached until the indexer processes a new block,
+so repeated polling does not cause any queries to Ogmios or Kupo.
+The handlers are plain functions that run in the thread pool, as the index is queried with blocking peewee calls.
+"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import fire
+import pycardano
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.decorator import cache
+
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.offchain.util import module_name
+from . import queries
+from .models import IndexedUtxo, Position, index_db_path, init_database
+
+# seconds between checks whether the indexer processed a new block
+TIP_POLL_INTERVAL = 1
+# seconds after which responses expire even if no new block was observed
+CACHE_EXPIRE = 600
+
+
+def utxo_json(utxo: IndexedUtxo) -> dict:
+    return {"tx_id": utxo.tx_id, "index": utxo.index, "address": utxo.address}
+
+
+def position_json(position: Position) -> dict:
+    return {
+        **utxo_json(position),
+        "nft_policy_id": position.nft_policy_id,
+        "nft_name": position.nft_name,
+        "stake_key": position.stake_key,
+        "lovelace": position.lovelace,
+    }
+
+
+async def clear_cache_on_new_block(last_tip: Optional[int]) -> Optional[int]:
+    """
+    Clear all cached responses if the indexer processed or rolled back a block since last_tip
+    :return: the slot of the current tip
+    """
+    tip = await run_in_threadpool(queries.tip)
+    tip_slot = tip.slot if tip is not None else None
+    if tip_slot != last_tip:
+        await FastAPICache.clear()
+    return tip_slot
+
+
+async def watch_tip():
+    last_tip = None
+    while True:
+        last_tip = await clear_cache_on_new_block(last_tip)
+        await asyncio.sleep(TIP_POLL_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_database(index_db_path)
+    FastAPICache.init(InMemoryBackend(), prefix="uada-api", expire=CACHE_EXPIRE)
+    watcher = asyncio.create_task(watch_tip())
+    yield
+    watcher.cancel()
+
+
+app = FastAPI(title="uADA", lifespan=lifespan)
+
+
+@app.get("/positions/stake_key/{stake_key}")
+@cache()
+def positions_by_stake_key(stake_key: str) -> list:
+    return [position_json(p) for p in queries.positions_by_stake_key(stake_key)]
+
+
+@app.get("/positions/nft/{nft_name}")
+@cache()
+def positions_by_nft(nft_name: str) -> list:
+    """
+    :param nft_name: hex encoded name of the one-shot NFT
+    """
+    try:
+        name = bytes.fromhex(nft_name)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="NFT name is not hex encoded")
+    return [position_json(p) for p in queries.positions_by_nft(name)]
+
+
+@app.get("/positions/owner/{address}")
+@cache()
+def positions_by_owner(address: str) -> list:
+    try:
+        owner = pycardano.Address.from_primitive(address)
+    except (TypeError, ValueError, pycardano.DecodingException):
+        raise HTTPException(status_code=400, detail="Invalid address")
+    return [position_json(p) for p in queries.positions_by_owner(owner)]
+
+
+@app.get("/fee_params")
+@cache()
+def fee_params() -> dict:
+    param_utxo, params = queries.fee_params()
+    if param_utxo is None:
+        raise HTTPException(status_code=404, detail="No fee parameters found")
+    return {**utxo_json(param_utxo), "fee_params": json.loads(params.to_json())}
+
+
+@app.get("/reference_scripts")
+@cache()
+def reference_scripts() -> dict:
+    """
+    The reference script UTxOs of the contracts, by module name
+    """
+    res = {}
+    for contract in (uada, one_shot_nft, parameter_auth_nft):
+        ref_utxo = queries.protocol_utxo(module_name(contract))
+        res[module_name(contract)] = (
+            utxo_json(ref_utxo) if ref_utxo is not None else None
+        )
+    return res
+
+
+@app.get("/totals")
+@cache()
+def totals() -> dict:
+    return {
+        "circulating_uada": queries.circulating_uada(),
+        "total_locked_lovelace": queries.total_locked_lovelace(),
+    }
+
+
+def main(host: str = "0.0.0.0", port: int = 8000):
+    """
+    Serve the queries, the position index is kept up to date by uada.indexer.sync
+    """
+    uvicorn.run(app, host=host, port=port)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
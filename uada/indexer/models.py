@@ -0,0 +1,130 @@
+import json
+import os
+
+import peewee
+import pycardano
+
+index_db_path = os.getenv("UADA_INDEX_DB", "uada_index.db")
+
+# bound to the actual database by init_database, so tests can use an in-memory database
+database = peewee.DatabaseProxy()
+
+
+class BaseModel(peewee.Model):
+    class Meta:
+        database = database
+
+
+class Block(BaseModel):
+    """
+    A block that was processed by the indexer, used to resume and roll back chain-sync
+    """
+
+    slot = peewee.IntegerField(primary_key=True)
+    id = peewee.CharField(unique=True)
+    height = peewee.IntegerField()
+
+
+class IndexedUtxo(BaseModel):
+    tx_id = peewee.CharField()
+    index = peewee.IntegerField()
+    address = peewee.CharField()
+    # the output as provided by Ogmios, to reconstruct the UTxO for building transactions
+    output = peewee.TextField()
+    created_slot = peewee.IntegerField(index=True)
+    spent_tx_id = peewee.CharField(null=True)
+    spent_slot = peewee.IntegerField(null=True, index=True)
+
+    def utxo(self) -> pycardano.UTxO:
+        output = json.loads(self.output)
+        multi_asset = pycardano.MultiAsset()
+        for policy_id, assets in output["value"].items():
+            if policy_id == "ada":
+                continue
+            multi_asset[
+                pycardano.ScriptHash.from_primitive(policy_id)
+            ] = pycardano.Asset(
+                {
+                    pycardano.AssetName(bytes.fromhex(name)): amount
+                    for name, amount in assets.items()
+                }
+            )
+        return pycardano.UTxO(
+            pycardano.TransactionInput.from_primitive([self.tx_id, self.index]),
+            pycardano.TransactionOutput(
+                pycardano.Address.from_primitive(self.address),
+                pycardano.Value(output["value"]["ada"]["lovelace"], multi_asset),
+                datum_hash=pycardano.DatumHash.from_primitive(output["datumHash"])
+                if "datumHash" in output
+                else None,
+                datum=pycardano.RawCBOR(bytes.fromhex(output["datum"]))
+                if "datum" in output
+                else None,
+                # stored by the indexer in the form expected by pycardano
+                script=pycardano.PlutusV2Script(bytes.fromhex(output["script"]["cbor"]))
+                if "script" in output
+                else None,
+            ),
+        )
+
+    class Meta:
+        indexes = ((("tx_id", "index"), True),)
+
+
+class Position(IndexedUtxo):
+    """
+    A UTxO at the uADA contract holding a UAdaStakingPosition datum
+    """
+
+    # the one-shot NFT that unlocks the position
+    nft_policy_id = peewee.CharField()
+    nft_name = peewee.CharField(index=True)
+    # bech32 stake address of the position, None if it is not delegated
+    stake_key = peewee.CharField(null=True, index=True)
+    lovelace = peewee.BigIntegerField()
+
+
+class PositionNft(IndexedUtxo):
+    """
+    A UTxO holding one or more one-shot NFTs of staking positions, its address is the owner of the positions
+    """
+
+    # hex payment key hash or script hash of the address
+    owner = peewee.CharField(index=True)
+
+
+class PositionNftName(BaseModel):
+    nft = peewee.ForeignKeyField(PositionNft, backref="names", on_delete="CASCADE")
+    name = peewee.CharField(index=True)
+
+
+class ProtocolUtxo(IndexedUtxo):
+    """
+    A UTxO the protocol depends on: the fee parameters or a reference script of one of the contracts
+    """
+
+    # FEE_PARAMS or the module name of the contract whose reference script is held
+    kind = peewee.CharField(index=True)
+
+
+FEE_PARAMS = "fee_params"
+
+
+class UAdaMint(BaseModel):
+    """
+    The amount of uADA minted (or burned, if negative) by a transaction
+    """
+
+    tx_id = peewee.CharField(unique=True)
+    slot = peewee.IntegerField(index=True)
+    amount = peewee.BigIntegerField()
+
+
+MODELS = [Block, Position, PositionNft, PositionNftName, ProtocolUtxo, UAdaMint]
+
+
+def init_database(path: str) -> peewee.SqliteDatabase:
+    db = peewee.SqliteDatabase(path, pragmas={"journal_mode": "wal", "foreign_keys": 1})
+    database.initialize(db)
+    db.create_tables(MODELS)
+    return db
@@ -0,0 +1,99 @@
+from typing import List, Optional, Tuple
+
+import peewee
+import pycardano
+
+from uada.onchain.uada import UAdaFeeParams
+from .models import (
+    FEE_PARAMS,
+    Block,
+    Position,
+    PositionNft,
+    PositionNftName,
+    ProtocolUtxo,
+    UAdaMint,
+)
+
+
+def unspent_positions() -> peewee.ModelSelect:
+    return Position.select().where(Position.spent_tx_id.is_null())
+
+
+def positions_by_nft(nft_name: bytes) -> List[Position]:
+    return list(unspent_positions().where(Position.nft_name == nft_name.hex()))
+
+
+def positions_by_stake_key(stake_key: str) -> List[Position]:
+    return list(unspent_positions().where(Position.stake_key == stake_key))
+
+
+def positions_by_owner(owner: pycardano.Address) -> List[Position]:
+    """
+    All unspent positions whose one-shot NFT is held at an address with the payment part of the owner
+    """
+    owned_nft_names = (
+        PositionNftName.select(PositionNftName.name)
+        .join(PositionNft)
+        .where(
+            (PositionNft.owner == owner.payment_part.payload.hex())
+            & PositionNft.spent_tx_id.is_null()
+        )
+    )
+    return list(unspent_positions().where(Position.nft_name.in_(owned_nft_names)))
+
+
+def nft_utxo(nft_name: bytes) -> PositionNft:
+    """
+    The unspent UTxO holding the one-shot NFT of the given name, None if it is not known
+    """
+    return (
+        PositionNft.select()
+        .join(PositionNftName)
+        .where(
+            (PositionNftName.name == nft_name.hex()) & PositionNft.spent_tx_id.is_null()
+        )
+        .first()
+    )
+
+
+def protocol_utxo(kind: str) -> Optional[ProtocolUtxo]:
+    """
+    The most recent unspent protocol UTxO of the given kind, None if there is none
+    """
+    return (
+        ProtocolUtxo.select()
+        .where((ProtocolUtxo.kind == kind) & ProtocolUtxo.spent_tx_id.is_null())
+        .order_by(ProtocolUtxo.created_slot.desc())
+        .first()
+    )
+
+
+def fee_params() -> Tuple[Optional[ProtocolUtxo], Optional[UAdaFeeParams]]:
+    param_utxo = protocol_utxo(FEE_PARAMS)
+    if param_utxo is None:
+        return None, None
+    return param_utxo, UAdaFeeParams.from_cbor(param_utxo.utxo().output.datum.cbor)
+
+
+def circulating_uada() -> int:
+    return UAdaMint.select(
+        peewee.fn.COALESCE(peewee.fn.SUM(UAdaMint.amount), 0)
+    ).scalar()
+
+
+def total_locked_lovelace() -> int:
+    """
+    The lovelace locked in all unspent staking positions
+    """
+    return (
+        Position.select(peewee.fn.COALESCE(peewee.fn.SUM(Position.lovelace), 0))
+        .where(Position.spent_tx_id.is_null())
+        .scalar()
+    )
+
+
+def tip() -> Optional[Block]:
+    """
+    The most recent indexed block
+    """
+    return Block.select().order_by(Block.slot.desc()).first()
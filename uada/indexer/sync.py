@@ -0,0 +1,279 @@
+"""
+Follows the chain through Ogmios chain-sync and indexes all uADA staking positions,
+the UTxOs holding their one-shot NFTs, the fee parameters, the reference scripts
+and the minted uADA in an SQLite database.
+"""
+import json
+from typing import Dict, List, Optional, Tuple, Union
+
+import cbor2
+import fire
+import ogmios
+import peewee
+import pycardano
+
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.offchain.util import module_name
+from uada.utils.contracts import get_contract
+from uada.utils.network import ogmios_host, ogmios_port, ogmios_protocol, network
+from .models import (
+    FEE_PARAMS,
+    Block,
+    Position,
+    PositionNft,
+    PositionNftName,
+    ProtocolUtxo,
+    UAdaMint,
+    index_db_path,
+    init_database,
+)
+
+# number of blocks after which a block can no longer be rolled back (security parameter k)
+ROLLBACK_DEPTH = 2160
+# spent inputs marked per update, each binds five SQL variables (SQLite allows 999 in older versions)
+SPENT_BATCH_SIZE = 150
+
+
+def payment_part(address: pycardano.Address) -> str:
+    return address.payment_part.payload.hex()
+
+
+def reference_script_cbor(
+    script: dict, script_hash: pycardano.ScriptHash
+) -> Optional[str]:
+    """
+    The script in the form expected by pycardano if it has the given hash, None otherwise
+    """
+    if script.get("language") != "plutus:v2":
+        return None
+    script_bytes = bytes.fromhex(script["cbor"])
+    # depending on the source, the script is wrapped in a CBOR byte string once more
+    for candidate in (script_bytes, cbor2.dumps(script_bytes)):
+        if pycardano.plutus_script_hash(pycardano.PlutusV2Script(candidate)) == (
+            script_hash
+        ):
+            return candidate.hex()
+    return None
+
+
+class PositionIndexer:
+    """
+    Applies blocks and rollbacks reported by chain-sync to the position index
+    """
+
+    def __init__(
+        self,
+        uada_script_hash: pycardano.ScriptHash,
+        one_shot_nft_policy_id: pycardano.ScriptHash,
+        parameter_auth_nft_policy_id: pycardano.ScriptHash,
+        network: pycardano.Network,
+    ):
+        self.uada_script_hash = uada_script_hash
+        self.one_shot_nft_policy_id = one_shot_nft_policy_id.payload.hex()
+        self.parameter_auth_nft_policy_id = parameter_auth_nft_policy_id.payload.hex()
+        self.network = network
+        # reference scripts are held at the address of their own contract
+        self.reference_scripts = {
+            uada_script_hash: module_name(uada),
+            one_shot_nft_policy_id: module_name(one_shot_nft),
+            parameter_auth_nft_policy_id: module_name(parameter_auth_nft),
+        }
+
+    @staticmethod
+    def datum_cbor(tx: dict, output: dict) -> Optional[bytes]:
+        if "datum" in output:
+            datum_cbor = output["datum"]
+        elif "datumHash" in output:
+            datum_cbor = tx.get("datums", {}).get(output["datumHash"])
+        else:
+            datum_cbor = None
+        return bytes.fromhex(datum_cbor) if datum_cbor is not None else None
+
+    def position_datum(
+        self, tx: dict, output: dict
+    ) -> Optional[uada.UAdaStakingPosition]:
+        try:
+            position = uada.UAdaStakingPosition.from_cbor(self.datum_cbor(tx, output))
+        except Exception:
+            return None
+        if position.policy_id.hex() != self.one_shot_nft_policy_id:
+            return None
+        return position
+
+    def index_output(self, tx: dict, index: int, output: dict, slot: int):
+        nft_names = list(output["value"].get(self.one_shot_nft_policy_id, {}))
+        if not output["address"].startswith("addr"):
+            # byron addresses can not hold positions or NFTs
+            return
+        address = pycardano.Address.from_primitive(output["address"])
+        utxo = dict(
+            tx_id=tx["id"],
+            index=index,
+            address=output["address"],
+            output=json.dumps(output),
+            created_slot=slot,
+        )
+        if nft_names:
+            nft = PositionNft.create(owner=payment_part(address), **utxo)
+            PositionNftName.insert_many(
+                [{"nft": nft, "name": name} for name in nft_names]
+            ).execute()
+        if self.parameter_auth_nft_policy_id in output["value"]:
+            try:
+                uada.UAdaFeeParams.from_cbor(self.datum_cbor(tx, output))
+            except Exception:
+                pass
+            else:
+                ProtocolUtxo.create(kind=FEE_PARAMS, **utxo)
+        if "script" in output and address.payment_part in self.reference_scripts:
+            script_cbor = reference_script_cbor(output["script"], address.payment_part)
+            if script_cbor is not None:
+                output = {**output, "script": {**output["script"], "cbor": script_cbor}}
+                ProtocolUtxo.create(
+                    kind=self.reference_scripts[address.payment_part],
+                    **{**utxo, "output": json.dumps(output)},
+                )
+        if address.payment_part != self.uada_script_hash:
+            return
+        position = self.position_datum(tx, output)
+        if position is None:
+            return
+        Position.create(
+            nft_policy_id=self.one_shot_nft_policy_id,
+            nft_name=position.token_name.hex(),
+            stake_key=str(
+                pycardano.Address(
+                    staking_part=address.staking_part, network=self.network
+                )
+            )
+            if address.staking_part is not None
+            else None,
+            lovelace=output["value"]["ada"]["lovelace"],
+            **utxo,
+        )
+
+    def roll_forward(
+        self, slot: int, block_id: str, height: int, transactions: List[dict]
+    ):
+        with Block._meta.database.atomic():
+            spent = {}
+            for tx in transactions:
+                # the collateral is consumed instead of the inputs if phase-2 validation failed
+                failed = tx.get("spends", "inputs") == "collaterals"
+                for i in tx.get("collaterals" if failed else "inputs", []):
+                    spent[(i["transaction"]["id"], i["index"])] = tx["id"]
+                if failed:
+                    continue
+                minted = (
+                    tx.get("mint", {})
+                    .get(self.uada_script_hash.payload.hex(), {})
+                    .get(b"uADA".hex())
+                )
+                if minted:
+                    UAdaMint.create(tx_id=tx["id"], slot=slot, amount=minted)
+                for index, output in enumerate(tx["outputs"]):
+                    self.index_output(tx, index, output, slot)
+            self.mark_spent(spent, slot)
+            Block.create(slot=slot, id=block_id, height=height)
+            Block.delete().where(Block.height <= height - ROLLBACK_DEPTH).execute()
+
+    @staticmethod
+    def mark_spent(spent: Dict[Tuple[str, int], str], slot: int):
+        """
+        Mark the indexed UTxOs among the spent inputs as spent, with one update per model and batch of inputs
+        :param spent: the spending transaction by input (transaction id and index)
+        """
+        inputs = list(spent)
+        for start in range(0, len(inputs), SPENT_BATCH_SIZE):
+            batch = inputs[start : start + SPENT_BATCH_SIZE]
+            for model in (Position, PositionNft, ProtocolUtxo):
+                spent_tx_id = peewee.Case(
+                    None,
+                    [
+                        (
+                            (model.tx_id == tx_id) & (model.index == index),
+                            spent[tx_id, index],
+                        )
+                        for tx_id, index in batch
+                    ],
+                )
+                model.update(spent_tx_id=spent_tx_id, spent_slot=slot).where(
+                    peewee.Tuple(model.tx_id, model.index).in_(batch)
+                    & model.spent_tx_id.is_null()
+                ).execute()
+
+    def roll_backward(self, slot: int):
+        """
+        Undo all blocks after the given slot
+        """
+        with Block._meta.database.atomic():
+            for model in (Position, PositionNft, ProtocolUtxo):
+                model.delete().where(model.created_slot > slot).execute()
+                model.update(spent_tx_id=None, spent_slot=None).where(
+                    model.spent_slot > slot
+                ).execute()
+            UAdaMint.delete().where(UAdaMint.slot > slot).execute()
+            Block.delete().where(Block.slot > slot).execute()
+
+    def intersection_points(self) -> List[ogmios.Point]:
+        """
+        The most recent blocks of the index, to find the point from which to resume chain-sync
+        """
+        return [
+            ogmios.Point(slot=b.slot, id=b.id)
+            for b in Block.select().order_by(Block.slot.desc()).limit(100)
+        ]
+
+
+def follow(
+    client: ogmios.Client,
+    indexer: PositionIndexer,
+    start_points: List[Union[ogmios.Point, ogmios.Origin]],
+):
+    """
+    Apply all blocks and rollbacks reported by chain-sync, resuming from the last indexed block
+    """
+    client.find_intersection.execute(indexer.intersection_points() + start_points)
+    while True:
+        direction, tip, block, _ = client.next_block.execute()
+        if direction == ogmios.Direction.backward:
+            indexer.roll_backward(block.slot if isinstance(block, ogmios.Point) else -1)
+        elif hasattr(block, "slot"):
+            # epoch boundary blocks carry no transactions
+            indexer.roll_forward(
+                block.slot, block.id, block.height, block.transactions or []
+            )
+
+
+def main(
+    start_slot: Optional[int] = None,
+    start_block_id: Optional[str] = None,
+    db_path: str = index_db_path,
+):
+    """
+    Index all staking positions, following the chain forever
+    :param start_slot: slot of the block from which to index if the index is empty, defaults to the origin
+    :param start_block_id: hash of that block
+    """
+    init_database(db_path)
+    _, uada_script_hash, _ = get_contract(module_name(uada), True)
+    _, one_shot_nft_policy_id, _ = get_contract(module_name(one_shot_nft), True)
+    _, auth_nft_policy_id, _ = get_contract(module_name(parameter_auth_nft), True)
+    indexer = PositionIndexer(
+        uada_script_hash, one_shot_nft_policy_id, auth_nft_policy_id, network
+    )
+    start_points = (
+        [ogmios.Point(slot=start_slot, id=start_block_id)]
+        if start_slot is not None
+        else [ogmios.Origin()]
+    )
+    with ogmios.Client(
+        host=ogmios_host,
+        port=int(ogmios_port),
+        secure=ogmios_protocol == "wss",
+    ) as client:
+        follow(client, indexer, start_points)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
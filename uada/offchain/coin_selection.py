@@ -0,0 +1,175 @@
+"""
+Selection of the wallet UTxOs that pay for a transaction.
+
+The builders add the selected UTxOs as explicit inputs and compute the redeemer indices from them,
+so only the selected UTxOs may end up in the transaction.
+"""
+import os
+import random
+from typing import Callable, List, Optional, Sequence
+
+import pycardano
+
+from uada.utils.reservations import UtxoReservations
+
+# maximum number of wallet UTxOs spent by a transaction
+max_selected_inputs = int(os.getenv("UADA_MAX_SELECTED_INPUTS", "20"))
+
+# lovelace selected on top of the required amount to cover the transaction fee and the change output
+SELECTION_MARGIN = 5_000_000
+
+Strategy = Callable[
+    [List[pycardano.UTxO], List[pycardano.UTxO], int, int], List[pycardano.UTxO]
+]
+
+
+def lovelace(utxo: pycardano.UTxO) -> int:
+    return utxo.output.amount.coin
+
+
+def asset_amount(
+    utxo: pycardano.UTxO, policy_id: pycardano.ScriptHash, name: pycardano.AssetName
+) -> int:
+    return utxo.output.amount.multi_asset.get(policy_id, {}).get(name, 0)
+
+
+def cover_assets(
+    selected: List[pycardano.UTxO],
+    available: List[pycardano.UTxO],
+    required_assets: pycardano.MultiAsset,
+) -> List[pycardano.UTxO]:
+    """
+    Add the UTxOs holding most of each required asset until the selected UTxOs hold the required amount
+    """
+    selected = list(selected)
+    for policy_id, assets in required_assets.items():
+        for name, amount in assets.items():
+            held = sum(asset_amount(u, policy_id, name) for u in selected)
+            holding = [
+                u
+                for u in available
+                if u not in selected and asset_amount(u, policy_id, name) > 0
+            ]
+            for u in sorted(
+                holding, key=lambda u: asset_amount(u, policy_id, name), reverse=True
+            ):
+                if held >= amount:
+                    break
+                selected.append(u)
+                held += asset_amount(u, policy_id, name)
+            assert (
+                held >= amount
+            ), f"The wallet does not hold {amount} of {policy_id.payload.hex()}.{name.payload.hex()}"
+    return selected
+
+
+def largest_first(
+    selected: List[pycardano.UTxO],
+    available: List[pycardano.UTxO],
+    target: int,
+    max_inputs: int,
+) -> List[pycardano.UTxO]:
+    """
+    Add the UTxOs with the most lovelace until the target is reached
+    """
+    selected = list(selected)
+    total = sum(lovelace(u) for u in selected)
+    for u in sorted(available, key=lovelace, reverse=True):
+        if total >= target or len(selected) >= max_inputs:
+            break
+        selected.append(u)
+        total += lovelace(u)
+    return selected
+
+
+def random_improve(
+    selected: List[pycardano.UTxO],
+    available: List[pycardano.UTxO],
+    target: int,
+    max_inputs: int,
+    rng: Optional[random.Random] = None,
+) -> List[pycardano.UTxO]:
+    """
+    Add random UTxOs until the target is reached, then keep adding random UTxOs
+    as long as they bring the selected amount closer to twice the target without exceeding three times the target.
+    The change outputs then tend to have a similar size as the payments, which keeps the wallet fit for future selections (CIP-2).
+    Falls back to largest first if the random UTxOs do not reach the target within the input limit.
+    """
+    rng = rng or random.Random()
+    remaining = list(available)
+    rng.shuffle(remaining)
+    selection = list(selected)
+    total = sum(lovelace(u) for u in selection)
+    while total < target and remaining and len(selection) < max_inputs:
+        u = remaining.pop()
+        selection.append(u)
+        total += lovelace(u)
+    if total < target:
+        return largest_first(selected, available, target, max_inputs)
+    ideal, maximum = 2 * target, 3 * target
+    for u in remaining:
+        if len(selection) >= max_inputs:
+            break
+        improved = total + lovelace(u)
+        if abs(ideal - improved) < abs(ideal - total) and improved <= maximum:
+            selection.append(u)
+            total = improved
+    return selection
+
+
+def select_utxos(
+    utxos: Sequence[pycardano.UTxO],
+    required_lovelace: int,
+    required_utxos: Sequence[pycardano.UTxO] = (),
+    min_inputs: int = 0,
+    max_inputs: int = max_selected_inputs,
+    strategy: Strategy = largest_first,
+    reservations: Optional[UtxoReservations] = None,
+    required_assets: Optional[pycardano.MultiAsset] = None,
+) -> List[pycardano.UTxO]:
+    """
+    Select the wallet UTxOs that pay for the transaction
+    :param required_lovelace: lovelace that the wallet has to add to the transaction, the selection margin is added to it
+    :param required_utxos: UTxOs that have to be spent, e.g. the one holding the NFT of a position. They are selected first.
+    :param min_inputs: the minimum number of selected UTxOs, e.g. one per one-shot NFT that is minted
+    :param reservations: if given, only unreserved UTxOs are selected and the selected UTxOs are reserved
+    :param required_assets: native assets that the wallet has to add to the transaction, e.g. the uADA that is burned.
+      The UTxOs holding most of them are selected after the required UTxOs.
+    :return: the selected UTxOs, the required UTxOs first, then the UTxOs holding the required assets
+      and the UTxOs with most lovelace if min_inputs requires more
+    """
+    if reservations is not None:
+        with reservations.lock:
+            assert not any(
+                reservations.is_reserved(u) for u in required_utxos
+            ), "A required UTxO is reserved by another transaction"
+            selected = select_utxos(
+                reservations.unreserved(utxos),
+                required_lovelace,
+                required_utxos,
+                min_inputs,
+                max_inputs,
+                strategy,
+                required_assets=required_assets,
+            )
+            reservations.reserve(selected)
+            return selected
+    selected = list(required_utxos)
+    if required_assets:
+        selected = cover_assets(selected, list(utxos), required_assets)
+    available = [u for u in utxos if u not in selected]
+    missing = min_inputs - len(selected)
+    if missing > 0:
+        available.sort(key=lovelace, reverse=True)
+        selected += available[:missing]
+        available = available[missing:]
+    assert (
+        len(selected) <= max_inputs
+    ), f"At least {len(selected)} inputs needed, more than the limit of {max_inputs}"
+    target = required_lovelace + SELECTION_MARGIN
+    selected = strategy(selected, available, target, max_inputs)
+    # if the whole wallet is selected, the builder reports whether the balance suffices
+    assert sum(lovelace(u) for u in selected) >= target or all(
+        u in selected for u in available
+    ), f"The wallet can not provide {target} lovelace in at most {max_inputs} inputs"
+    return selected
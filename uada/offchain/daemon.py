@@ -0,0 +1,416 @@
+"""
+Resident transaction builder.
+
+Keeps the contracts, keys, chain connection and protocol state loaded between requests
+and returns unsigned transactions (or transactions signed by the wallet of the daemon) over HTTP.
+The protocol state is kept up to date by following the chain, so it is only queried again
+when a block spends one of the UTxOs it was loaded from.
+"""
+import copy
+import threading
+import time
+from typing import Callable, List, Optional
+
+import fire
+import ogmios
+import pycardano
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from pycardano import AuxiliaryData, AlonzoMetadata, Metadata
+
+from uada.indexer.sync import follow
+from uada.utils.network import (
+    context,
+    network,
+    ogmios_host,
+    ogmios_port,
+    ogmios_protocol,
+)
+from .mint_uada_batch import build_batch_mint
+from .protocol_state import ProtocolState
+from .util import HintingTransactionBuilder, combine_with_stake_key
+from .withdraw_or_extend_uada_partial import (
+    build_extend_or_withdraw_partial,
+    find_position,
+)
+from .withdraw_uada_batch import build_batch_withdraw, find_positions
+from ..utils import get_signing_info
+from ..utils.local_evaluation import LocalEvaluationContext
+from ..utils.reservations import (
+    ReservingChainContext,
+    UtxoReservations,
+    reservations_of,
+)
+
+# seconds to wait before reconnecting to chain-sync after the connection was lost
+FOLLOW_RETRY_INTERVAL = 5
+
+
+class StateFollower:
+    """
+    Applies the blocks reported by chain-sync to the protocol state and the UTxO reservations.
+    The state is only changed under the lock, which the daemon holds while it refreshes and copies the state.
+    """
+
+    def __init__(
+        self,
+        state: ProtocolState,
+        reservations: Optional[UtxoReservations] = None,
+        lock: Optional[threading.Lock] = None,
+    ):
+        self.state = state
+        self.reservations = reservations
+        self.lock = lock or threading.Lock()
+
+    def intersection_points(self) -> list:
+        return []
+
+    def roll_forward(self, slot: int, block_id: str, height: int, transactions: list):
+        with self.lock:
+            self.state.roll_forward(transactions)
+        if self.reservations is not None:
+            self.reservations.roll_forward(transactions)
+
+    def roll_backward(self, slot: int):
+        self.invalidate()
+        if self.reservations is not None:
+            self.reservations.roll_backward()
+
+    def invalidate(self):
+        with self.lock:
+            self.state.roll_backward()
+
+
+def follow_chain(
+    state: ProtocolState,
+    reservations: Optional[UtxoReservations] = None,
+    lock: Optional[threading.Lock] = None,
+):
+    """
+    Invalidate the state whenever a block spends one of its UTxOs, starting at the current tip.
+    While the connection is lost no blocks are seen, so the state is invalidated before reconnecting.
+    :param lock: the lock that guards the state, see TransactionDaemon
+    """
+    follower = StateFollower(state, reservations, lock)
+    while True:
+        try:
+            with ogmios.Client(
+                host=ogmios_host,
+                port=int(ogmios_port),
+                secure=ogmios_protocol == "wss",
+            ) as client:
+                tip, _ = client.query_network_tip.execute()
+                follower.invalidate()
+                follow(client, follower, [tip])
+        except Exception as e:
+            print(f"Lost chain-sync connection: {e}")
+        follower.invalidate()
+        time.sleep(FOLLOW_RETRY_INTERVAL)
+
+
+class TransactionDaemon:
+    """
+    Builds uADA transactions against a warm protocol state
+    """
+
+    def __init__(
+        self,
+        context: pycardano.ChainContext,
+        state: ProtocolState,
+        signing_key: Optional[pycardano.PaymentSigningKey] = None,
+    ):
+        self.context = context
+        self.state = state
+        self.signing_key = signing_key
+        self._lock = threading.Lock()
+
+    def protocol_state(self) -> ProtocolState:
+        """
+        A consistent copy of the protocol state, loaded if it was invalidated
+        """
+        with self._lock:
+            self.state.refresh()
+            assert self.state.fee_params is not None, "No auth nft found"
+            return copy.copy(self.state)
+
+    def check_own_wallet(self, address: pycardano.Address, msg: str):
+        assert self.signing_key is not None, "The daemon has no wallet to sign with"
+        assert (
+            address.payment_part == self.signing_key.to_verification_key().hash()
+        ), msg
+
+    def finish(
+        self,
+        builder: HintingTransactionBuilder,
+        change_address: pycardano.Address,
+        sign: bool,
+    ) -> pycardano.Transaction:
+        if sign:
+            self.check_own_wallet(
+                change_address,
+                "Can only sign transactions paid by the wallet of the daemon",
+            )
+            return builder.build_and_sign(
+                signing_keys=[self.signing_key], change_address=change_address
+            )
+        tx_body = builder.build(change_address=change_address)
+        return pycardano.Transaction(
+            tx_body,
+            builder.build_witness_set(),
+            auxiliary_data=builder.auxiliary_data,
+        )
+
+    def build(
+        self,
+        add_to_builder: Callable[[HintingTransactionBuilder, ProtocolState], None],
+        change_address: pycardano.Address,
+        sign: bool,
+        msg: str,
+    ) -> pycardano.Transaction:
+        """
+        Build a transaction, loading the protocol state again and retrying once
+        if building with the warm state fails (e.g. because the state was outdated)
+        """
+        for attempt in range(2):
+            state = self.protocol_state()
+            builder = HintingTransactionBuilder(self.context)
+            builder.auxiliary_data = AuxiliaryData(
+                data=AlonzoMetadata(metadata=Metadata({674: {"msg": [msg]}}))
+            )
+            try:
+                add_to_builder(builder, state)
+                return self.finish(builder, change_address, sign)
+            except Exception as e:
+                # the inputs are handed out again for the next attempt or request
+                reservations = reservations_of(self.context)
+                if reservations is not None:
+                    reservations.release(u.input for u in builder.inputs)
+                if isinstance(e, AssertionError) or attempt > 0:
+                    raise
+                self.state.roll_backward()
+
+    def uada_address(self, stake_key: str) -> pycardano.Address:
+        return combine_with_stake_key(
+            pycardano.Address(
+                pycardano.plutus_script_hash(self.state.uada_script), network=network
+            ),
+            stake_key,
+        )
+
+    def one_shot_nft_policy_id(self) -> pycardano.ScriptHash:
+        return pycardano.plutus_script_hash(self.state.one_shot_nft_script)
+
+    def mint(
+        self, address: pycardano.Address, positions: List[tuple], sign: bool = False
+    ) -> pycardano.Transaction:
+        """
+        :param positions: list of (owner address, stake key, amount) for each position
+        """
+        if sign:
+            # the requests are not authenticated, the NFTs and uADA of signed positions stay in the wallet
+            for owner, _, _ in positions:
+                self.check_own_wallet(
+                    pycardano.Address.from_primitive(owner),
+                    "Can only sign positions owned by the wallet of the daemon",
+                )
+        payment_utxos = self.context.utxos(address)
+        return self.build(
+            lambda builder, state: build_batch_mint(
+                builder,
+                payment_utxos,
+                positions,
+                state.param_utxo,
+                state.fee_params,
+                state.uada_script,
+                state.one_shot_nft_script,
+                state.uada_ref_utxo,
+                state.one_shot_nft_ref_utxo,
+            ),
+            address,
+            sign,
+            f"Mint uADA x{len(positions)}",
+        )
+
+    def withdraw(
+        self, address: pycardano.Address, stake_keys: List[str], sign: bool = False
+    ) -> pycardano.Transaction:
+        payment_utxos = self.context.utxos(address)
+        positions = find_positions(
+            self.context,
+            [self.uada_address(stake_key) for stake_key in stake_keys],
+            payment_utxos,
+            self.one_shot_nft_policy_id(),
+        )
+        assert positions, "No uada staking position found"
+        return self.build(
+            lambda builder, state: build_batch_withdraw(
+                builder,
+                payment_utxos,
+                positions,
+                state.param_utxo,
+                state.fee_params,
+                state.uada_script,
+                state.one_shot_nft_script,
+                state.uada_ref_utxo,
+                state.one_shot_nft_ref_utxo,
+            ),
+            address,
+            sign,
+            "Withdraw uADA",
+        )
+
+    def extend_or_withdraw_partial(
+        self,
+        address: pycardano.Address,
+        stake_key: str,
+        amount_to_mint: int,
+        sign: bool = False,
+    ) -> pycardano.Transaction:
+        """
+        :param amount_to_mint: positive for extending, negative for withdrawing
+        """
+        position_utxo, position_datum = find_position(
+            self.context, self.uada_address(stake_key), self.one_shot_nft_policy_id()
+        )
+        assert position_utxo is not None, "No uada staking position found"
+        payment_utxos = self.context.utxos(address)
+        return self.build(
+            lambda builder, state: build_extend_or_withdraw_partial(
+                builder,
+                payment_utxos,
+                position_utxo,
+                position_datum,
+                amount_to_mint,
+                state.param_utxo,
+                state.fee_params,
+                state.uada_script,
+                state.uada_ref_utxo,
+            ),
+            address,
+            sign,
+            "Extend/PartialWithdraw uADA",
+        )
+
+
+class MintPosition(BaseModel):
+    stake_key: str
+    amount: int
+    # defaults to the paying address
+    owner: Optional[str] = None
+
+
+class MintRequest(BaseModel):
+    address: str
+    positions: List[MintPosition]
+    sign: bool = False
+
+
+class WithdrawRequest(BaseModel):
+    address: str
+    stake_keys: List[str]
+    sign: bool = False
+
+
+class ExtendOrWithdrawPartialRequest(BaseModel):
+    address: str
+    stake_key: str
+    # positive for extending, negative for withdrawing
+    amount: int
+    sign: bool = False
+
+
+def tx_json(tx: pycardano.Transaction) -> dict:
+    return {
+        "tx_id": str(tx.id),
+        "cbor": tx.to_cbor_hex(),
+        "signed": bool(tx.transaction_witness_set.vkey_witnesses),
+    }
+
+
+daemon: Optional[TransactionDaemon] = None
+
+
+def serve(build: Callable[[], pycardano.Transaction]) -> dict:
+    try:
+        return tx_json(build())
+    except AssertionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+app = FastAPI(title="uADA transaction builder")
+
+
+# the endpoints block on chain queries, so they are run in the thread pool of FastAPI
+@app.post("/mint")
+def mint(request: MintRequest) -> dict:
+    positions = [
+        (p.owner or request.address, p.stake_key, p.amount) for p in request.positions
+    ]
+    return serve(
+        lambda: daemon.mint(
+            pycardano.Address.from_primitive(request.address), positions, request.sign
+        )
+    )
+
+
+@app.post("/withdraw")
+def withdraw(request: WithdrawRequest) -> dict:
+    return serve(
+        lambda: daemon.withdraw(
+            pycardano.Address.from_primitive(request.address),
+            request.stake_keys,
+            request.sign,
+        )
+    )
+
+
+@app.post("/extend_or_withdraw_partial")
+def extend_or_withdraw_partial(request: ExtendOrWithdrawPartialRequest) -> dict:
+    return serve(
+        lambda: daemon.extend_or_withdraw_partial(
+            pycardano.Address.from_primitive(request.address),
+            request.stake_key,
+            request.amount,
+            request.sign,
+        )
+    )
+
+
+def main(
+    host: str = "127.0.0.1",
+    port: int = 8001,
+    wallet: Optional[str] = None,
+    admin_wallet: str = "admin",
+    local_evaluation: bool = False,
+):
+    """
+    Serve transaction building until interrupted
+    :param wallet: wallet whose transactions the daemon may sign, only unsigned transactions are built if omitted
+    :param admin_wallet: wallet holding the fee parameters
+    :param local_evaluation: evaluate the scripts locally and cache their execution units by transaction shape,
+      instead of asking the chain backend for every transaction. The local cost model is not checked against
+      the ledger yet, so the declared budgets may be rejected by the chain.
+    """
+    global daemon
+    _, _, admin_address = get_signing_info(admin_wallet, network=network)
+    signing_key = (
+        get_signing_info(wallet, network=network)[1] if wallet is not None else None
+    )
+    chain_context = LocalEvaluationContext(context) if local_evaluation else context
+    state = ProtocolState.from_contracts(chain_context, admin_address)
+    # concurrent requests for the same wallet are built from disjoint UTxOs
+    reserving_context = ReservingChainContext(chain_context)
+    daemon = TransactionDaemon(reserving_context, state, signing_key)
+    threading.Thread(
+        target=follow_chain,
+        # the follower changes the state that request threads refresh and copy
+        args=(state, reserving_context.reservations, daemon._lock),
+        daemon=True,
+        name="chain-follower",
+    ).start()
+    uvicorn.run(app, host=host, port=port)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
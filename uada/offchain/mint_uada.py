@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 
 import fire
@@ -5,12 +6,11 @@ import pycardano
 
 from uada.onchain import uada, one_shot_nft, parameter_auth_nft
 from uada.utils.from_script_context import from_address
-from uada.utils.network import show_tx, context
+from uada.utils.network import show_tx, async_context, AsyncChainContext
 from uada.utils.to_script_context import to_address, to_tx_out_ref
 from opshin.prelude import Token
 from pycardano import (
     OgmiosChainContext,
-    TransactionBuilder,
     Redeemer,
     AuxiliaryData,
     AlonzoMetadata,
@@ -21,6 +21,7 @@ from pycardano import (
 )
 
 from .util import (
+    HintingTransactionBuilder,
     token_from_string,
     asset_from_token,
     module_name,
@@ -31,28 +32,33 @@ from .util import (
     combine_with_stake_key,
 )
 from ..utils import get_signing_info, ogmios_url, network, kupo_url
-from ..utils.contracts import get_contract, get_ref_utxo
+from .coin_selection import select_utxos
+from ..utils.reservations import reservations_of
+from .protocol_state import ProtocolState
+from ..utils.contracts import get_contract
 
 
-def main(
+async def main_async(
     wallet: str = "minter",
     stake_key: str = SAMPLE_STAKE_KEY,
     amount: int = 5_000_000,
     admin_wallet: str = "admin",
+    async_context: AsyncChainContext = async_context,
 ):
+    """
+    Independent chain queries are run concurrently
+    """
     # Load script info
     (
         uada_script,
         uada_policy_id,
         uada_address,
     ) = get_contract(module_name(uada), True)
-    uada_ref_utxo = get_ref_utxo(uada_script, context)
     (
         one_shot_nft_script,
         one_shot_nft_policy_id,
         _,
     ) = get_contract(module_name(one_shot_nft), True)
-    one_shot_nft_ref_utxo = get_ref_utxo(one_shot_nft_script, context)
     (
         _,
         auth_nft_policy_id,
@@ -68,40 +74,37 @@ def main(
     admin_vkey, admin_skey, admin_address = get_signing_info(
         admin_wallet, network=network
     )
-    # find the fee parameters
-    param_utxo = None
-    auth_nft_datum = None
-    for utxo in context.utxos(admin_address):
-        if not utxo.output.amount.multi_asset.get(auth_nft_policy_id):
-            continue
-        try:
-            auth_nft_datum = uada.UAdaFeeParams.from_cbor(utxo.output.datum.cbor)
-        except Exception:
-            continue
-        param_utxo = utxo
+    # find the fee parameters, reference scripts and payment UTxOs at the same time
+    state = ProtocolState.from_contracts(async_context.context, admin_address)
+    _, payment_utxos = await asyncio.gather(
+        state.refresh_async(async_context),
+        async_context.utxos(combined_payment_address),
+    )
+    param_utxo, auth_nft_datum = state.param_utxo, state.fee_params
+    uada_ref_utxo = state.uada_ref_utxo
+    one_shot_nft_ref_utxo = state.one_shot_nft_ref_utxo
     assert (
         auth_nft_datum is not None
     ), "No auth nft found, did you run init_uada_params? Also run init_uada_stake_key to fix withdrawal error"
-    treasury_address = from_address(auth_nft_datum.treasury_address)
-    if isinstance(auth_nft_datum.treasury_out_datum, uada.NoOutputDatum):
-        treasury_out_datum = None
-        treasury_out_datum_hash = None
-    elif isinstance(auth_nft_datum.treasury_out_datum, uada.SomeOutputDatum):
-        treasury_out_datum = auth_nft_datum.treasury_out_datum.datum
-        treasury_out_datum_hash = pycardano.datum_hash(treasury_out_datum)
-    else:
-        treasury_out_datum = None
-        treasury_out_datum_hash = auth_nft_datum.treasury_out_datum.datum_hash
+    treasury_address = state.treasury_address
+    treasury_out_datum = state.treasury_out_datum
+    treasury_out_datum_hash = state.treasury_out_datum_hash
     fee_min = auth_nft_datum.mint_fee_min
     fee_percent = auth_nft_datum.mint_fee_percent
     fee = uada.compute_fee(amount, fee_percent, fee_min)
 
-    payment_utxos = context.utxos(combined_payment_address)
+    # only as many wallet UTxOs are spent as needed, the first one names the NFT
+    payment_utxos = select_utxos(
+        payment_utxos,
+        amount + (fee if fee >= 1_000_000 else 0),
+        min_inputs=1,
+        reservations=reservations_of(async_context.context),
+    )
     unique_utxo = payment_utxos[0]
     unique_nft_name = one_shot_nft.one_shot_nft_name(to_tx_out_ref(unique_utxo.input))
     all_utxos_sorted = sorted_utxos(payment_utxos)
     unique_input_index = all_utxos_sorted.index(unique_utxo)
-    unique_nft_redeeemer = Redeemer(unique_input_index)
+    unique_nft_redeeemer = Redeemer([unique_input_index])
 
     all_ref_utxos_sorted = sorted_utxos(
         [param_utxo]
@@ -114,9 +117,11 @@ def main(
 
     uada_mint_redeemer = Redeemer(uada.Nothing())
     uada_wdrl_redeemer = Redeemer(
-        uada.ContractInteractionRedeemer(
+        uada.HintedContractInteractionRedeemer(
             parameter_auth_nft_ref_utxo_index=param_utxo_index,
             treasury_payout_tx_out_index=0,
+            # filled in by the HintingTransactionBuilder
+            script_output_indices=[],
         )
     )
 
@@ -135,7 +140,9 @@ def main(
     )
 
     # Build the transaction
-    builder = TransactionBuilder(context)
+    builder = HintingTransactionBuilder(
+        async_context.context, hinted_script_hash=uada_policy_id
+    )
     builder.auxiliary_data = AuxiliaryData(
         data=AlonzoMetadata(metadata=Metadata({674: {"msg": ["Mint uADA"]}}))
     )
@@ -189,10 +196,19 @@ def main(
     )
 
     # Submit the transaction
-    context.submit_tx(signed_tx)
+    await async_context.submit_tx(signed_tx)
 
     show_tx(signed_tx)
 
 
+def main(
+    wallet: str = "minter",
+    stake_key: str = SAMPLE_STAKE_KEY,
+    amount: int = 5_000_000,
+    admin_wallet: str = "admin",
+):
+    asyncio.run(main_async(wallet, stake_key, amount, admin_wallet))
+
+
 if __name__ == "__main__":
     fire.Fire(main)
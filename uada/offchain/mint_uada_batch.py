@@ -0,0 +1,223 @@
+from typing import List, Optional, Tuple
+
+import fire
+import pycardano
+
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.utils.network import show_tx, context
+from uada.utils.to_script_context import to_tx_out_ref
+from opshin.prelude import Token
+from pycardano import (
+    MultiAsset,
+    Redeemer,
+    AuxiliaryData,
+    AlonzoMetadata,
+    Metadata,
+    TransactionOutput,
+    Value,
+    Withdrawals,
+)
+
+from .util import (
+    HintingTransactionBuilder,
+    asset_from_token,
+    module_name,
+    with_min_lovelace,
+    sorted_utxos,
+    SAMPLE_STAKE_KEY,
+    combine_with_stake_key,
+    treasury_payout,
+)
+from .coin_selection import lovelace, select_utxos
+from ..utils.reservations import reservations_of
+from .protocol_state import ProtocolState
+from ..utils import get_signing_info, network
+
+# owner address, stake key and amount of lovelace of a staking position
+Position = Tuple[str, str, int]
+
+
+def build_batch_mint(
+    builder: HintingTransactionBuilder,
+    payment_utxos: List[pycardano.UTxO],
+    positions: List[Position],
+    param_utxo: pycardano.UTxO,
+    fee_params: uada.UAdaFeeParams,
+    uada_script: pycardano.PlutusV2Script,
+    one_shot_nft_script: pycardano.PlutusV2Script,
+    uada_ref_utxo: Optional[pycardano.UTxO] = None,
+    one_shot_nft_ref_utxo: Optional[pycardano.UTxO] = None,
+) -> HintingTransactionBuilder:
+    """
+    Add the inputs, mints and outputs that create all given staking positions to the builder.
+    The uADA withdrawal script is invoked only once to check the circulating supply invariant
+    for the whole batch, and the fee for the total volume is paid in a single treasury output.
+    Every position gets its own one-shot NFT, named after a distinct spent wallet UTxO.
+    Only as many wallet UTxOs are spent as needed to pay for the positions, see select_utxos.
+    """
+    uada_script_hash = pycardano.plutus_script_hash(uada_script)
+    builder.hinted_script_hash = uada_script_hash
+    uada_address = pycardano.Address(uada_script_hash, network=network)
+    one_shot_nft_policy_id = pycardano.plutus_script_hash(one_shot_nft_script)
+
+    reservations = reservations_of(builder.context)
+    if reservations is not None:
+        payment_utxos = reservations.unreserved(payment_utxos)
+    assert len(payment_utxos) >= len(
+        positions
+    ), f"Need at least {len(positions)} unreserved UTxOs in the wallet to mint {len(positions)} unique NFTs"
+    # the UTxOs with most lovelace are spent for the NFT names, as they also pay for the positions
+    unique_utxos = sorted(payment_utxos, key=lovelace, reverse=True)[: len(positions)]
+
+    uada_token = Token(uada_script_hash.payload, b"uADA")
+    total_amount = sum(amount for _, _, amount in positions)
+    fee = uada.compute_fee(
+        total_amount, fee_params.mint_fee_percent, fee_params.mint_fee_min
+    )
+
+    nft_mint = MultiAsset()
+    position_outputs = []
+    for unique_utxo, (owner, stake_key, amount) in zip(unique_utxos, positions):
+        unique_nft_name = one_shot_nft.one_shot_nft_name(
+            to_tx_out_ref(unique_utxo.input)
+        )
+        unique_nft_token = Token(one_shot_nft_policy_id.payload, unique_nft_name)
+        nft_mint += asset_from_token(unique_nft_token, 1)
+        position_outputs.append(
+            TransactionOutput(
+                address=combine_with_stake_key(uada_address, stake_key),
+                amount=amount,
+                datum=uada.UAdaStakingPosition(
+                    one_shot_nft_policy_id.payload,
+                    unique_nft_name,
+                ),
+            )
+        )
+        # the owner receives the NFT that controls the position and the minted uADA
+        position_outputs.append(
+            with_min_lovelace(
+                TransactionOutput(
+                    address=pycardano.Address.from_primitive(owner),
+                    amount=Value(
+                        coin=0,
+                        multi_asset=asset_from_token(unique_nft_token, 1)
+                        + asset_from_token(uada_token, amount),
+                    ),
+                ),
+                builder.context,
+            )
+        )
+
+    payment_utxos = select_utxos(
+        payment_utxos,
+        (fee if fee >= 1_000_000 else 0) + sum(o.amount.coin for o in position_outputs),
+        required_utxos=unique_utxos,
+        reservations=reservations,
+    )
+    # the indices refer to the final, sorted set of inputs and must be ascending
+    all_utxos_sorted = sorted_utxos(payment_utxos)
+    unique_input_indices = sorted(all_utxos_sorted.index(u) for u in unique_utxos)
+
+    all_ref_utxos_sorted = sorted_utxos(
+        [param_utxo]
+        + ([uada_ref_utxo] if uada_ref_utxo else [])
+        + ([one_shot_nft_ref_utxo] if one_shot_nft_ref_utxo else [])
+    )
+    param_utxo_index = all_ref_utxos_sorted.index(param_utxo)
+
+    for u in payment_utxos:
+        builder.add_input(u)
+
+    builder.add_minting_script(
+        uada_ref_utxo or uada_script,
+        Redeemer(uada.Nothing()),
+    )
+    builder.add_minting_script(
+        one_shot_nft_ref_utxo or one_shot_nft_script,
+        Redeemer(unique_input_indices),
+    )
+    builder.mint = asset_from_token(uada_token, total_amount) + nft_mint
+    builder.reference_inputs.add(param_utxo)
+    # the treasury payout must be the first output, see treasury_payout_tx_out_index
+    if fee >= 1_000_000:
+        builder.add_output(treasury_payout(fee_params, fee))
+    for output in position_outputs:
+        builder.add_output(output)
+
+    builder.withdrawals = Withdrawals(
+        {bytes(pycardano.Address(staking_part=uada_script_hash, network=network)): 0}
+    )
+    builder.add_withdrawal_script(
+        uada_ref_utxo or uada_script,
+        Redeemer(
+            uada.HintedContractInteractionRedeemer(
+                parameter_auth_nft_ref_utxo_index=param_utxo_index,
+                treasury_payout_tx_out_index=0,
+                # filled in by the HintingTransactionBuilder
+                script_output_indices=[],
+            )
+        ),
+    )
+    return builder
+
+
+def main(
+    positions: List[Position],
+    wallet: str = "minter",
+    stake_key: str = SAMPLE_STAKE_KEY,
+    admin_wallet: str = "admin",
+):
+    """
+    Mint many staking positions in a single transaction
+    :param positions: list of (owner address, stake key, amount) for each position
+    :param wallet: the wallet paying for all positions
+    :param stake_key: stake key of the change of the paying wallet
+    """
+    # Get payment address
+    payment_vkey, payment_skey, payment_address = get_signing_info(
+        wallet, network=network
+    )
+    combined_payment_address = combine_with_stake_key(payment_address, stake_key)
+
+    admin_vkey, admin_skey, admin_address = get_signing_info(
+        admin_wallet, network=network
+    )
+    # find the fee parameters and reference scripts
+    state = ProtocolState.from_contracts(context, admin_address).refresh()
+    assert (
+        state.fee_params is not None
+    ), "No auth nft found, did you run init_uada_params? Also run init_uada_stake_key to fix withdrawal error"
+
+    # Build the transaction
+    builder = HintingTransactionBuilder(context)
+    builder.auxiliary_data = AuxiliaryData(
+        data=AlonzoMetadata(
+            metadata=Metadata({674: {"msg": [f"Mint uADA x{len(positions)}"]}})
+        )
+    )
+    build_batch_mint(
+        builder,
+        context.utxos(combined_payment_address),
+        positions,
+        state.param_utxo,
+        state.fee_params,
+        state.uada_script,
+        state.one_shot_nft_script,
+        state.uada_ref_utxo,
+        state.one_shot_nft_ref_utxo,
+    )
+
+    # Sign the transaction
+    signed_tx = builder.build_and_sign(
+        signing_keys=[payment_skey],
+        change_address=combined_payment_address,
+    )
+
+    # Submit the transaction
+    context.submit_tx(signed_tx)
+
+    show_tx(signed_tx)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
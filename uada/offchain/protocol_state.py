@@ -0,0 +1,151 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+import pycardano
+
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.utils.contracts import get_contract, get_ref_utxo
+from uada.utils.from_script_context import from_address
+from uada.utils.network import AsyncChainContext
+from uada.utils.reservations import spent_inputs
+from .util import find_fee_params, module_name, treasury_datum
+
+
+@dataclass
+class ProtocolState:
+    """
+    The fee parameters and reference script UTxOs needed to build transactions.
+    They are queried once and kept until a block spends one of the UTxOs they were loaded from,
+    so that repeated builds in a long-running process do not query the chain for them again.
+    """
+
+    context: pycardano.ChainContext
+    admin_address: pycardano.Address
+    uada_script: pycardano.PlutusV2Script
+    one_shot_nft_script: pycardano.PlutusV2Script
+    auth_nft_policy_id: pycardano.ScriptHash
+
+    param_utxo: Optional[pycardano.UTxO] = field(default=None, init=False)
+    fee_params: Optional[uada.UAdaFeeParams] = field(default=None, init=False)
+    treasury_address: Optional[pycardano.Address] = field(default=None, init=False)
+    treasury_out_datum: Optional[pycardano.Datum] = field(default=None, init=False)
+    treasury_out_datum_hash: Optional[pycardano.DatumHash] = field(
+        default=None, init=False
+    )
+    uada_ref_utxo: Optional[pycardano.UTxO] = field(default=None, init=False)
+    one_shot_nft_ref_utxo: Optional[pycardano.UTxO] = field(default=None, init=False)
+    loaded: bool = field(default=False, init=False)
+
+    @classmethod
+    def from_contracts(
+        cls, context: pycardano.ChainContext, admin_address: pycardano.Address
+    ) -> "ProtocolState":
+        """
+        The state of the contracts in the build directory
+        """
+        uada_script, _, _ = get_contract(module_name(uada), True)
+        one_shot_nft_script, _, _ = get_contract(module_name(one_shot_nft), True)
+        _, auth_nft_policy_id, _ = get_contract(module_name(parameter_auth_nft), True)
+        return cls(
+            context, admin_address, uada_script, one_shot_nft_script, auth_nft_policy_id
+        )
+
+    def _set_fee_params(
+        self,
+        param_utxo: Optional[pycardano.UTxO],
+        fee_params: Optional[uada.UAdaFeeParams],
+    ):
+        self.param_utxo, self.fee_params = param_utxo, fee_params
+        if fee_params is not None:
+            self.treasury_address = from_address(fee_params.treasury_address)
+            self.treasury_out_datum, self.treasury_out_datum_hash = treasury_datum(
+                fee_params
+            )
+
+    def load(self) -> "ProtocolState":
+        self._set_fee_params(
+            *find_fee_params(self.context, self.admin_address, self.auth_nft_policy_id)
+        )
+        self.uada_ref_utxo = get_ref_utxo(self.uada_script, self.context)
+        self.one_shot_nft_ref_utxo = get_ref_utxo(
+            self.one_shot_nft_script, self.context
+        )
+        self.loaded = True
+        return self
+
+    async def load_async(self, async_context: AsyncChainContext) -> "ProtocolState":
+        """
+        Load the state, running the independent queries concurrently
+        """
+        (
+            fee_params,
+            self.uada_ref_utxo,
+            self.one_shot_nft_ref_utxo,
+        ) = await asyncio.gather(
+            async_context.run(
+                find_fee_params,
+                self.context,
+                self.admin_address,
+                self.auth_nft_policy_id,
+            ),
+            async_context.run(get_ref_utxo, self.uada_script, self.context),
+            async_context.run(get_ref_utxo, self.one_shot_nft_script, self.context),
+        )
+        self._set_fee_params(*fee_params)
+        self.loaded = True
+        return self
+
+    def refresh(self) -> "ProtocolState":
+        """
+        Load the state if it was never loaded or invalidated since
+        """
+        if not self.loaded:
+            self.load()
+        return self
+
+    async def refresh_async(self, async_context: AsyncChainContext) -> "ProtocolState":
+        if not self.loaded:
+            await self.load_async(async_context)
+        return self
+
+    def utxos(self) -> List[pycardano.UTxO]:
+        return [
+            u
+            for u in (self.param_utxo, self.uada_ref_utxo, self.one_shot_nft_ref_utxo)
+            if u is not None
+        ]
+
+    def spend(self, inputs: Iterable[pycardano.TransactionInput]) -> bool:
+        """
+        Invalidate the state if one of the inputs spends a UTxO it was loaded from
+        :return: whether the state was invalidated
+        """
+        loaded_from = {u.input for u in self.utxos()}
+        if any(i in loaded_from for i in inputs):
+            self.loaded = False
+        return not self.loaded
+
+    def roll_forward(self, transactions: List[dict]) -> bool:
+        """
+        Invalidate the state if one of the transactions of a block (as reported by Ogmios chain-sync)
+        spends a UTxO it was loaded from
+        """
+        return self.spend(spent_inputs(transactions))
+
+    def roll_backward(self):
+        """
+        A rollback may have undone the creation of any of the UTxOs, so the state is loaded again
+        """
+        self.loaded = False
+
+    def treasury_payout(self, fee: int) -> pycardano.TransactionOutput:
+        """
+        The output paying the given fee to the treasury, with the datum required by the fee parameters
+        """
+        return pycardano.TransactionOutput(
+            address=self.treasury_address,
+            amount=pycardano.Value(coin=fee),
+            datum=self.treasury_out_datum,
+            datum_hash=self.treasury_out_datum_hash,
+        )
@@ -0,0 +1,30 @@
+import fire
+
+from uada import submit_ref_script
+from uada.utils.chaining import ChainingContext
+from uada.utils.network import context
+from . import init_uada_params, init_uada_stake_key, mint_uada
+from .util import SAMPLE_STAKE_KEY
+
+
+def main(
+    wallet: str = "minter",
+    stake_key: str = SAMPLE_STAKE_KEY,
+    admin_wallet: str = "admin",
+    amount: int = 5_000_000,
+    compress: bool = True,
+):
+    """
+    Register the stake key of the uADA script, create the fee parameters and reference scripts
+    and mint a first staking position. Every transaction spends the outputs of the previous ones
+    before they are confirmed, so all of them are submitted within one block.
+    """
+    context.set(ChainingContext(context.get()))
+    init_uada_stake_key.main(wallet, stake_key)
+    init_uada_params.main(admin_wallet)
+    submit_ref_script.main(compress)
+    mint_uada.main(wallet, stake_key, amount, admin_wallet)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -1,11 +1,15 @@
+from copy import deepcopy
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
 import pycardano
 
-from opshin.prelude import Token
+from opshin.prelude import Token, NoOutputDatum, SomeOutputDatum
 from pycardano import MultiAsset, ScriptHash, Asset, AssetName, Value, Network
+from uada.onchain.uada import UAdaFeeParams, HintedContractInteractionRedeemer
 from uada.utils import network
+from uada.utils.from_script_context import from_address
 
 SAMPLE_STAKE_KEY = (
     "stake_test1uz7lwepxz9v0ks5tmx6m6nt436jm9c9r88mdlsydt70vnng9sr59q"
@@ -66,3 +70,147 @@ def combine_with_stake_key(
         pycardano.Address.from_primitive(stake_key).staking_part,
         network=address.network,
     )
+
+
+def find_fee_params(
+    context: pycardano.ChainContext,
+    admin_address: pycardano.Address,
+    auth_nft_policy_id: ScriptHash,
+) -> Tuple[Optional[pycardano.UTxO], Optional[UAdaFeeParams]]:
+    """
+    Find the UTxO holding the parameter auth NFT and decode the fee parameters attached to it
+    """
+    param_utxo = None
+    fee_params = None
+    for utxo in context.utxos(admin_address):
+        if not utxo.output.amount.multi_asset.get(auth_nft_policy_id):
+            continue
+        try:
+            fee_params = UAdaFeeParams.from_cbor(utxo.output.datum.cbor)
+        except Exception:
+            continue
+        param_utxo = utxo
+    return param_utxo, fee_params
+
+
+def treasury_datum(
+    fee_params: UAdaFeeParams,
+) -> Tuple[Optional[pycardano.Datum], Optional[pycardano.DatumHash]]:
+    """
+    The datum and datum hash that the treasury payout has to carry according to the fee parameters
+    """
+    if isinstance(fee_params.treasury_out_datum, NoOutputDatum):
+        treasury_out_datum = None
+        treasury_out_datum_hash = None
+    elif isinstance(fee_params.treasury_out_datum, SomeOutputDatum):
+        treasury_out_datum = fee_params.treasury_out_datum.datum
+        treasury_out_datum_hash = pycardano.datum_hash(treasury_out_datum)
+    else:
+        treasury_out_datum = None
+        treasury_out_datum_hash = fee_params.treasury_out_datum.datum_hash
+    return treasury_out_datum, treasury_out_datum_hash
+
+
+def treasury_payout(fee_params: UAdaFeeParams, fee: int) -> pycardano.TransactionOutput:
+    """
+    The output paying the given fee to the treasury, with the datum required by the fee parameters
+    """
+    datum, datum_hash = treasury_datum(fee_params)
+    return pycardano.TransactionOutput(
+        address=from_address(fee_params.treasury_address),
+        amount=Value(coin=fee),
+        datum=datum,
+        datum_hash=datum_hash,
+    )
+
+
+def datum_cbor(output: pycardano.TransactionOutput) -> bytes:
+    """
+    The CBOR of the inline datum of the output, whether it is kept raw or decoded by the chain context
+    """
+    datum = output.datum
+    return datum.cbor if isinstance(datum, pycardano.RawCBOR) else datum.to_cbor()
+
+
+def within_protocol_limits(
+    tx: pycardano.Transaction, protocol_param: pycardano.ProtocolParameters
+) -> bool:
+    """
+    Whether the transaction fits the maximum size and execution units of a single transaction
+    """
+    redeemers = tx.transaction_witness_set.redeemer or []
+    return (
+        len(tx.to_cbor()) <= protocol_param.max_tx_size
+        and sum(r.ex_units.mem for r in redeemers) <= protocol_param.max_tx_ex_mem
+        and sum(r.ex_units.steps for r in redeemers) <= protocol_param.max_tx_ex_steps
+    )
+
+
+def script_indices(
+    outputs: List[pycardano.TransactionOutput], script_hash: ScriptHash
+) -> List[int]:
+    """
+    The ascending indices of all outputs whose payment part is the given script
+    """
+    return [i for i, o in enumerate(outputs) if o.address.payment_part == script_hash]
+
+
+@dataclass
+class HintingTransactionBuilder(pycardano.TransactionBuilder):
+    """
+    Fills in the script output indices of every HintedContractInteractionRedeemer
+    once the outputs are final (the change output is only appended afterwards).
+    With size_limited unset, transactions larger than the protocol limit are built as well,
+    the caller compares them with within_protocol_limits.
+    """
+
+    hinted_script_hash: Optional[ScriptHash] = field(default=None)
+    size_limited: bool = field(default=True)
+
+    def _build_full_fake_tx(self) -> pycardano.Transaction:
+        if self.size_limited:
+            return super()._build_full_fake_tx()
+        # the fake transaction of pycardano without the check of its size
+        tx_body = self._build_tx_body()
+        if tx_body.fee == 0:
+            tx_body.fee = pycardano.max_tx_fee(self.context)
+        return pycardano.Transaction(
+            tx_body, self._build_fake_witness_set(), True, self.auxiliary_data
+        )
+
+    def _estimate_execution_units(
+        self,
+        change_address: Optional[pycardano.Address] = None,
+        merge_change: Optional[bool] = False,
+        collateral_change_address: Optional[pycardano.Address] = None,
+    ):
+        if self.size_limited:
+            return super()._estimate_execution_units(
+                change_address, merge_change, collateral_change_address
+            )
+        # as pycardano, but on a copy of this class so that the copy does not check the size either
+        tmp_builder = type(self)(self.context)
+        for f in fields(self):
+            if f.name != "context":
+                setattr(tmp_builder, f.name, deepcopy(getattr(self, f.name)))
+        tmp_builder._should_estimate_execution_units = False
+        self._should_estimate_execution_units = False
+        tx_body = tmp_builder.build(
+            change_address, merge_change, collateral_change_address
+        )
+        tx = pycardano.Transaction(
+            tx_body,
+            tmp_builder._build_fake_witness_set(),
+            auxiliary_data=tmp_builder.auxiliary_data,
+        )
+        return self.context.evaluate_tx(tx)
+
+    def _set_redeemer_index(self):
+        super()._set_redeemer_index()
+        if self.hinted_script_hash is None:
+            return
+        for redeemer in self.redeemers:
+            if isinstance(redeemer.data, HintedContractInteractionRedeemer):
+                redeemer.data.script_output_indices = script_indices(
+                    self.outputs, self.hinted_script_hash
+                )
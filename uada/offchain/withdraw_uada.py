@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 
 import fire
@@ -5,12 +6,11 @@ import pycardano
 
 from uada.onchain import uada, one_shot_nft, parameter_auth_nft
 from uada.utils.from_script_context import from_address
-from uada.utils.network import show_tx, context
+from uada.utils.network import show_tx, async_context, AsyncChainContext
 from uada.utils.to_script_context import to_address, to_tx_out_ref
 from opshin.prelude import Token
 from pycardano import (
     OgmiosChainContext,
-    TransactionBuilder,
     Redeemer,
     AuxiliaryData,
     AlonzoMetadata,
@@ -21,6 +21,7 @@ from pycardano import (
 )
 
 from .util import (
+    HintingTransactionBuilder,
     token_from_string,
     asset_from_token,
     module_name,
@@ -31,27 +32,32 @@ from .util import (
     combine_with_stake_key,
 )
 from ..utils import get_signing_info, ogmios_url, network, kupo_url
-from ..utils.contracts import get_contract, get_ref_utxo
+from .coin_selection import select_utxos
+from ..utils.reservations import reservations_of
+from .protocol_state import ProtocolState
+from ..utils.contracts import get_contract
 
 
-def main(
+async def main_async(
     wallet: str = "minter",
     stake_key: str = SAMPLE_STAKE_KEY,
     admin_wallet: str = "admin",
+    async_context: AsyncChainContext = async_context,
 ):
+    """
+    Independent chain queries are run concurrently
+    """
     # Load script info
     (
         uada_script,
         uada_policy_id,
         uada_address,
     ) = get_contract(module_name(uada), True)
-    uada_ref_utxo = get_ref_utxo(uada_script, context)
     (
         one_shot_nft_script,
         one_shot_nft_policy_id,
         _,
     ) = get_contract(module_name(one_shot_nft), True)
-    one_shot_nft_ref_utxo = get_ref_utxo(one_shot_nft_script, context)
     (
         _,
         auth_nft_policy_id,
@@ -69,10 +75,17 @@ def main(
     )
 
     combined_uada_address = combine_with_stake_key(uada_address, stake_key)
+    # the position, the payment UTxOs, the fee parameters and reference scripts are queried at the same time
+    state = ProtocolState.from_contracts(async_context.context, admin_address)
+    position_utxos, payment_utxos, _ = await asyncio.gather(
+        async_context.utxos(combined_uada_address),
+        async_context.utxos(combined_payment_address),
+        state.refresh_async(async_context),
+    )
     # find the uada staking position
     uada_position_utxo = None
     uada_position_datum = None
-    for utxo in context.utxos(combined_uada_address):
+    for utxo in position_utxos:
         try:
             uada_position_datum = uada.UAdaStakingPosition.from_cbor(
                 utxo.output.datum.cbor
@@ -86,7 +99,6 @@ def main(
     assert uada_position_utxo is not None, "No uada staking position found"
     amount = uada_position_utxo.output.amount.coin
 
-    payment_utxos = context.utxos(combined_payment_address)
     # find the own input with the unique nft
     unique_nft_utxo = None
     for utxo in payment_utxos:
@@ -97,6 +109,31 @@ def main(
             break
     assert unique_nft_utxo is not None, "No unique nft found"
 
+    # the fee parameters and reference scripts
+    param_utxo, auth_nft_datum = state.param_utxo, state.fee_params
+    uada_ref_utxo = state.uada_ref_utxo
+    one_shot_nft_ref_utxo = state.one_shot_nft_ref_utxo
+    assert auth_nft_datum is not None, "No auth nft found"
+    treasury_address = state.treasury_address
+    treasury_out_datum = state.treasury_out_datum
+    treasury_out_datum_hash = state.treasury_out_datum_hash
+    fee_min = auth_nft_datum.mint_fee_min
+    fee_percent = auth_nft_datum.mint_fee_percent
+    fee = uada.compute_fee(amount, fee_percent, fee_min)
+
+    uada_token = Token(
+        uada_policy_id.payload,
+        b"uADA",
+    )
+    # the unlocked lovelace pays the fee, other wallet UTxOs are only spent if it does not suffice
+    # or to provide the uADA that is burned
+    payment_utxos = select_utxos(
+        payment_utxos,
+        (fee if fee >= 1_000_000 else 0) - amount,
+        required_utxos=[unique_nft_utxo],
+        reservations=reservations_of(async_context.context),
+        required_assets=asset_from_token(uada_token, amount),
+    )
     all_utxos_sorted = sorted_utxos(payment_utxos + [uada_position_utxo])
     unique_nft_input_index = all_utxos_sorted.index(unique_nft_utxo)
     spending_redeemer = Redeemer(
@@ -105,32 +142,6 @@ def main(
         )
     )
 
-    # find the fee parameters
-    param_utxo = None
-    auth_nft_datum = None
-    for utxo in context.utxos(admin_address):
-        if not utxo.output.amount.multi_asset.get(auth_nft_policy_id):
-            continue
-        try:
-            auth_nft_datum = uada.UAdaFeeParams.from_cbor(utxo.output.datum.cbor)
-        except Exception:
-            continue
-        param_utxo = utxo
-    assert auth_nft_datum is not None, "No auth nft found"
-    treasury_address = from_address(auth_nft_datum.treasury_address)
-    if isinstance(auth_nft_datum.treasury_out_datum, uada.NoOutputDatum):
-        treasury_out_datum = None
-        treasury_out_datum_hash = None
-    elif isinstance(auth_nft_datum.treasury_out_datum, uada.SomeOutputDatum):
-        treasury_out_datum = auth_nft_datum.treasury_out_datum.datum
-        treasury_out_datum_hash = pycardano.datum_hash(treasury_out_datum)
-    else:
-        treasury_out_datum = None
-        treasury_out_datum_hash = auth_nft_datum.treasury_out_datum.datum_hash
-    fee_min = auth_nft_datum.mint_fee_min
-    fee_percent = auth_nft_datum.mint_fee_percent
-    fee = uada.compute_fee(amount, fee_percent, fee_min)
-
     all_ref_utxos_sorted = sorted_utxos(
         [param_utxo]
         + ([uada_ref_utxo] if uada_ref_utxo else [])
@@ -140,24 +151,24 @@ def main(
 
     uada_mint_redeemer = Redeemer(uada.Nothing())
     uada_wdrl_redeemer = Redeemer(
-        uada.ContractInteractionRedeemer(
+        uada.HintedContractInteractionRedeemer(
             parameter_auth_nft_ref_utxo_index=param_utxo_index,
             treasury_payout_tx_out_index=0,
+            # filled in by the HintingTransactionBuilder
+            script_output_indices=[],
         )
     )
-    one_shot_nft_mint_redeemer = Redeemer(-1)
+    one_shot_nft_mint_redeemer = Redeemer([])
 
-    uada_token = Token(
-        uada_policy_id.payload,
-        b"uADA",
-    )
     unique_nft_token = Token(
         uada_position_datum.policy_id,
         uada_position_datum.token_name,
     )
 
     # Build the transaction
-    builder = TransactionBuilder(context)
+    builder = HintingTransactionBuilder(
+        async_context.context, hinted_script_hash=uada_policy_id
+    )
     builder.auxiliary_data = AuxiliaryData(
         data=AlonzoMetadata(metadata=Metadata({674: {"msg": ["Withdraw uADA"]}}))
     )
@@ -211,10 +222,18 @@ def main(
     )
 
     # Submit the transaction
-    context.submit_tx(signed_tx)
+    await async_context.submit_tx(signed_tx)
 
     show_tx(signed_tx)
 
 
+def main(
+    wallet: str = "minter",
+    stake_key: str = SAMPLE_STAKE_KEY,
+    admin_wallet: str = "admin",
+):
+    asyncio.run(main_async(wallet, stake_key, admin_wallet))
+
+
 if __name__ == "__main__":
     fire.Fire(main)
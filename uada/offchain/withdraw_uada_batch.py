@@ -0,0 +1,280 @@
+from typing import Dict, List, Optional, Tuple
+
+import fire
+import pycardano
+
+from uada.onchain import uada, one_shot_nft, parameter_auth_nft
+from uada.utils.network import show_tx, context
+from opshin.prelude import Token
+from pycardano import (
+    Redeemer,
+    AuxiliaryData,
+    AlonzoMetadata,
+    Metadata,
+    Withdrawals,
+)
+
+from .util import (
+    HintingTransactionBuilder,
+    asset_from_token,
+    module_name,
+    sorted_utxos,
+    SAMPLE_STAKE_KEY,
+    combine_with_stake_key,
+    datum_cbor,
+    treasury_payout,
+    within_protocol_limits,
+)
+from .coin_selection import max_selected_inputs, select_utxos
+from .protocol_state import ProtocolState
+from ..utils import get_signing_info, network
+from ..utils.contracts import get_contract
+from ..utils.reservations import ReservingChainContext, reservations_of
+
+# the staking position UTxO, its datum and the wallet UTxO holding its unique NFT
+Position = Tuple[pycardano.UTxO, uada.UAdaStakingPosition, pycardano.UTxO]
+
+
+def find_positions(
+    context: pycardano.ChainContext,
+    position_addresses: List[pycardano.Address],
+    payment_utxos: List[pycardano.UTxO],
+    one_shot_nft_policy_id: pycardano.ScriptHash,
+) -> List[Position]:
+    """
+    Find all staking positions at the given addresses whose unique NFT is held in one of the payment UTxOs
+    """
+    nft_utxos: Dict[bytes, pycardano.UTxO] = {}
+    for utxo in payment_utxos:
+        for name in utxo.output.amount.multi_asset.get(one_shot_nft_policy_id, {}):
+            nft_utxos[name.payload] = utxo
+
+    positions = []
+    for address in position_addresses:
+        for utxo in context.utxos(address):
+            try:
+                position_datum = uada.UAdaStakingPosition.from_cbor(
+                    datum_cbor(utxo.output)
+                )
+            except Exception:
+                continue
+            if position_datum.policy_id != one_shot_nft_policy_id.payload:
+                continue
+            if position_datum.token_name not in nft_utxos:
+                continue
+            positions.append(
+                (utxo, position_datum, nft_utxos[position_datum.token_name])
+            )
+    return positions
+
+
+def build_batch_withdraw(
+    builder: HintingTransactionBuilder,
+    payment_utxos: List[pycardano.UTxO],
+    positions: List[Position],
+    param_utxo: pycardano.UTxO,
+    fee_params: uada.UAdaFeeParams,
+    uada_script: pycardano.PlutusV2Script,
+    one_shot_nft_script: pycardano.PlutusV2Script,
+    uada_ref_utxo: Optional[pycardano.UTxO] = None,
+    one_shot_nft_ref_utxo: Optional[pycardano.UTxO] = None,
+) -> HintingTransactionBuilder:
+    """
+    Add the inputs, burns and outputs that withdraw all given staking positions to the builder.
+    The wallet UTxOs holding the unique NFTs are spent, and other payment UTxOs only if they are needed
+    to provide the uADA that is burned, see select_utxos. The unlocked ADA pays for the transaction.
+    """
+    uada_script_hash = pycardano.plutus_script_hash(uada_script)
+    builder.hinted_script_hash = uada_script_hash
+    uada_token = Token(uada_script_hash.payload, b"uADA")
+    total_amount = sum(
+        position_utxo.output.amount.coin for position_utxo, _, _ in positions
+    )
+    fee = uada.compute_fee(
+        total_amount,
+        fee_params.withdrawal_fee_percent,
+        fee_params.withdrawal_fee_min,
+    )
+
+    nft_utxos = list({nft_utxo: None for _, _, nft_utxo in positions})
+    payment_utxos = select_utxos(
+        payment_utxos,
+        (fee if fee >= 1_000_000 else 0) - total_amount,
+        required_utxos=nft_utxos,
+        # the NFT UTxOs have to be spent, the limit applies to the UTxOs selected on top
+        max_inputs=len(nft_utxos) + max_selected_inputs,
+        reservations=reservations_of(builder.context),
+        required_assets=asset_from_token(uada_token, total_amount),
+    )
+    # the indices refer to the final, sorted set of inputs
+    all_utxos_sorted = sorted_utxos(
+        payment_utxos + [position_utxo for position_utxo, _, _ in positions]
+    )
+
+    all_ref_utxos_sorted = sorted_utxos(
+        [param_utxo]
+        + ([uada_ref_utxo] if uada_ref_utxo else [])
+        + ([one_shot_nft_ref_utxo] if one_shot_nft_ref_utxo else [])
+    )
+    param_utxo_index = all_ref_utxos_sorted.index(param_utxo)
+
+    for u in payment_utxos:
+        builder.add_input(u)
+
+    builder.mint = asset_from_token(uada_token, -total_amount)
+    for position_utxo, position_datum, nft_utxo in positions:
+        builder.add_script_input(
+            position_utxo,
+            uada_ref_utxo or uada_script,
+            None,
+            Redeemer(
+                uada.WithdrawUAdaStakingPosition(
+                    unique_nft_input_index=all_utxos_sorted.index(nft_utxo),
+                )
+            ),
+        )
+        builder.mint += asset_from_token(
+            Token(position_datum.policy_id, position_datum.token_name), -1
+        )
+    builder.add_minting_script(
+        uada_ref_utxo or uada_script,
+        Redeemer(uada.Nothing()),
+    )
+    builder.add_minting_script(
+        one_shot_nft_ref_utxo or one_shot_nft_script,
+        Redeemer([]),
+    )
+    builder.reference_inputs.add(param_utxo)
+    # the treasury payout must be the first output, see treasury_payout_tx_out_index
+    if fee >= 1_000_000:
+        builder.add_output(treasury_payout(fee_params, fee))
+    builder.withdrawals = Withdrawals(
+        {bytes(pycardano.Address(staking_part=uada_script_hash, network=network)): 0}
+    )
+    builder.add_withdrawal_script(
+        uada_ref_utxo or uada_script,
+        Redeemer(
+            uada.HintedContractInteractionRedeemer(
+                parameter_auth_nft_ref_utxo_index=param_utxo_index,
+                treasury_payout_tx_out_index=0,
+                # filled in by the HintingTransactionBuilder
+                script_output_indices=[],
+            )
+        ),
+    )
+    return builder
+
+
+def group_by_nft_utxo(positions: List[Position]) -> List[List[Position]]:
+    """
+    Positions whose NFTs sit in the same wallet UTxO have to be withdrawn together
+    """
+    groups: Dict[pycardano.UTxO, List[Position]] = {}
+    for position in positions:
+        groups.setdefault(position[2], []).append(position)
+    return list(groups.values())
+
+
+def build_batches(
+    context: pycardano.ChainContext,
+    payment_utxos: List[pycardano.UTxO],
+    groups: List[List[Position]],
+    signing_key: pycardano.PaymentSigningKey,
+    change_address: pycardano.Address,
+    **kwargs,
+) -> List[pycardano.Transaction]:
+    """
+    Build and sign one transaction withdrawing all positions, or split the positions into
+    several independent transactions if it exceeds the protocol limits.
+    The built transaction is compared with the limits, any failure to build it is raised.
+    """
+    builder = HintingTransactionBuilder(context, size_limited=False)
+    builder.auxiliary_data = AuxiliaryData(
+        data=AlonzoMetadata(metadata=Metadata({674: {"msg": ["Withdraw uADA"]}}))
+    )
+    build_batch_withdraw(
+        builder, payment_utxos, [p for g in groups for p in g], **kwargs
+    )
+    signed_tx = builder.build_and_sign(
+        signing_keys=[signing_key],
+        change_address=change_address,
+    )
+    if within_protocol_limits(signed_tx, context.protocol_param):
+        return [signed_tx]
+    assert len(groups) > 1, "Can not split positions that share a single NFT UTxO"
+    # the split transactions reserve their inputs again
+    reservations = reservations_of(context)
+    if reservations is not None:
+        reservations.release(u.input for u in builder.inputs)
+    half = len(groups) // 2
+    return build_batches(
+        context, payment_utxos, groups[:half], signing_key, change_address, **kwargs
+    ) + build_batches(
+        context, payment_utxos, groups[half:], signing_key, change_address, **kwargs
+    )
+
+
+def main(
+    wallet: str = "minter",
+    stake_keys: Tuple[str, ...] = (SAMPLE_STAKE_KEY,),
+    admin_wallet: str = "admin",
+):
+    """
+    Withdraw all staking positions whose unique NFT is held by the wallet
+    :param stake_keys: stake keys under which to look for positions and NFTs, the first one receives the change
+    """
+    # Load script info
+    _, _, uada_address = get_contract(module_name(uada), True)
+    _, one_shot_nft_policy_id, _ = get_contract(module_name(one_shot_nft), True)
+
+    # Get payment address
+    payment_vkey, payment_skey, payment_address = get_signing_info(
+        wallet, network=network
+    )
+    combined_payment_addresses = [
+        combine_with_stake_key(payment_address, stake_key) for stake_key in stake_keys
+    ]
+
+    admin_vkey, admin_skey, admin_address = get_signing_info(
+        admin_wallet, network=network
+    )
+
+    payment_utxos = [
+        u for address in combined_payment_addresses for u in context.utxos(address)
+    ]
+    positions = find_positions(
+        context,
+        [combine_with_stake_key(uada_address, stake_key) for stake_key in stake_keys],
+        payment_utxos,
+        one_shot_nft_policy_id,
+    )
+    assert positions, "No uada staking position found"
+
+    # find the fee parameters and reference scripts
+    state = ProtocolState.from_contracts(context, admin_address).refresh()
+    assert state.fee_params is not None, "No auth nft found"
+
+    # the split transactions select disjoint wallet UTxOs
+    reserving_context = ReservingChainContext(context)
+    signed_txs = build_batches(
+        reserving_context,
+        payment_utxos,
+        group_by_nft_utxo(positions),
+        payment_skey,
+        combined_payment_addresses[0],
+        param_utxo=state.param_utxo,
+        fee_params=state.fee_params,
+        uada_script=state.uada_script,
+        one_shot_nft_script=state.one_shot_nft_script,
+        uada_ref_utxo=state.uada_ref_utxo,
+        one_shot_nft_ref_utxo=state.one_shot_nft_ref_utxo,
+    )
+
+    # Submit the transactions, they spend disjoint inputs
+    for signed_tx in signed_txs:
+        context.submit_tx(signed_tx)
+        show_tx(signed_tx)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
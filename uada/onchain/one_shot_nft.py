@@ -21,30 +21,37 @@ def one_shot_nft_name(spent_utxo: TxOutRef) -> TokenName:
     return sha2_256(bytes_big_from_unsigned_int(spent_utxo.idx) + spent_utxo.id.tx_id)
 
 
-def validator(unique_utxo_index: int, context: ScriptContext) -> None:
+def validator(unique_utxo_indices: List[int], context: ScriptContext) -> None:
     """
-    One-shot minting policy. Ensures that the name of the resulting NFT is unique,
-    being the hash of a consumed UTxO.
+    One-shot minting policy. Ensures that the name of every resulting NFT is unique,
+    being the hash of a consumed UTxO. Several NFTs may be minted at once, one per
+    consumed UTxO listed in the redeemer.
     """
     policy_id = get_minting_purpose(context).policy_id
+    minted = context.tx_info.mint[policy_id]
 
-    if unique_utxo_index < 0:
-        # A negative utxo index indicates that the token should be burned
+    if not unique_utxo_indices:
+        # An empty list of utxo indices indicates that the tokens should be burned
         # which is always fine (as long as it is actually a burn)
         assert all(
-            [
-                name_amount[1] < 0
-                for name_amount in context.tx_info.mint[policy_id].items()
-            ]
+            [name_amount[1] < 0 for name_amount in minted.items()]
         ), "Trying to mint in burn tx"
     else:
         # Check that
-        # 1. only one token of the own policy id is minted
-        # 2. the tokenname is the hash of the spent UTxO indicated by the redeemer
-
-        spent_input = context.tx_info.inputs[unique_utxo_index].out_ref
-        required_token_name = one_shot_nft_name(spent_input)
-
-        check_mint_exactly_one_with_name(
-            context.tx_info.mint, policy_id, required_token_name
-        )
+        # 1. exactly one token is minted for each spent UTxO indicated by the redeemer
+        # 2. the tokenname is the hash of the respective spent UTxO
+        # 3. no other token of the own policy id is minted
+        # The indices must be strictly ascending, so that no UTxO is counted twice in 3.
+
+        inputs = context.tx_info.inputs
+        previous_index = -1
+        for unique_utxo_index in unique_utxo_indices:
+            assert (
+                unique_utxo_index > previous_index
+            ), "UTxO indices must be strictly ascending"
+            previous_index = unique_utxo_index
+            required_token_name = one_shot_nft_name(inputs[unique_utxo_index].out_ref)
+            assert (
+                minted.get(required_token_name, 0) == 1
+            ), "Exactly one token must be minted per spent UTxO"
+        assert len(minted) == len(unique_utxo_indices), "No other token must be minted"
@@ -15,6 +15,19 @@ class ContractInteractionRedeemer(PlutusData):
     treasury_payout_tx_out_index: int
 
 
+@dataclass
+class HintedContractInteractionRedeemer(PlutusData):
+    """
+    Like ContractInteractionRedeemer, but also lists the (strictly ascending) indices of all outputs
+    that lock lovelace in the script
+    """
+
+    CONSTR_ID = 3
+    parameter_auth_nft_ref_utxo_index: int
+    treasury_payout_tx_out_index: int
+    script_output_indices: List[int]
+
+
 @dataclass
 class UAdaFeeParams(PlutusData):
     """
@@ -31,7 +44,12 @@ class UAdaFeeParams(PlutusData):
     treasury_out_datum: OutputDatum
 
 
-UAdaRedeemer = Union[WithdrawUAdaStakingPosition, Nothing, ContractInteractionRedeemer]
+UAdaRedeemer = Union[
+    WithdrawUAdaStakingPosition,
+    Nothing,
+    ContractInteractionRedeemer,
+    HintedContractInteractionRedeemer,
+]
 
 
 def all_lovelace_unlocked_from_script(
@@ -67,6 +85,30 @@ def all_lovelace_locked_in_script(
     return total
 
 
+def hinted_lovelace_locked_in_script(
+    script_credential: ScriptCredential,
+    tx_info: TxInfo,
+    script_output_indices: List[int],
+) -> int:
+    """
+    Return the total amount of tokens locked in the script.
+    Every output at the script must be hinted, in the order of the outputs, and every hint must be such an output,
+    so no lovelace can be locked without minting uADA for it.
+    """
+    remaining_indices = script_output_indices
+    total = 0
+    index = 0
+    for tx_out in tx_info.outputs:
+        if script_credential == tx_out.address.payment_credential:
+            # fails with an IndexError if the hints are exhausted
+            assert remaining_indices[0] == index, "Script output not hinted"
+            remaining_indices = remaining_indices[1:]
+            total += tx_out.value.get(b"", EMTPY_TOKENNAME_DICT).get(b"", 0)
+        index += 1
+    assert not remaining_indices, "Hinted output not in script"
+    return total
+
+
 def check_withdrawal_invoked(
     own_script_credential: ScriptCredential,
     tx_info: TxInfo,
@@ -116,6 +158,58 @@ def check_pays_fee_to_treasury(
         ), "Not enough lovelace paid to treasury"
 
 
+def check_contract_interaction(
+    expected_diff: int,
+    own_script_hash: bytes,
+    parameter_auth_nft_policy_id: PolicyId,
+    parameter_auth_nft_ref_utxo_index: int,
+    treasury_payout_tx_out_index: int,
+    tx_info: TxInfo,
+) -> None:
+    """
+    Check that exactly the difference of locked and unlocked lovelace is minted as uADA
+    and that the fee is paid to the treasury
+    """
+    uada_policy_id: PolicyId = own_script_hash
+    uada_token_name: TokenName = b"uADA"
+
+    check_mint_exactly_n_with_name(
+        tx_info.mint, expected_diff, uada_policy_id, uada_token_name
+    )
+
+    # Verify that the fee is being paid to the treasury
+    params_ref_input = tx_info.reference_inputs[
+        parameter_auth_nft_ref_utxo_index
+    ].resolved
+    assert token_present_in_output(
+        Token(parameter_auth_nft_policy_id, b""), params_ref_input
+    ), "Auth NFT not present in parameter reference input"
+    fee_params: UAdaFeeParams = resolve_datum_unsafe(
+        params_ref_input,
+        tx_info,
+    )
+    if expected_diff < 0:
+        check_pays_fee_to_treasury(
+            -expected_diff,
+            fee_params.withdrawal_fee_percent,
+            fee_params.withdrawal_fee_min,
+            tx_info.outputs,
+            treasury_payout_tx_out_index,
+            fee_params.treasury_address,
+            fee_params.treasury_out_datum,
+        )
+    else:
+        check_pays_fee_to_treasury(
+            expected_diff,
+            fee_params.mint_fee_percent,
+            fee_params.mint_fee_min,
+            tx_info.outputs,
+            treasury_payout_tx_out_index,
+            fee_params.treasury_address,
+            fee_params.treasury_out_datum,
+        )
+
+
 def validator(
     parameter_auth_nft_policy_id: PolicyId,
     datum: Union[UAdaStakingPosition, Nothing],
@@ -166,50 +260,38 @@ def validator(
         # In this case, the withdrawal was obviously invoked (it is being invoked in this branch)
 
         # Verify the circulating supply invariant
-        uada_policy_id: PolicyId = own_script_hash
-        uada_token_name: TokenName = b"uADA"
-
         tokens_unlocked_from_contract = all_lovelace_unlocked_from_script(
             own_script_credential, tx_info
         )
         tokens_locked_in_contract = all_lovelace_locked_in_script(
             own_script_credential, tx_info
         )
-        expected_diff = tokens_locked_in_contract - tokens_unlocked_from_contract
-        check_mint_exactly_n_with_name(
-            tx_info.mint, expected_diff, uada_policy_id, uada_token_name
+        check_contract_interaction(
+            tokens_locked_in_contract - tokens_unlocked_from_contract,
+            own_script_hash,
+            parameter_auth_nft_policy_id,
+            redeemer.parameter_auth_nft_ref_utxo_index,
+            redeemer.treasury_payout_tx_out_index,
+            tx_info,
         )
-
-        # Verify that the fee is being paid to the treasury
-        params_ref_input = tx_info.reference_inputs[
-            redeemer.parameter_auth_nft_ref_utxo_index
-        ].resolved
-        assert token_present_in_output(
-            Token(parameter_auth_nft_policy_id, b""), params_ref_input
-        ), "Auth NFT not present in parameter reference input"
-        fee_params: UAdaFeeParams = resolve_datum_unsafe(
-            params_ref_input,
+    elif isinstance(purpose, Rewarding) and isinstance(
+        redeemer, HintedContractInteractionRedeemer
+    ):
+        # Same as above, but the outputs at the script must match the hints
+        # All inputs are still scanned, an unhinted script input would unlock lovelace without burning uADA
+        tokens_unlocked_from_contract = all_lovelace_unlocked_from_script(
+            own_script_credential, tx_info
+        )
+        tokens_locked_in_contract = hinted_lovelace_locked_in_script(
+            own_script_credential, tx_info, redeemer.script_output_indices
+        )
+        check_contract_interaction(
+            tokens_locked_in_contract - tokens_unlocked_from_contract,
+            own_script_hash,
+            parameter_auth_nft_policy_id,
+            redeemer.parameter_auth_nft_ref_utxo_index,
+            redeemer.treasury_payout_tx_out_index,
             tx_info,
         )
-        if expected_diff < 0:
-            check_pays_fee_to_treasury(
-                -expected_diff,
-                fee_params.withdrawal_fee_percent,
-                fee_params.withdrawal_fee_min,
-                tx_info.outputs,
-                redeemer.treasury_payout_tx_out_index,
-                fee_params.treasury_address,
-                fee_params.treasury_out_datum,
-            )
-        else:
-            check_pays_fee_to_treasury(
-                expected_diff,
-                fee_params.mint_fee_percent,
-                fee_params.mint_fee_min,
-                tx_info.outputs,
-                redeemer.treasury_payout_tx_out_index,
-                fee_params.treasury_address,
-                fee_params.treasury_out_datum,
-            )
     else:
         assert False, "Invalid purpose, datum or redeemer combination"
@@ -1,9 +1,13 @@
 from opshin.prelude import *
 from uada.onchain.utils.ext_interval import *
 from opshin.std.builtins import *
+from opshin.bridge import wraps_builtin
 
 EMTPY_TOKENNAME_DICT: Dict[bytes, int] = {}
 EMPTY_VALUE_DICT: Value = {}
+# from this number of policies in both values together, merging costs less fees than
+# the quadratic value arithmetic (see merge_crossover in uada.benchmark_util)
+VALUE_MERGE_THRESHOLD = 44
 
 
 def get_minting_purpose(context: ScriptContext) -> Minting:
@@ -52,7 +56,9 @@ def merge_without_duplicates(a: List[bytes], b: List[bytes]) -> List[bytes]:
     Rough estimate allows 1000 bytes / 32 bytes per policy id ~ 31 policy ids
     However for token names no lower bound on the length is given, so we assume 1000 bytes / 1 byte per token name ~ 1000 token names
     """
-    return [x for x in a if not x in b] + b
+    # b is copied so that the value helpers also run in Python, where they pass the keys() view of a dict
+    # that can not be added to a list. This costs one more pass over b (about 10% of this helper).
+    return [x for x in a if not x in b] + [x for x in b]
 
 
 def _subtract_token_names(
@@ -71,9 +77,10 @@ def _subtract_token_names(
     }
 
 
-def subtract_value(a: Value, b: Value) -> Value:
+def _subtract_value_unsorted(a: Value, b: Value) -> Value:
     """
     Subtract b from a, return a - b
+    Works for maps in any order, but is O(n^2)
     """
     if not b:
         return a
@@ -108,9 +115,10 @@ def _add_token_names(
     }
 
 
-def add_value(a: Value, b: Value) -> Value:
+def _add_value_unsorted(a: Value, b: Value) -> Value:
     """
     Add b to a, return a + b
+    Works for maps in any order, but is O(n^2)
     """
     if not a:
         return b
@@ -124,16 +132,257 @@ def add_value(a: Value, b: Value) -> Value:
     }
 
 
-def total_value(value_store_inputs: List[TxOut]) -> Value:
+def _total_value_unsorted(value_store_inputs: List[TxOut]) -> Value:
     """
     Calculate the total value of all inputs
+    Works for maps in any order, but is O(n^2)
     """
     total_value = EMPTY_VALUE_DICT
     for txo in value_store_inputs:
-        total_value = add_value(total_value, txo.value)
+        total_value = _add_value_unsorted(total_value, txo.value)
     return total_value
 
 
+@wraps_builtin
+def tail_list(x: List[Anything]) -> List[Anything]:
+    """
+    Drop the first element of the list, in constant time (unlike slicing)
+    Note: only lists of bytes, ints and lists of those behave correctly in Python
+    """
+    pass
+
+
+@dataclass
+class TokenAmount(PlutusData):
+    """
+    Entry of the token name map of a value, used while merging values
+    """
+
+    CONSTR_ID = 0
+    token_name: TokenName
+    amount: int
+
+
+@dataclass
+class PolicyTokens(PlutusData):
+    """
+    Entry of the policy id map of a value, used while merging values
+    """
+
+    CONSTR_ID = 0
+    policy_id: PolicyId
+    tokens: Dict[TokenName, int]
+
+
+def _token_names_ascending(tokens: Dict[TokenName, int]) -> bool:
+    res = True
+    first = True
+    previous = b""
+    for tn in tokens.keys():
+        res = res and (first or previous < tn)
+        first = False
+        previous = tn
+    return res
+
+
+def _value_ascending(v: Value) -> bool:
+    """
+    Whether policy ids and token names of the value are strictly ascending, as in values provided by the ledger
+    """
+    res = True
+    first = True
+    previous = b""
+    for pid_tokens in v.items():
+        pid = pid_tokens[0]
+        res = (
+            res and (first or previous < pid) and _token_names_ascending(pid_tokens[1])
+        )
+        first = False
+        previous = pid
+    return res
+
+
+def _merge_token_names(
+    a: Dict[TokenName, int],
+    b_token_names: List[TokenName],
+    b_amounts: List[int],
+    sign: int,
+) -> Dict[TokenName, int]:
+    """
+    Return a + sign * b in O(n), where b is given as its (ascending) token names and amounts
+    Requires a to be sorted ascending by token name
+    """
+    merged: List[TokenAmount] = []
+    for tn_amount in a.items():
+        tn = tn_amount[0]
+        pending = True
+        while pending:
+            if b_token_names:
+                b_tn = b_token_names[0]
+                if b_tn < tn:
+                    merged = [TokenAmount(b_tn, sign * b_amounts[0])] + merged
+                    b_token_names: List[TokenName] = tail_list(b_token_names)
+                    b_amounts: List[int] = tail_list(b_amounts)
+                elif b_tn == tn:
+                    merged = [
+                        TokenAmount(tn, tn_amount[1] + sign * b_amounts[0])
+                    ] + merged
+                    b_token_names: List[TokenName] = tail_list(b_token_names)
+                    b_amounts: List[int] = tail_list(b_amounts)
+                    pending = False
+                else:
+                    merged = [TokenAmount(tn, tn_amount[1])] + merged
+                    pending = False
+            else:
+                merged = [TokenAmount(tn, tn_amount[1])] + merged
+                pending = False
+    while b_token_names:
+        merged = [TokenAmount(b_token_names[0], sign * b_amounts[0])] + merged
+        b_token_names: List[TokenName] = tail_list(b_token_names)
+        b_amounts: List[int] = tail_list(b_amounts)
+    # merged is descending, restore the order
+    ascending: List[TokenAmount] = []
+    for t in merged:
+        ascending = [t] + ascending
+    return {t.token_name: t.amount for t in ascending}
+
+
+def _merge_values(a: Value, b: Value, sign: int) -> Value:
+    """
+    Return a + sign * b in O(n)
+    Requires both values to be sorted ascending by policy id and token name
+    """
+    # b is consumed from the front, lists of plain bytes and ints can be traversed with tail_list
+    b_policy_ids: List[PolicyId] = [pid for pid in b.keys()]
+    b_token_names: List[List[TokenName]] = [
+        [tn for tn in tokens.keys()] for tokens in b.values()
+    ]
+    b_amounts: List[List[int]] = [
+        [amount for amount in tokens.values()] for tokens in b.values()
+    ]
+    merged: List[PolicyTokens] = []
+    for pid_tokens in a.items():
+        pid = pid_tokens[0]
+        pending = True
+        while pending:
+            if b_policy_ids:
+                b_pid = b_policy_ids[0]
+                if b_pid < pid:
+                    merged = [
+                        PolicyTokens(
+                            b_pid,
+                            _merge_token_names(
+                                EMTPY_TOKENNAME_DICT,
+                                b_token_names[0],
+                                b_amounts[0],
+                                sign,
+                            ),
+                        )
+                    ] + merged
+                    b_policy_ids: List[PolicyId] = tail_list(b_policy_ids)
+                    b_token_names: List[List[TokenName]] = tail_list(b_token_names)
+                    b_amounts: List[List[int]] = tail_list(b_amounts)
+                elif b_pid == pid:
+                    merged = [
+                        PolicyTokens(
+                            pid,
+                            _merge_token_names(
+                                pid_tokens[1], b_token_names[0], b_amounts[0], sign
+                            ),
+                        )
+                    ] + merged
+                    b_policy_ids: List[PolicyId] = tail_list(b_policy_ids)
+                    b_token_names: List[List[TokenName]] = tail_list(b_token_names)
+                    b_amounts: List[List[int]] = tail_list(b_amounts)
+                    pending = False
+                else:
+                    merged = [PolicyTokens(pid, pid_tokens[1])] + merged
+                    pending = False
+            else:
+                merged = [PolicyTokens(pid, pid_tokens[1])] + merged
+                pending = False
+    while b_policy_ids:
+        merged = [
+            PolicyTokens(
+                b_policy_ids[0],
+                _merge_token_names(
+                    EMTPY_TOKENNAME_DICT, b_token_names[0], b_amounts[0], sign
+                ),
+            )
+        ] + merged
+        b_policy_ids: List[PolicyId] = tail_list(b_policy_ids)
+        b_token_names: List[List[TokenName]] = tail_list(b_token_names)
+        b_amounts: List[List[int]] = tail_list(b_amounts)
+    # merged is descending, restore the order
+    ascending: List[PolicyTokens] = []
+    for p in merged:
+        ascending = [p] + ascending
+    return {p.policy_id: p.tokens for p in ascending}
+
+
+def subtract_value(a: Value, b: Value) -> Value:
+    """
+    Subtract b from a, return a - b
+    Linear for large values whose keys are sorted ascending (as in values provided by the ledger),
+    falls back to the quadratic implementation otherwise
+    """
+    if not b:
+        return a
+    if (
+        len(a) + len(b) >= VALUE_MERGE_THRESHOLD
+        and _value_ascending(a)
+        and _value_ascending(b)
+    ):
+        res = _merge_values(a, b, -1)
+    else:
+        res = _subtract_value_unsorted(a, b)
+    return res
+
+
+def add_value(a: Value, b: Value) -> Value:
+    """
+    Add b to a, return a + b
+    Linear for large values whose keys are sorted ascending (as in values provided by the ledger),
+    falls back to the quadratic implementation otherwise
+    """
+    if not a:
+        return b
+    if not b:
+        return a
+    if (
+        len(a) + len(b) >= VALUE_MERGE_THRESHOLD
+        and _value_ascending(a)
+        and _value_ascending(b)
+    ):
+        res = _merge_values(a, b, 1)
+    else:
+        res = _add_value_unsorted(a, b)
+    return res
+
+
+def total_value(value_store_inputs: List[TxOut]) -> Value:
+    """
+    Calculate the total value of all inputs
+    Linear for large values that are all sorted ascending, the running total then stays sorted
+    """
+    policies = 0
+    for txo in value_store_inputs:
+        policies += len(txo.value)
+    merge = policies >= VALUE_MERGE_THRESHOLD
+    for txo in value_store_inputs:
+        merge = merge and _value_ascending(txo.value)
+    if merge:
+        res = EMPTY_VALUE_DICT
+        for txo in value_store_inputs:
+            if not res:
+                res = txo.value
+            else:
+                res = _merge_values(res, txo.value, 1)
+    else:
+        res = _total_value_unsorted(value_store_inputs)
+    return res
+
+
 def check_mint_exactly_n_with_name(
     mint: Value, n: int, policy_id: PolicyId, required_token_name: TokenName
 ) -> None:
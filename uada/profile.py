@@ -0,0 +1,204 @@
+"""
+Execution cost profile of the uADA validator by source level function.
+
+The contract is compiled in process, where the UPLC still carries the names opshin gives
+to the functions of the contract, and every machine step and builtin call is charged to the
+innermost function that contains the computed term. Frames are nested lexically, i.e. a helper
+of uada.onchain.util shows up under its own name, not under the function calling it.
+The list and data access patterns inserted by the compiler are charged to the function using them.
+The cost of the code plutonomy would optimise away is included, the profile is of the plain build.
+"""
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import fire
+from uplc.ast import AST, Apply, Delay, Force, Lambda, Program
+from uplc.ast import PlutusByteString, plutus_cbor_dumps
+
+from uada import benchmark
+from uada.build import compile_uplc
+from uada.offchain.util import module_name
+from uada.onchain import parameter_auth_nft, uada
+from uada.utils.contracts import get_contract
+from uada.utils.evaluate import STARTUP_COST, CostingMachine, to_uplc_data
+
+# opshin names variables by their name in the source and the id of their scope
+OPSHIN_NAME = re.compile(r"^(?P<name>[A-Za-z_]\w*?)_\d+$")
+# pluthon names its helper patterns 0p_<pattern>_
+PLUTHON_PATTERN = re.compile(r"^0p_(?P<name>[A-Za-z]+)")
+DIMENSIONS = ("cpu", "mem")
+
+Frame = Tuple[str, ...]
+
+
+def function_name(var_name: str, value: AST) -> Optional[str]:
+    """
+    The name of the function if the value bound to the variable is a function definition
+    """
+    pattern = PLUTHON_PATTERN.match(var_name)
+    if pattern:
+        return f"pluthon.{pattern['name']}"
+    name = OPSHIN_NAME.match(var_name)
+    if name and isinstance(value, Delay) and isinstance(value.term, Lambda):
+        return name["name"]
+    return None
+
+
+def is_pattern(name: str) -> bool:
+    return name.startswith("pluthon.")
+
+
+def children(term: AST) -> List[AST]:
+    if isinstance(term, Apply):
+        return [term.f, term.x]
+    if isinstance(term, (Lambda, Delay, Force)):
+        return [term.term]
+    return []
+
+
+def label_functions(named: AST, renamed: AST) -> Dict[int, Frame]:
+    """
+    The lexical function frame of every term of renamed, which has the same structure
+    as named but the variables renamed by the machine
+    """
+    labels = {}
+    stack = [(named, renamed, ())]
+    while stack:
+        n, r, frame = stack.pop()
+        labels[id(r)] = frame
+        n_children, r_children = children(n), children(r)
+        if isinstance(n, Apply) and isinstance(n.f, Lambda):
+            name = function_name(n.f.var_name, n.x)
+            if name is not None:
+                stack.append((n.f, r.f, frame))
+                stack.append((n.x, r.x, frame + (name,)))
+                continue
+        stack.extend((nc, rc, frame) for nc, rc in zip(n_children, r_children))
+    return labels
+
+
+class ProfilingMachine(CostingMachine):
+    """
+    Costing machine that also sums up the costs by function frame
+    """
+
+    def __init__(self, program: AST, max_steps=10_000_000):
+        super().__init__(program, max_steps=max_steps)
+        self.labels = label_functions(program, self.program)
+        self.frame: Frame = ()
+        self.caller: Frame = ()
+        self.profile: Dict[Frame, List[int]] = defaultdict(lambda: [0, 0])
+        self.profile[()] = list(STARTUP_COST)
+
+    def enter(self, term: AST):
+        frame = self.labels.get(id(term))
+        # terms created during evaluation belong to the frame that created them
+        if frame is None:
+            return
+        if frame and is_pattern(frame[-1]):
+            # the patterns of pluthon are shared, they are charged to the function using them
+            self.frame = self.caller + frame[-1:]
+        else:
+            self.frame = self.caller = frame
+
+    def charge(self, cpu: int, mem: int):
+        super().charge(cpu, mem)
+        cost = self.profile[self.frame]
+        cost[0] += cpu
+        cost[1] += mem
+
+
+def profile_program(program: Program, *args: Any) -> Dict[Frame, Dict[str, int]]:
+    """
+    Apply the arguments to the compiled contract and return its cost by function frame
+    """
+    term = program.term
+    for arg in args:
+        term = Apply(term, to_uplc_data(arg))
+    machine = ProfilingMachine(term)
+    machine.eval()
+    return {
+        frame: dict(zip(DIMENSIONS, cost)) for frame, cost in machine.profile.items()
+    }
+
+
+def folded(
+    profile: Dict[Frame, Dict[str, int]], root: str, dimension: str = "cpu"
+) -> str:
+    """
+    The profile in the folded stack format of flamegraph.pl, speedscope and inferno
+    """
+    return "".join(
+        f"{';'.join((root,) + frame)} {cost[dimension]}\n"
+        for frame, cost in sorted(profile.items())
+        if cost[dimension] > 0
+    )
+
+
+def top(
+    profile: Dict[Frame, Dict[str, int]], n: int = 20, dimension: str = "cpu"
+) -> List[Tuple[str, int, int]]:
+    """
+    The functions with the highest own cost, including the patterns they use, with their cpu and mem
+    """
+    by_function = defaultdict(lambda: [0, 0])
+    for frame, cost in profile.items():
+        functions = [name for name in frame if not is_pattern(name)]
+        totals = by_function[functions[-1] if functions else "<toplevel>"]
+        totals[0] += cost["cpu"]
+        totals[1] += cost["mem"]
+    rows = [(name, cpu, mem) for name, (cpu, mem) in by_function.items()]
+    rows.sort(key=lambda r: r[1 + DIMENSIONS.index(dimension)], reverse=True)
+    return rows[:n]
+
+
+def main(
+    branch: str = "rewarding",
+    output: Optional[str] = None,
+    n: int = 20,
+    dimension: str = "cpu",
+    inputs: int = 1,
+    outputs: int = 1,
+    reference_inputs: int = 0,
+    mint: int = 0,
+    hinted: bool = False,
+):
+    """
+    Profile a branch of the uADA validator for a transaction of the given shape, see uada.benchmark
+    :param output: if given, write the folded stacks to this file, e.g. for flamegraph.pl
+    :param n: number of functions in the table of the most expensive functions
+    """
+    # uada is always parameterized with the compressed auth nft, see uada.build
+    _, auth_nft_policy_id, _ = get_contract(module_name(parameter_auth_nft), True)
+    program = compile_uplc(
+        uada.__file__,
+        ("--cf", "--force-three-params"),
+        [plutus_cbor_dumps(PlutusByteString(auth_nft_policy_id.payload)).hex()],
+    )
+    profile = profile_program(
+        program,
+        *benchmark.script_context(
+            branch,
+            inputs=inputs,
+            outputs=outputs,
+            reference_inputs=reference_inputs,
+            mint=mint,
+            hinted=hinted,
+        ),
+    )
+    total = {d: sum(c[d] for c in profile.values()) for d in DIMENSIONS}
+    print(f"{branch}: {total['cpu']} cpu {total['mem']} mem")
+    for name, cpu, mem in top(profile, n, dimension):
+        print(
+            f"  {name:<40} {cpu:>11} cpu {cpu / total['cpu']:>6.1%} "
+            f"{mem:>8} mem {mem / total['mem']:>6.1%}"
+        )
+    if output is not None:
+        Path(output).write_text(folded(profile, module_name(uada), dimension))
+        print(f"wrote folded stacks to {output}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
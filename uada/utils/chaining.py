@@ -0,0 +1,270 @@
+"""
+Chaining of transactions on outputs that are not confirmed yet.
+
+The chain context is extended with the outputs of submitted transactions, so that dependent
+transactions can be built, evaluated and submitted back to back instead of waiting a block for each.
+The node accepts them into its mempool as long as the transactions they spend are in it.
+"""
+import json
+from typing import Callable, Dict, List, Optional, Union
+
+import cbor2
+import ogmios
+import pycardano
+import websocket
+from pycardano.serialization import default_encoder
+
+from .network import ogmios_host, ogmios_port, ogmios_protocol, ogmios_url
+from .reservations import spent_inputs
+
+# redeemer purposes of Ogmios and the redeemer tags of pycardano that the builder expects
+OGMIOS_PURPOSES = {
+    "spend": "spend",
+    "mint": "mint",
+    "publish": "cert",
+    "withdraw": "reward",
+}
+# the same for the protocol of Ogmios v5
+OGMIOS_V5_PURPOSES = {
+    "spend": "spend",
+    "mint": "mint",
+    "certificate": "cert",
+    "withdrawal": "reward",
+}
+
+Evaluator = Callable[
+    [pycardano.Transaction, List[pycardano.UTxO]],
+    Dict[str, pycardano.ExecutionUnits],
+]
+
+
+def ogmios_utxo_json(utxo: pycardano.UTxO) -> dict:
+    """
+    The UTxO in the JSON format of Ogmios
+    """
+    output = utxo.output
+    value = {"ada": {"lovelace": output.amount.coin}}
+    for policy_id, assets in output.amount.multi_asset.items():
+        value[policy_id.payload.hex()] = {
+            name.payload.hex(): amount for name, amount in assets.items()
+        }
+    res = {
+        "transaction": {"id": str(utxo.input.transaction_id)},
+        "index": utxo.input.index,
+        "address": str(output.address),
+        "value": value,
+    }
+    if output.datum_hash is not None:
+        res["datumHash"] = output.datum_hash.payload.hex()
+    if output.datum is not None:
+        res["datum"] = cbor2.dumps(output.datum, default=default_encoder).hex()
+    if output.script is not None:
+        res["script"] = {
+            "language": "plutus:v1"
+            if isinstance(output.script, pycardano.PlutusV1Script)
+            else "plutus:v2",
+            "cbor": bytes(output.script).hex(),
+        }
+    return res
+
+
+def ogmios_v5_utxo_json(utxo: pycardano.UTxO) -> list:
+    """
+    The UTxO in the JSON format of Ogmios v5
+    """
+    output = utxo.output
+    assets = {}
+    for policy_id, policy_assets in output.amount.multi_asset.items():
+        for name, amount in policy_assets.items():
+            key = policy_id.payload.hex()
+            if name.payload:
+                key += f".{name.payload.hex()}"
+            assets[key] = amount
+    res = {
+        "address": str(output.address),
+        "value": {"coins": output.amount.coin, "assets": assets},
+    }
+    if output.datum_hash is not None:
+        res["datumHash"] = output.datum_hash.payload.hex()
+    if output.datum is not None:
+        res["datum"] = cbor2.dumps(output.datum, default=default_encoder).hex()
+    if output.script is not None:
+        language = (
+            "plutus:v1"
+            if isinstance(output.script, pycardano.PlutusV1Script)
+            else "plutus:v2"
+        )
+        res["script"] = {language: bytes(output.script).hex()}
+    return [
+        {"txId": str(utxo.input.transaction_id), "index": utxo.input.index},
+        res,
+    ]
+
+
+def evaluate_with_ogmios_v5(
+    tx: pycardano.Transaction, additional_utxos: List[pycardano.UTxO]
+) -> Dict[str, pycardano.ExecutionUnits]:
+    """
+    Evaluate the scripts of the transaction with Ogmios v5, like pycardano's OgmiosChainContext does,
+    resolving inputs from the additional UTxOs if they are not on chain yet
+    """
+    ws = websocket.create_connection(ogmios_url)
+    try:
+        ws.send(
+            json.dumps(
+                {
+                    "type": "jsonwsp/request",
+                    "version": "1.0",
+                    "servicename": "ogmios",
+                    "methodname": "EvaluateTx",
+                    "args": {
+                        "evaluate": tx.to_cbor_hex(),
+                        "additionalUtxoSet": [
+                            ogmios_v5_utxo_json(u) for u in additional_utxos
+                        ],
+                    },
+                }
+            )
+        )
+        response = json.loads(ws.recv())
+    finally:
+        ws.close()
+    result = response.get("result") or {}
+    if "EvaluationResult" not in result:
+        raise pycardano.TransactionFailedException(response)
+    res = {}
+    for key, budget in result["EvaluationResult"].items():
+        purpose, index = key.split(":")
+        res[f"{OGMIOS_V5_PURPOSES[purpose]}:{index}"] = pycardano.ExecutionUnits(
+            budget["memory"], budget["steps"]
+        )
+    return res
+
+
+def evaluate_with_ogmios(
+    tx: pycardano.Transaction, additional_utxos: List[pycardano.UTxO]
+) -> Dict[str, pycardano.ExecutionUnits]:
+    """
+    Evaluate the scripts of the transaction with Ogmios v6, resolving inputs from the additional UTxOs
+    if they are not on chain yet
+    """
+    with ogmios.Client(
+        host=ogmios_host,
+        port=int(ogmios_port),
+        secure=ogmios_protocol == "wss",
+    ) as client:
+        client.send(
+            json.dumps(
+                {
+                    "jsonrpc": "2.0",
+                    "method": "evaluateTransaction",
+                    "params": {
+                        "transaction": {"cbor": tx.to_cbor_hex()},
+                        "additionalUtxo": [
+                            ogmios_utxo_json(u) for u in additional_utxos
+                        ],
+                    },
+                }
+            )
+        )
+        response = client.receive()
+    if "error" in response:
+        raise pycardano.TransactionFailedException(response["error"])
+    return {
+        f"{OGMIOS_PURPOSES[r['validator']['purpose']]}:{r['validator']['index']}": pycardano.ExecutionUnits(
+            r["budget"]["memory"], r["budget"]["cpu"]
+        )
+        for r in response["result"]
+    }
+
+
+def ogmios_evaluator(context: pycardano.ChainContext) -> Evaluator:
+    """
+    The evaluator that speaks the protocol of the Ogmios the context is connected to:
+    pycardano's OgmiosChainContext only connects to Ogmios v5, the one of the ogmios package to v6
+    (see uada.utils.network.connect_context)
+    """
+    if isinstance(context, pycardano.OgmiosChainContext):
+        return evaluate_with_ogmios_v5
+    return evaluate_with_ogmios
+
+
+class ChainingContext:
+    """
+    Stands in for a chain context and treats submitted transactions as if they were confirmed:
+    their outputs are handed out as UTxOs and the UTxOs they spend are not.
+    A transaction stops being pending once one of its outputs is returned by the chain
+    or it is included in a block reported by chain-sync.
+    """
+
+    def __init__(
+        self,
+        context: pycardano.ChainContext,
+        evaluate: Optional[Evaluator] = None,
+    ):
+        self.context = context
+        self.evaluate = evaluate or ogmios_evaluator(context)
+        self.pending: Dict[pycardano.TransactionId, pycardano.Transaction] = {}
+
+    def spent(self) -> set:
+        return {i for tx in self.pending.values() for i in tx.transaction_body.inputs}
+
+    def pending_utxos(self) -> List[pycardano.UTxO]:
+        """
+        The outputs of pending transactions that no other pending transaction spends
+        """
+        spent = self.spent()
+        utxos = [
+            pycardano.UTxO(pycardano.TransactionInput(tx_id, index), output)
+            for tx_id, tx in self.pending.items()
+            for index, output in enumerate(tx.transaction_body.outputs)
+        ]
+        return [u for u in utxos if u.input not in spent]
+
+    def confirm(self, tx_ids):
+        for tx_id in tx_ids:
+            self.pending.pop(tx_id, None)
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        confirmed = self.context.utxos(address)
+        self.confirm({u.input.transaction_id for u in confirmed})
+        spent = self.spent()
+        return [u for u in confirmed if u.input not in spent] + [
+            u for u in self.pending_utxos() if str(u.output.address) == str(address)
+        ]
+
+    def submit_tx(self, tx: pycardano.Transaction):
+        res = self.context.submit_tx(tx)
+        self.pending[tx.id] = tx
+        return res
+
+    def evaluate_tx(
+        self, tx: pycardano.Transaction
+    ) -> Dict[str, pycardano.ExecutionUnits]:
+        body = tx.transaction_body
+        referenced = set(body.inputs) | set(body.reference_inputs or [])
+        additional_utxos = [u for u in self.pending_utxos() if u.input in referenced]
+        if not additional_utxos:
+            return self.context.evaluate_tx(tx)
+        return self.evaluate(tx, additional_utxos)
+
+    def roll_forward(self, transactions: List[dict]):
+        """
+        Pending transactions included in a new block are confirmed
+        """
+        self.confirm(
+            pycardano.TransactionId.from_primitive(tx["id"]) for tx in transactions
+        )
+        # transactions spending the same inputs can no longer be included
+        spent = set(spent_inputs(transactions))
+        for tx_id in [
+            tx_id
+            for tx_id, tx in self.pending.items()
+            if spent.intersection(tx.transaction_body.inputs)
+        ]:
+            del self.pending[tx_id]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.context, name)
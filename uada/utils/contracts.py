@@ -1,4 +1,7 @@
+import functools
+import json
 from pathlib import Path
+from typing import Dict
 
 from pycardano import (
     PaymentVerificationKey,
@@ -8,18 +11,77 @@ from pycardano import (
     PlutusV2Script,
     plutus_script_hash,
     ChainContext,
+    ScriptHash,
 )
 
 from .keys import get_address
 from .network import network
 
 build_dir = Path(__file__).parent.parent.parent.joinpath("build")
+MANIFEST_NAME = "manifest.json"
 
 
+def manifest_entry(build_name: str, parameters: dict) -> dict:
+    """
+    Everything needed to use and verify the contract in the given build directory
+    """
+    with open(build_dir.joinpath(f"{build_name}/script.cbor")) as f:
+        contract_cbor_hex = f.read().strip()
+    contract_plutus_script = PlutusV2Script(bytes.fromhex(contract_cbor_hex))
+    contract_script_hash = plutus_script_hash(contract_plutus_script)
+    return {
+        "cbor": contract_cbor_hex,
+        "policy_id": contract_script_hash.payload.hex(),
+        "testnet_address": str(Address(contract_script_hash, network=Network.TESTNET)),
+        "mainnet_address": str(Address(contract_script_hash, network=Network.MAINNET)),
+        "size": len(contract_plutus_script),
+        "parameters": parameters,
+    }
+
+
+def write_manifest(parameters: Dict[str, dict]):
+    """
+    Write the manifest of all built contracts, in plain and compressed form
+    :param parameters: the build parameters of each contract, by name
+    """
+    manifest = {
+        build_name: manifest_entry(build_name, contract_parameters)
+        for name, contract_parameters in parameters.items()
+        for build_name in (name, f"{name}_compressed")
+    }
+    with open(build_dir.joinpath(MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    load_manifest.cache_clear()
+    get_contract.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def load_manifest() -> dict:
+    manifest_path = build_dir.joinpath(MANIFEST_NAME)
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
 def get_contract(name, compressed=False):
-    with open(
-        build_dir.joinpath(f"{name}{'_compressed' if compressed else ''}/script.cbor")
-    ) as f:
+    build_name = f"{name}{'_compressed' if compressed else ''}"
+    entry = load_manifest().get(build_name)
+    if entry is not None:
+        # the hashes and addresses were computed when building
+        return (
+            PlutusV2Script(bytes.fromhex(entry["cbor"])),
+            ScriptHash.from_primitive(entry["policy_id"]),
+            Address.from_primitive(
+                entry[
+                    "mainnet_address"
+                    if network == Network.MAINNET
+                    else "testnet_address"
+                ]
+            ),
+        )
+    with open(build_dir.joinpath(f"{build_name}/script.cbor")) as f:
         contract_cbor_hex = f.read().strip()
     contract_cbor = bytes.fromhex(contract_cbor_hex)
 
@@ -0,0 +1,294 @@
+"""
+In-process emulation of the ledger, to build, evaluate and submit transactions without a node.
+
+Submitted transactions are checked against the main phase-1 rules (inputs, balance, fee, size,
+validity interval, signatures, stake registrations). Phase 2 is checked by evaluating every
+script of the transaction locally, so contracts that fail their checks on chain fail here as well.
+The execution units come from the cost model of uada.utils.evaluate, which is not checked against the ledger,
+so a transaction within its budgets here may still exceed them on chain, or the other way round.
+"""
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, List, Union
+
+import pycardano
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+from .local_evaluation import evaluate_redeemers, redeemer_key
+
+# Babbage era mainnet parameters
+PROTOCOL_PARAMETERS = pycardano.ProtocolParameters(
+    min_fee_constant=155381,
+    min_fee_coefficient=44,
+    max_block_size=90112,
+    max_tx_size=16384,
+    max_block_header_size=1100,
+    key_deposit=2_000_000,
+    pool_deposit=500_000_000,
+    pool_influence=0.3,
+    monetary_expansion=0.003,
+    treasury_expansion=0.2,
+    decentralization_param=0,
+    extra_entropy="",
+    protocol_major_version=8,
+    protocol_minor_version=0,
+    min_utxo=1_000_000,
+    min_pool_cost=170_000_000,
+    price_mem=0.0577,
+    price_step=0.0000721,
+    max_tx_ex_mem=14_000_000,
+    max_tx_ex_steps=10_000_000_000,
+    max_block_ex_mem=62_000_000,
+    max_block_ex_steps=20_000_000_000,
+    max_val_size=5000,
+    collateral_percent=150,
+    max_collateral_inputs=3,
+    coins_per_utxo_word=34482,
+    coins_per_utxo_byte=4310,
+    # the builder falls back to the cost models shipped with pycardano
+    cost_models={},
+)
+
+GENESIS_PARAMETERS = pycardano.GenesisParameters(
+    active_slots_coefficient=0.05,
+    update_quorum=5,
+    max_lovelace_supply=45_000_000_000_000_000,
+    network_magic=1,
+    epoch_length=432_000,
+    system_start=1_654_041_600,
+    slots_per_kes_period=129_600,
+    slot_length=1,
+    max_kes_evolutions=62,
+    security_param=2160,
+)
+
+
+def flat_value(value: pycardano.Value) -> Counter:
+    """
+    The non-zero amounts of the value by (policy id, asset name), lovelace under ("", "")
+    """
+    res = Counter({("", ""): value.coin})
+    for policy_id, assets in value.multi_asset.items():
+        for name, amount in assets.items():
+            res[(policy_id.payload.hex(), name.payload.hex())] += amount
+    return Counter({k: v for k, v in res.items() if v != 0})
+
+
+def valid_signature(witness: pycardano.VerificationKeyWitness, message: bytes) -> bool:
+    try:
+        VerifyKey(witness.vkey.payload).verify(message, witness.signature)
+    except BadSignatureError:
+        return False
+    return True
+
+
+class EmulatorChainContext(pycardano.ChainContext):
+    """
+    Chain context that keeps the UTxO set and the registered stake credentials in memory
+    and applies submitted transactions to them immediately, each in a block of its own
+    """
+
+    def __init__(
+        self,
+        protocol_param: pycardano.ProtocolParameters = PROTOCOL_PARAMETERS,
+        genesis_param: pycardano.GenesisParameters = GENESIS_PARAMETERS,
+        network: pycardano.Network = pycardano.Network.TESTNET,
+    ):
+        self._protocol_param = protocol_param
+        self._genesis_param = genesis_param
+        self._network = network
+        self.ledger: Dict[pycardano.TransactionInput, pycardano.TransactionOutput] = {}
+        # reward balances of the registered stake credentials, by credential hash
+        self.rewards: Dict[bytes, int] = {}
+        self.slot = 0
+        self.transactions: List[pycardano.Transaction] = []
+        self._genesis_index = 0
+        self._lock = threading.RLock()
+
+    @property
+    def protocol_param(self) -> pycardano.ProtocolParameters:
+        return self._protocol_param
+
+    @property
+    def genesis_param(self) -> pycardano.GenesisParameters:
+        return self._genesis_param
+
+    @property
+    def network(self) -> pycardano.Network:
+        return self._network
+
+    @property
+    def epoch(self) -> int:
+        return self.slot // self.genesis_param.epoch_length
+
+    @property
+    def last_block_slot(self) -> int:
+        return self.slot
+
+    def wait(self, slots: int = 1):
+        self.slot += slots
+
+    def add_utxo(self, output: pycardano.TransactionOutput) -> pycardano.UTxO:
+        """
+        Create a UTxO out of thin air, i.e. to fund a wallet or to place the fee parameters
+        """
+        with self._lock:
+            tx_id = pycardano.TransactionId(
+                hashlib.sha256(f"genesis{self._genesis_index}".encode()).digest()
+            )
+            self._genesis_index += 1
+            utxo = pycardano.UTxO(pycardano.TransactionInput(tx_id, 0), output)
+            self.ledger[utxo.input] = output
+            return utxo
+
+    def register_stake(
+        self, credential: Union[pycardano.VerificationKeyHash, pycardano.ScriptHash]
+    ):
+        self.rewards.setdefault(credential.payload, 0)
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        with self._lock:
+            return [
+                pycardano.UTxO(i, o)
+                for i, o in self.ledger.items()
+                if str(o.address) == str(address)
+            ]
+
+    def resolve(
+        self, inputs: List[pycardano.TransactionInput]
+    ) -> List[pycardano.TransactionOutput]:
+        missing = [i for i in inputs if i not in self.ledger]
+        if missing:
+            raise pycardano.TransactionFailedException(
+                f"Unknown or spent inputs: {[str(i) for i in missing]}"
+            )
+        return [self.ledger[i] for i in inputs]
+
+    def evaluate_tx(
+        self, tx: pycardano.Transaction
+    ) -> Dict[str, pycardano.ExecutionUnits]:
+        """
+        Evaluate all scripts of the transaction on the current UTxO set
+        """
+        with self._lock:
+            return evaluate_redeemers(tx, self.resolve)
+
+    def evaluate_tx_cbor(
+        self, cbor: Union[bytes, str]
+    ) -> Dict[str, pycardano.ExecutionUnits]:
+        return self.evaluate_tx(pycardano.Transaction.from_cbor(cbor))
+
+    def _check_phase_1(
+        self,
+        tx: pycardano.Transaction,
+        resolved_inputs: List[pycardano.TransactionOutput],
+    ):
+        tx_body = tx.transaction_body
+        witnesses = tx.transaction_witness_set
+        protocol_param = self.protocol_param
+
+        def fail(msg: str):
+            raise pycardano.TransactionFailedException(msg)
+
+        if len(tx.to_cbor()) > protocol_param.max_tx_size:
+            fail("Maximum transaction size exceeded")
+        if tx_body.validity_start is not None and self.slot < tx_body.validity_start:
+            fail(f"Transaction is valid from slot {tx_body.validity_start} on")
+        if tx_body.ttl is not None and self.slot >= tx_body.ttl:
+            fail(f"Transaction expired at slot {tx_body.ttl}")
+
+        # balance
+        deposits = 0
+        for c in tx_body.certificates or []:
+            if isinstance(c, pycardano.StakeRegistration):
+                deposits += protocol_param.key_deposit
+            elif isinstance(c, pycardano.StakeDeregistration):
+                deposits -= protocol_param.key_deposit
+        withdrawn = 0
+        for reward_address, amount in (tx_body.withdraws or {}).items():
+            credential = pycardano.Address.from_primitive(reward_address).staking_part
+            if self.rewards.get(credential.payload) != amount:
+                fail(
+                    f"Withdrawal of {amount} does not match the rewards of {credential}"
+                )
+            withdrawn += amount
+        consumed = sum(
+            (o.amount for o in resolved_inputs), pycardano.Value(withdrawn)
+        ) + pycardano.Value(0, tx_body.mint or pycardano.MultiAsset())
+        produced = sum(
+            (o.amount for o in tx_body.outputs), pycardano.Value(tx_body.fee + deposits)
+        )
+        if flat_value(consumed) != flat_value(produced):
+            fail(f"Value not preserved: consumed {consumed}, produced {produced}")
+
+        # fee
+        redeemers = witnesses.redeemer or []
+        steps = sum(r.ex_units.steps for r in redeemers)
+        mem = sum(r.ex_units.mem for r in redeemers)
+        if steps > protocol_param.max_tx_ex_steps or mem > protocol_param.max_tx_ex_mem:
+            fail("Maximum execution units of a transaction exceeded")
+        min_fee = pycardano.fee(self, len(tx.to_cbor()), steps, mem)
+        if tx_body.fee < min_fee:
+            fail(f"Fee {tx_body.fee} below the minimum fee {min_fee}")
+        if redeemers:
+            collateral = sum(
+                o.amount.coin for o in self.resolve(tx_body.collateral or [])
+            )
+            if collateral * 100 < tx_body.fee * protocol_param.collateral_percent:
+                fail("Insufficient collateral")
+
+        # signatures
+        signers = set()
+        for w in witnesses.vkey_witnesses or []:
+            if not valid_signature(w, tx_body.hash()):
+                fail(f"Invalid signature of {w.vkey.hash()}")
+            signers.add(w.vkey.hash())
+        required = set(tx_body.required_signers or [])
+        for o in resolved_inputs:
+            if isinstance(o.address.payment_part, pycardano.VerificationKeyHash):
+                required.add(o.address.payment_part)
+        if not required <= signers:
+            fail(f"Missing signatures of {[str(s) for s in required - signers]}")
+
+    def submit_tx(self, tx: Union[pycardano.Transaction, bytes, str]):
+        """
+        Validate the transaction and apply it to the UTxO set
+        """
+        if not isinstance(tx, pycardano.Transaction):
+            tx = pycardano.Transaction.from_cbor(tx)
+        with self._lock:
+            tx_body = tx.transaction_body
+            resolved_inputs = self.resolve(tx_body.inputs)
+            self.resolve(tx_body.reference_inputs or [])
+            self._check_phase_1(tx, resolved_inputs)
+            # phase 2, every script must succeed within the budget of its redeemer, as far as the local costs tell
+            ex_units = self.evaluate_tx(tx)
+            for r in tx.transaction_witness_set.redeemer or []:
+                used = ex_units[redeemer_key(r)]
+                if used.mem > r.ex_units.mem or used.steps > r.ex_units.steps:
+                    raise pycardano.TransactionFailedException(
+                        f"Redeemer {redeemer_key(r)} exceeds its budget: {used} > {r.ex_units}"
+                    )
+
+            for i in tx_body.inputs:
+                del self.ledger[i]
+            for index, output in enumerate(tx_body.outputs):
+                self.ledger[pycardano.TransactionInput(tx.id, index)] = output
+            for c in tx_body.certificates or []:
+                if isinstance(c, pycardano.StakeRegistration):
+                    self.register_stake(c.stake_credential.credential)
+                elif isinstance(c, pycardano.StakeDeregistration):
+                    self.rewards.pop(c.stake_credential.credential.payload, None)
+            for reward_address in tx_body.withdraws or {}:
+                credential = pycardano.Address.from_primitive(
+                    reward_address
+                ).staking_part
+                self.rewards[credential.payload] = 0
+            self.transactions.append(tx)
+            self.slot += 1
+            return tx.id
+
+    def submit_tx_cbor(self, cbor: Union[bytes, str]):
+        return self.submit_tx(cbor)
@@ -0,0 +1,327 @@
+"""
+Local evaluation of compiled contracts with execution unit accounting.
+
+The uplc machine shipped with our toolchain only counts steps, so the costs
+charged by the ledger are recomputed here from the Plutus V2 mainnet cost model.
+"""
+import functools
+import sys
+from typing import Any, Callable, Dict, Tuple
+
+import frozendict
+import pycardano
+from uplc.ast import (
+    AST,
+    BuiltInFun,
+    BuiltInFunEvalMap,
+    BuiltInFunForceMap,
+    BuiltinBool,
+    BuiltinByteString,
+    BuiltinInteger,
+    BuiltinList,
+    BuiltinPair,
+    BuiltinString,
+    BuiltinUnit,
+    Apply,
+    Compute,
+    Done,
+    ForcedBuiltIn,
+    NoFrame,
+    PlutusByteString,
+    PlutusConstr,
+    PlutusData,
+    PlutusInteger,
+    PlutusList,
+    PlutusMap,
+    Return,
+    data_from_cbor,
+)
+from uplc.machine import Machine
+from uplc.tools import unflatten
+
+# cost of starting the machine and of every single machine step, as (cpu, mem)
+STARTUP_COST = (100, 100)
+STEP_COST = (23000, 100)
+
+
+def integer_size(i: int) -> int:
+    if i == 0:
+        return 1
+    return (abs(i).bit_length() - 1) // 64 + 1
+
+
+def bytes_size(b: bytes) -> int:
+    if not b:
+        return 1
+    return (len(b) - 1) // 8 + 1
+
+
+def data_size(d: PlutusData) -> int:
+    if isinstance(d, PlutusConstr):
+        return 4 + sum(data_size(f) for f in d.fields)
+    if isinstance(d, PlutusMap):
+        return 4 + sum(data_size(k) + data_size(v) for k, v in d.value.items())
+    if isinstance(d, PlutusList):
+        return 4 + sum(data_size(f) for f in d.value)
+    if isinstance(d, PlutusInteger):
+        return 4 + integer_size(d.value)
+    if isinstance(d, PlutusByteString):
+        return 4 + bytes_size(d.value)
+    raise NotImplementedError(f"Unknown data type {type(d)}")
+
+
+def memory_size(x: AST) -> int:
+    """
+    Size of a builtin argument as measured by the ledger cost model
+    """
+    if isinstance(x, BuiltinInteger):
+        return integer_size(x.value)
+    if isinstance(x, BuiltinByteString):
+        return bytes_size(x.value)
+    if isinstance(x, BuiltinString):
+        return len(x.value)
+    if isinstance(x, (BuiltinBool, BuiltinUnit)):
+        return 1
+    if isinstance(x, PlutusData):
+        return data_size(x)
+    if isinstance(x, BuiltinPair):
+        return 1 + memory_size(x.l_value) + memory_size(x.r_value)
+    if isinstance(x, BuiltinList):
+        return sum(memory_size(v) for v in x.values)
+    return 1
+
+
+CostFunction = Callable[..., int]
+
+
+def constant(c: int) -> CostFunction:
+    return lambda *sizes: c
+
+
+def linear_in(arg: int, intercept: int, slope: int) -> CostFunction:
+    return lambda *sizes: intercept + slope * sizes[arg]
+
+
+def added_sizes(intercept: int, slope: int) -> CostFunction:
+    return lambda x, y, *_: intercept + slope * (x + y)
+
+
+def multiplied_sizes(intercept: int, slope: int) -> CostFunction:
+    return lambda x, y, *_: intercept + slope * x * y
+
+
+def subtracted_sizes(intercept: int, slope: int, minimum: int) -> CostFunction:
+    return lambda x, y, *_: max(minimum, intercept + slope * (x - y))
+
+
+def min_size(intercept: int, slope: int) -> CostFunction:
+    return lambda x, y, *_: intercept + slope * min(x, y)
+
+
+def max_size(intercept: int, slope: int) -> CostFunction:
+    return lambda x, y, *_: intercept + slope * max(x, y)
+
+
+def linear_on_diagonal(c: int, intercept: int, slope: int) -> CostFunction:
+    return lambda x, y, *_: intercept + slope * x if x == y else c
+
+
+def const_above_diagonal(c: int, model: CostFunction) -> CostFunction:
+    return lambda x, y, *_: c if x < y else model(x, y)
+
+
+_DIVISION_CPU = const_above_diagonal(196500, multiplied_sizes(453240, 220))
+
+# (cpu, mem) cost functions of the builtins, taking the sizes of all arguments
+BUILTIN_COSTS: Dict[BuiltInFun, Tuple[CostFunction, CostFunction]] = {
+    BuiltInFun.AddInteger: (max_size(205665, 812), max_size(1, 1)),
+    BuiltInFun.SubtractInteger: (max_size(205665, 812), max_size(1, 1)),
+    BuiltInFun.MultiplyInteger: (added_sizes(69522, 11687), added_sizes(0, 1)),
+    BuiltInFun.DivideInteger: (_DIVISION_CPU, subtracted_sizes(0, 1, 1)),
+    BuiltInFun.QuotientInteger: (_DIVISION_CPU, subtracted_sizes(0, 1, 1)),
+    BuiltInFun.RemainderInteger: (_DIVISION_CPU, linear_in(1, 0, 1)),
+    BuiltInFun.ModInteger: (_DIVISION_CPU, linear_in(1, 0, 1)),
+    BuiltInFun.EqualsInteger: (min_size(208512, 421), constant(1)),
+    BuiltInFun.LessThanInteger: (min_size(208896, 511), constant(1)),
+    BuiltInFun.LessThanEqualsInteger: (min_size(204924, 473), constant(1)),
+    BuiltInFun.AppendByteString: (added_sizes(1000, 571), added_sizes(0, 1)),
+    BuiltInFun.ConsByteString: (linear_in(1, 221973, 511), added_sizes(0, 1)),
+    BuiltInFun.SliceByteString: (linear_in(2, 265318, 0), linear_in(2, 4, 0)),
+    BuiltInFun.LengthOfByteString: (constant(1000), constant(10)),
+    BuiltInFun.IndexByteString: (constant(57667), constant(4)),
+    BuiltInFun.EqualsByteString: (
+        linear_on_diagonal(245000, 216773, 62),
+        constant(1),
+    ),
+    BuiltInFun.LessThanByteString: (min_size(197145, 156), constant(1)),
+    BuiltInFun.LessThanEqualsByteString: (min_size(197145, 156), constant(1)),
+    BuiltInFun.Sha2_256: (linear_in(0, 806990, 30482), constant(4)),
+    BuiltInFun.Sha3_256: (linear_in(0, 1927926, 82523), constant(4)),
+    BuiltInFun.Blake2b_256: (linear_in(0, 117366, 10475), constant(4)),
+    BuiltInFun.VerifyEd25519Signature: (
+        linear_in(1, 57996947, 18975),
+        constant(10),
+    ),
+    BuiltInFun.VerifyEcdsaSecp256k1Signature: (constant(35190005), constant(10)),
+    BuiltInFun.VerifySchnorrSecp256k1Signature: (
+        linear_in(1, 39121781, 32260),
+        constant(10),
+    ),
+    BuiltInFun.AppendString: (added_sizes(1000, 24177), added_sizes(4, 1)),
+    BuiltInFun.EqualsString: (linear_on_diagonal(187000, 1000, 52998), constant(1)),
+    BuiltInFun.EncodeUtf8: (linear_in(0, 1000, 28662), linear_in(0, 4, 2)),
+    BuiltInFun.DecodeUtf8: (linear_in(0, 497525, 14068), linear_in(0, 4, 2)),
+    BuiltInFun.IfThenElse: (constant(80556), constant(1)),
+    BuiltInFun.ChooseUnit: (constant(46417), constant(4)),
+    BuiltInFun.Trace: (constant(212342), constant(32)),
+    BuiltInFun.FstPair: (constant(80436), constant(32)),
+    BuiltInFun.SndPair: (constant(85931), constant(32)),
+    BuiltInFun.ChooseList: (constant(175354), constant(32)),
+    BuiltInFun.MkCons: (constant(65493), constant(32)),
+    BuiltInFun.HeadList: (constant(43249), constant(32)),
+    BuiltInFun.TailList: (constant(41182), constant(32)),
+    BuiltInFun.NullList: (constant(60091), constant(32)),
+    BuiltInFun.ChooseData: (constant(19537), constant(32)),
+    BuiltInFun.ConstrData: (constant(89141), constant(32)),
+    BuiltInFun.MapData: (constant(64832), constant(32)),
+    BuiltInFun.ListData: (constant(52467), constant(32)),
+    BuiltInFun.IData: (constant(1000), constant(32)),
+    BuiltInFun.BData: (constant(1000), constant(32)),
+    BuiltInFun.UnConstrData: (constant(32696), constant(32)),
+    BuiltInFun.UnMapData: (constant(38314), constant(32)),
+    BuiltInFun.UnListData: (constant(32247), constant(32)),
+    BuiltInFun.UnIData: (constant(43357), constant(32)),
+    BuiltInFun.UnBData: (constant(31220), constant(32)),
+    BuiltInFun.EqualsData: (min_size(1060367, 12586), constant(1)),
+    BuiltInFun.MkPairData: (constant(76511), constant(32)),
+    BuiltInFun.MkNilData: (constant(22558), constant(32)),
+    BuiltInFun.MkNilPairData: (constant(16563), constant(32)),
+    BuiltInFun.SerialiseData: (linear_in(0, 1159724, 392670), linear_in(0, 0, 2)),
+}
+
+
+class CostingMachine(Machine):
+    """
+    CEK machine that charges every step and builtin call like the ledger does
+    """
+
+    def __init__(self, program: AST, max_steps=10_000_000):
+        super().__init__(program, max_steps=max_steps)
+        self.cpu, self.mem = STARTUP_COST
+        # the same data, i.e. the script context and the lists taken from it, is passed
+        # to many builtin calls, so the size of every data is computed once.
+        # The entries keep the data alive, so ids are not reused
+        self.data_sizes: Dict[int, Tuple[PlutusData, int]] = {}
+
+    def memory_size(self, x: AST) -> int:
+        """
+        Like memory_size, but remembering the size of data
+        """
+        if isinstance(x, PlutusData):
+            entry = self.data_sizes.get(id(x))
+            if entry is None:
+                entry = self.data_sizes[id(x)] = (x, data_size(x))
+            return entry[1]
+        if isinstance(x, BuiltinPair):
+            return 1 + self.memory_size(x.l_value) + self.memory_size(x.r_value)
+        if isinstance(x, BuiltinList):
+            return sum(self.memory_size(v) for v in x.values)
+        return memory_size(x)
+
+    def charge(self, cpu: int, mem: int):
+        self.cpu += cpu
+        self.mem += mem
+
+    def enter(self, term: AST):
+        """
+        Called before each term is computed, see uada.utils.profile
+        """
+
+    def eval(self):
+        stack = [
+            Compute(
+                NoFrame(),
+                frozendict.frozendict(),
+                self.program,
+            )
+        ]
+
+        while stack:
+            self.rem_steps -= 1
+            if self.rem_steps < 0:
+                raise RuntimeError("Maximum steps exceeded")
+            step = stack.pop()
+            if isinstance(step, Compute):
+                self.enter(step.term)
+                self.charge(*STEP_COST)
+                stack.append(step.term.eval(step.ctx, step.env))
+            elif isinstance(step, Return):
+                stack.append(self.return_compute(step.context, step.value))
+            elif isinstance(step, Done):
+                stack.append(step.term)
+                break
+
+        return stack.pop()
+
+    def apply_evaluate(self, context, function, argument):
+        if (
+            isinstance(function, ForcedBuiltIn)
+            and function.applied_forces == BuiltInFunForceMap[function.builtin]
+            and BuiltInFunEvalMap[function.builtin].__code__.co_argcount
+            == len(function.bound_arguments) + 1
+        ):
+            cpu, mem = BUILTIN_COSTS[function.builtin]
+            sizes = [self.memory_size(a) for a in function.bound_arguments + [argument]]
+            self.charge(cpu(*sizes), mem(*sizes))
+        return super().apply_evaluate(context, function, argument)
+
+
+@functools.lru_cache(maxsize=32)
+def load_program(script: bytes) -> AST:
+    """
+    Decode the (singly CBOR wrapped) flat encoding of a compiled contract
+    """
+    # same as the --recursion-limit passed to opshin and uplc in uada.build
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 2000))
+    return unflatten(bytes(script)).term
+
+
+def to_uplc_data(d: Any) -> PlutusData:
+    if isinstance(d, PlutusData):
+        return d
+    if isinstance(d, int):
+        return PlutusInteger(d)
+    if isinstance(d, bytes):
+        return PlutusByteString(d)
+    if isinstance(d, dict):
+        return PlutusMap(
+            frozendict.frozendict(
+                {to_uplc_data(k): to_uplc_data(v) for k, v in d.items()}
+            )
+        )
+    if isinstance(d, list):
+        return PlutusList([to_uplc_data(x) for x in d])
+    return data_from_cbor(d.to_cbor())
+
+
+def run_script(script: bytes, *args: Any) -> Tuple[AST, pycardano.ExecutionUnits]:
+    """
+    Apply the arguments to the compiled contract and return the resulting term
+    together with the execution units consumed.
+    Raises a RuntimeError if the contract fails.
+    """
+    term = load_program(bytes(script))
+    for arg in args:
+        term = Apply(term, to_uplc_data(arg))
+    machine = CostingMachine(term)
+    result = machine.eval()
+    return result, pycardano.ExecutionUnits(mem=machine.mem, steps=machine.cpu)
+
+
+def evaluate_script(script: bytes, *args: Any) -> pycardano.ExecutionUnits:
+    """
+    Apply the arguments (datum, redeemer, script context) to the compiled contract
+    and return the execution units consumed.
+    Raises a RuntimeError if the contract fails.
+    """
+    return run_script(script, *args)[1]
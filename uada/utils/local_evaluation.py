@@ -0,0 +1,311 @@
+"""
+Local evaluation of the execution units of transactions.
+
+The scripts of a transaction are run as the ledger runs them, with the costs of uada.utils.evaluate,
+so the transaction builder does not need to ask the chain backend to evaluate every transaction.
+The script context is converted to data once per transaction and shared by all of its redeemers.
+
+The execution units mostly depend on the shape of a transaction: its redeemers, its inputs, outputs and reference inputs,
+which of the inputs are spent from scripts, and the number of policies and assets and the datum size of every
+spent, referenced and created output. They are cached by that shape, so transactions of a known shape are not evaluated
+at all. The execution units are raised by a safety margin to cover what differs between transactions of the same shape,
+e.g. the lengths of amounts and names, whether they were cached or just evaluated.
+The costs of uada.utils.evaluate are not checked against the ledger yet, so local evaluation is opt-in.
+"""
+import dataclasses
+import math
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Union
+
+import cbor2
+import pycardano
+from pycardano.serialization import default_encoder
+from uplc.ast import PlutusConstr, PlutusData, data_from_cbor
+
+from .evaluate import evaluate_script, to_uplc_data
+from .to_script_context import RedeemerTargets, to_tx_info
+from opshin.prelude import ScriptContext
+
+# share of the cached execution units added on top, pycardano adds its own buffer to the result
+MARGIN = 0.1
+# number of transaction shapes whose execution units are kept
+CACHE_SIZE = 1024
+
+Resolver = Callable[
+    [List[pycardano.TransactionInput]], List[pycardano.TransactionOutput]
+]
+
+
+def redeemer_key(redeemer: pycardano.Redeemer) -> str:
+    """
+    The key of the execution units of the redeemer, as returned by evaluate_tx
+    """
+    return f"{redeemer.tag.name.lower()}:{redeemer.index}"
+
+
+def datum_data(datum: pycardano.Datum):
+    if isinstance(datum, pycardano.RawCBOR):
+        return data_from_cbor(datum.cbor)
+    return datum
+
+
+def sorted_inputs(
+    inputs: Sequence[pycardano.TransactionInput],
+) -> List[pycardano.TransactionInput]:
+    """
+    The inputs in the order of the ledger
+    """
+    return sorted(inputs, key=lambda i: (i.transaction_id.payload, i.index))
+
+
+def script_context_data(tx_info: PlutusData, purpose) -> PlutusData:
+    """
+    The script context of the purpose as data, built on the tx info that was already converted
+    """
+    return PlutusConstr(ScriptContext.CONSTR_ID, [tx_info, to_uplc_data(purpose)])
+
+
+def scripts_of(
+    tx: pycardano.Transaction, resolved: List[pycardano.TransactionOutput]
+) -> Dict[pycardano.ScriptHash, bytes]:
+    """
+    The scripts attached to the transaction or to the outputs it spends or references, by hash
+    """
+    witnesses = tx.transaction_witness_set
+    scripts = (
+        list(witnesses.plutus_v1_script or [])
+        + list(witnesses.plutus_v2_script or [])
+        + [o.script for o in resolved if o.script is not None]
+    )
+    return {pycardano.plutus_script_hash(s): s for s in scripts}
+
+
+def script_hash_of(
+    redeemer: pycardano.Redeemer,
+    targets: RedeemerTargets,
+    resolved_inputs: List[pycardano.TransactionOutput],
+) -> pycardano.ScriptHash:
+    """
+    The hash of the script that the redeemer is passed to
+    """
+    if redeemer.tag == pycardano.RedeemerTag.SPEND:
+        return resolved_inputs[redeemer.index].address.payment_part
+    if redeemer.tag == pycardano.RedeemerTag.MINT:
+        return targets.policy_ids[redeemer.index]
+    if redeemer.tag == pycardano.RedeemerTag.REWARD:
+        return pycardano.Address.from_primitive(
+            targets.reward_addresses[redeemer.index]
+        ).staking_part
+    raise NotImplementedError(f"Can not evaluate redeemer tag {redeemer.tag} yet")
+
+
+def evaluate_redeemers(
+    tx: pycardano.Transaction, resolve: Resolver
+) -> Dict[str, pycardano.ExecutionUnits]:
+    """
+    Evaluate all scripts of the transaction on the outputs that resolve returns for its inputs.
+    Raises a TransactionFailedException if a script fails or can not be run.
+    """
+    tx_body = tx.transaction_body
+    targets = RedeemerTargets(tx_body)
+    # the script context lists the inputs ordered like the ledger does
+    reference_inputs = sorted_inputs(tx_body.reference_inputs or [])
+    resolved_inputs = resolve(targets.inputs)
+    resolved_reference_inputs = resolve(reference_inputs)
+    sorted_body = dataclasses.replace(
+        tx_body, inputs=targets.inputs, reference_inputs=reference_inputs
+    )
+    tx_info = to_uplc_data(
+        to_tx_info(
+            pycardano.Transaction(sorted_body, tx.transaction_witness_set),
+            resolved_inputs,
+            resolved_reference_inputs,
+            # the id of the transaction as it was serialized
+            tx_id=tx.id,
+        )
+    )
+    scripts = scripts_of(tx, resolved_inputs + resolved_reference_inputs)
+    datums = {
+        pycardano.datum_hash(d): d for d in tx.transaction_witness_set.plutus_data or []
+    }
+
+    res = {}
+    for redeemer in tx.transaction_witness_set.redeemer or []:
+        script_hash = script_hash_of(redeemer, targets, resolved_inputs)
+        if script_hash not in scripts:
+            raise pycardano.TransactionFailedException(
+                f"Missing script {script_hash} for redeemer {redeemer_key(redeemer)}"
+            )
+        args = [redeemer.data, script_context_data(tx_info, targets.purpose(redeemer))]
+        if redeemer.tag == pycardano.RedeemerTag.SPEND:
+            output = resolved_inputs[redeemer.index]
+            datum = (
+                output.datum
+                if output.datum is not None
+                else datums.get(output.datum_hash)
+            )
+            if datum is None:
+                raise pycardano.TransactionFailedException(
+                    f"Missing datum for spent input {targets.inputs[redeemer.index]}"
+                )
+            args.insert(0, datum_data(datum))
+        try:
+            res[redeemer_key(redeemer)] = evaluate_script(scripts[script_hash], *args)
+        except Exception as e:
+            raise pycardano.TransactionFailedException(
+                f"Script {script_hash} failed for redeemer {redeemer_key(redeemer)}: {e}"
+            ) from e
+    return res
+
+
+def output_shape(output: Optional[pycardano.TransactionOutput]) -> Hashable:
+    """
+    The number of policies and assets in the value of the output and the size of its datum,
+    which the scripts traverse when they inspect the output. None if the output is not known.
+    """
+    if output is None:
+        return None
+    multi_asset = (
+        output.amount.multi_asset if isinstance(output.amount, pycardano.Value) else {}
+    )
+    datum = output.datum
+    if datum is None:
+        datum_size = 0
+    elif isinstance(datum, pycardano.RawCBOR):
+        datum_size = len(datum.cbor)
+    else:
+        datum_size = len(cbor2.dumps(datum, default=default_encoder))
+    return (
+        len(multi_asset),
+        sum(len(assets) for assets in multi_asset.values()),
+        datum_size,
+    )
+
+
+def shape_key(
+    tx: pycardano.Transaction,
+    resolved: Sequence[Optional[pycardano.TransactionOutput]] = (),
+) -> Hashable:
+    """
+    The shape of the transaction that determines its execution units, up to the exact contents of its values and datums.
+    The inputs spent from scripts are the indices of the spend redeemers.
+    :param resolved: the outputs spent or referenced by the transaction, in the order of the ledger
+        (inputs, then reference inputs), None where not known
+    """
+    tx_body = tx.transaction_body
+    witnesses = tx.transaction_witness_set
+    redeemers = sorted(witnesses.redeemer or [], key=redeemer_key)
+    return (
+        len(tx_body.inputs),
+        len(tx_body.reference_inputs or []),
+        tuple(output_shape(o) for o in resolved),
+        tuple(output_shape(o) for o in tx_body.outputs),
+        tuple(sorted(p.payload for p in (tx_body.mint or {}).keys())),
+        tuple(sorted(tx_body.withdraws or {})),
+        len(tx_body.required_signers or []),
+        len(witnesses.plutus_data or []),
+        tuple(
+            (redeemer_key(r), cbor2.dumps(r.data, default=default_encoder))
+            for r in redeemers
+        ),
+    )
+
+
+def with_margin(
+    ex_units: Dict[str, pycardano.ExecutionUnits], margin: float
+) -> Dict[str, pycardano.ExecutionUnits]:
+    return {
+        key: pycardano.ExecutionUnits(
+            math.ceil(e.mem * (1 + margin)), math.ceil(e.steps * (1 + margin))
+        )
+        for key, e in ex_units.items()
+    }
+
+
+class LocalEvaluationContext:
+    """
+    Stands in for a chain context and evaluates transactions locally on the UTxOs it handed out,
+    caching the execution units by the shape of the transaction.
+    Transactions that spend or reference other UTxOs are evaluated by the wrapped context.
+    """
+
+    def __init__(
+        self,
+        context: pycardano.ChainContext,
+        margin: float = MARGIN,
+        cache_size: int = CACHE_SIZE,
+    ):
+        self.context = context
+        self.margin = margin
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[Hashable, Dict[str, pycardano.ExecutionUnits]]" = (
+            OrderedDict()
+        )
+        # the UTxOs last handed out for every address
+        self.known: Dict[str, List[pycardano.UTxO]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        utxos = self.context.utxos(address)
+        with self._lock:
+            self.known[str(address)] = utxos
+        return utxos
+
+    def known_outputs(
+        self,
+    ) -> Dict[pycardano.TransactionInput, pycardano.TransactionOutput]:
+        with self._lock:
+            return {u.input: u.output for us in self.known.values() for u in us}
+
+    def _evaluate(
+        self,
+        tx: pycardano.Transaction,
+        known: Dict[pycardano.TransactionInput, pycardano.TransactionOutput],
+    ) -> Dict[str, pycardano.ExecutionUnits]:
+        tx_body = tx.transaction_body
+        if all(
+            i in known for i in [*tx_body.inputs, *(tx_body.reference_inputs or [])]
+        ):
+            return evaluate_redeemers(tx, lambda inputs: [known[i] for i in inputs])
+        return self.context.evaluate_tx(tx)
+
+    def evaluate_tx(
+        self, tx: pycardano.Transaction
+    ) -> Dict[str, pycardano.ExecutionUnits]:
+        tx_body = tx.transaction_body
+        known = self.known_outputs()
+        key = shape_key(
+            tx,
+            [
+                known.get(i)
+                for i in sorted_inputs(tx_body.inputs)
+                + sorted_inputs(tx_body.reference_inputs or [])
+            ],
+        )
+        with self._lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return with_margin(cached, self.margin)
+            self.misses += 1
+        ex_units = self._evaluate(tx, known)
+        with self._lock:
+            self.cache[key] = ex_units
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        # the same margin as for cached execution units, the builder adjusts the returned ones in place
+        return with_margin(ex_units, self.margin)
+
+    def evaluate_tx_cbor(
+        self, cbor: Union[bytes, str]
+    ) -> Dict[str, pycardano.ExecutionUnits]:
+        return self.evaluate_tx(pycardano.Transaction.from_cbor(cbor))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.context, name)
@@ -1,10 +1,12 @@
+import asyncio
+import functools
 import os
-
-import blockfrost
-import ogmios
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, TypeVar, Union
 
 import pycardano
-from pycardano import Network, OgmiosChainContext
+from pycardano import Network
 
 ogmios_host = os.getenv("OGMIOS_API_HOST", "localhost")
 ogmios_port = os.getenv("OGMIOS_API_PORT", "1337")
@@ -20,28 +22,125 @@ kupo_url = (
 
 network = Network.TESTNET
 
+# number of chain queries that are run at the same time by the AsyncChainContext
+query_concurrency = int(os.getenv("UADA_QUERY_CONCURRENCY", "8"))
+
 blockfrost_project_id = os.getenv("BLOCKFROST_PROJECT_ID", None)
-blockfrost_client = blockfrost.BlockFrostApi(
-    blockfrost_project_id,
-    base_url=blockfrost.ApiUrls.mainnet.value
-    if network == Network.MAINNET
-    else blockfrost.ApiUrls.preprod.value,
-)
 
 
-# Load chain context
-try:
-    context = OgmiosChainContext(ogmios_url, network=network, kupo_url=kupo_url)
-except Exception as e:
+@functools.lru_cache(maxsize=None)
+def get_blockfrost_client():
+    import blockfrost
+
+    return blockfrost.BlockFrostApi(
+        blockfrost_project_id,
+        base_url=blockfrost.ApiUrls.mainnet.value
+        if network == Network.MAINNET
+        else blockfrost.ApiUrls.preprod.value,
+    )
+
+
+def connect_context() -> Optional[pycardano.ChainContext]:
+    """
+    Connect to Ogmios (and Kupo if configured), None if no ogmios is available
+    """
     try:
-        context = ogmios.OgmiosChainContext(
-            host=ogmios_host,
-            port=int(ogmios_port),
-            secure=ogmios_protocol == "wss",
+        return pycardano.OgmiosChainContext(
+            ogmios_url, network=network, kupo_url=kupo_url
         )
     except Exception as e:
-        print("No ogmios available")
-        context = None
+        try:
+            import ogmios
+
+            return ogmios.OgmiosChainContext(
+                host=ogmios_host,
+                port=int(ogmios_port),
+                secure=ogmios_protocol == "wss",
+            )
+        except Exception as e:
+            print("No ogmios available")
+            return None
+
+
+class ChainContextProvider:
+    """
+    Stands in for the chain context: connects on first use and keeps the connection
+    for the rest of the process. A local context, e.g. for tests, can be installed with set.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Optional[pycardano.ChainContext]] = connect_context,
+    ):
+        self._connect = connect
+        self._context: Optional[pycardano.ChainContext] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> pycardano.ChainContext:
+        if self._context is None:
+            with self._lock:
+                if self._context is None:
+                    self._context = self._connect()
+        if self._context is None:
+            # connecting is attempted again on the next use
+            raise ConnectionError(f"No ogmios available at {ogmios_url}")
+        return self._context
+
+    def set(self, context: Optional[pycardano.ChainContext]):
+        self._context = context
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+# Load chain context on first use
+context = ChainContextProvider()
+
+T = TypeVar("T")
+
+
+class AsyncChainContext:
+    """
+    Runs the blocking queries of a chain context in a pool of worker threads,
+    so that independent queries can be awaited concurrently
+    """
+
+    def __init__(
+        self,
+        context: Union[pycardano.ChainContext, ChainContextProvider] = context,
+        max_workers: int = query_concurrency,
+    ):
+        self.context = context
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="chain-query"
+        )
+
+    async def run(self, function: Callable[..., T], *args, **kwargs) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def utxos(
+        self, address: Union[str, pycardano.Address]
+    ) -> List[pycardano.UTxO]:
+        return await self.run(self.context.utxos, address)
+
+    async def protocol_param(self) -> pycardano.ProtocolParameters:
+        return await self.run(lambda: self.context.protocol_param)
+
+    async def submit_tx(self, tx: pycardano.Transaction):
+        return await self.run(self.context.submit_tx, tx)
+
+
+async_context = AsyncChainContext()
+
+
+def __getattr__(name):
+    if name == "blockfrost_client":
+        return get_blockfrost_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def show_tx(signed_tx: pycardano.Transaction):
@@ -0,0 +1,169 @@
+"""
+Reservation of wallet UTxOs, so that transactions built concurrently from one wallet do not spend the same UTxOs.
+
+UTxOs are reserved when they are selected as inputs of a transaction and stay reserved
+until the transaction is confirmed, its reservation expires or the chain is rolled back.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+import pycardano
+
+# seconds after which UTxOs reserved for a transaction that was never submitted are handed out again
+BUILD_TIMEOUT = 300
+# seconds after which UTxOs spent by a submitted but unconfirmed transaction are handed out again,
+# the validity interval set by pycardano defaults to 10_000 slots of one second
+PENDING_TIMEOUT = 10_000
+
+
+def spent_inputs(transactions: List[dict]) -> List[pycardano.TransactionInput]:
+    """
+    The inputs spent by the transactions of a block, as reported by Ogmios chain-sync
+    """
+    return [
+        pycardano.TransactionInput.from_primitive([i["transaction"]["id"], i["index"]])
+        for tx in transactions
+        # failed transactions only spend their collateral
+        for i in tx.get(
+            "collaterals" if tx.get("spends") == "collaterals" else "inputs", []
+        )
+    ]
+
+
+@dataclass
+class Reservation:
+    address: str
+    expires: float
+    tx_id: Optional[pycardano.TransactionId] = None
+
+
+class UtxoReservations:
+    def __init__(
+        self,
+        build_timeout: float = BUILD_TIMEOUT,
+        pending_timeout: float = PENDING_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.build_timeout = build_timeout
+        self.pending_timeout = pending_timeout
+        self.clock = clock
+        # held while selecting and reserving UTxOs, so that the selection is atomic
+        self.lock = threading.RLock()
+        self._reserved: Dict[pycardano.TransactionInput, Reservation] = {}
+
+    def _expire(self):
+        now = self.clock()
+        for i in [i for i, r in self._reserved.items() if r.expires <= now]:
+            del self._reserved[i]
+
+    def is_reserved(self, utxo: pycardano.UTxO) -> bool:
+        with self.lock:
+            self._expire()
+            return utxo.input in self._reserved
+
+    def unreserved(self, utxos: Iterable[pycardano.UTxO]) -> List[pycardano.UTxO]:
+        with self.lock:
+            self._expire()
+            return [u for u in utxos if u.input not in self._reserved]
+
+    def available(
+        self,
+        address: Union[str, pycardano.Address],
+        utxos: List[pycardano.UTxO],
+    ) -> List[pycardano.UTxO]:
+        """
+        The UTxOs at the address that are not reserved.
+        Reserved UTxOs at the address that are no longer returned by the chain were spent,
+        their reservations are dropped.
+        """
+        with self.lock:
+            present = {u.input for u in utxos}
+            for i in [
+                i
+                for i, r in self._reserved.items()
+                if r.address == str(address) and i not in present
+            ]:
+                del self._reserved[i]
+            return self.unreserved(utxos)
+
+    def reserve(self, utxos: Iterable[pycardano.UTxO]):
+        with self.lock:
+            utxos = list(utxos)
+            taken = [u for u in utxos if self.is_reserved(u)]
+            assert not taken, f"UTxOs already reserved: {[str(u.input) for u in taken]}"
+            expires = self.clock() + self.build_timeout
+            for u in utxos:
+                self._reserved[u.input] = Reservation(str(u.output.address), expires)
+
+    def release(self, inputs: Iterable[pycardano.TransactionInput]):
+        with self.lock:
+            for i in inputs:
+                self._reserved.pop(i, None)
+
+    def submitted(self, tx: pycardano.Transaction):
+        """
+        Keep the reserved inputs of the transaction until it is confirmed
+        """
+        with self.lock:
+            expires = self.clock() + self.pending_timeout
+            for i in tx.transaction_body.inputs:
+                if i in self._reserved:
+                    self._reserved[i].tx_id = tx.id
+                    self._reserved[i].expires = expires
+
+    def roll_forward(self, transactions: List[dict]):
+        """
+        Release the UTxOs spent by the transactions of a new block
+        """
+        self.release(spent_inputs(transactions))
+
+    def roll_backward(self):
+        """
+        A rollback may drop submitted transactions, so their UTxOs are handed out again
+        """
+        with self.lock:
+            for i in [i for i, r in self._reserved.items() if r.tx_id is not None]:
+                del self._reserved[i]
+
+
+class ReservingChainContext:
+    """
+    Stands in for a chain context and only hands out UTxOs that are not reserved.
+    The inputs of submitted transactions stay reserved until confirmed, those of failed submissions are released.
+    """
+
+    def __init__(
+        self,
+        context: pycardano.ChainContext,
+        reservations: Optional[UtxoReservations] = None,
+    ):
+        self.context = context
+        self.reservations = reservations or UtxoReservations()
+
+    def utxos(self, address: Union[str, pycardano.Address]) -> List[pycardano.UTxO]:
+        return self.reservations.available(address, self.context.utxos(address))
+
+    def submit_tx(self, tx: pycardano.Transaction):
+        try:
+            res = self.context.submit_tx(tx)
+        except Exception:
+            self.reservations.release(tx.transaction_body.inputs)
+            raise
+        self.reservations.submitted(tx)
+        return res
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.context, name)
+
+
+def reservations_of(context) -> Optional[UtxoReservations]:
+    """
+    The reservations of the context, None if it does not reserve UTxOs
+    """
+    if isinstance(context, ReservingChainContext):
+        return context.reservations
+    return None
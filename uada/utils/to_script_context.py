@@ -1,8 +1,57 @@
-from typing import Optional
+"""
+Conversion of pycardano transactions into the script context that contracts are passed.
+
+Addresses and credentials are converted once per byte encoding, and the datum hashes and converted
+resolved inputs are shared by all transactions that reuse the same outputs, i.e. when evaluating
+many candidate transactions on the same UTxOs. Converted objects are shared, they must not be mutated.
+"""
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
 
 import pycardano
 from opshin.prelude import *
 
+# number of converted objects that are remembered of every kind
+CACHE_SIZE = 4096
+
+
+class IdentityCache:
+    """
+    Bounded cache of conversions of objects that are not hashable, keyed by their identity.
+    The entries keep the objects alive, so their ids are not reused while cached.
+    It is shared by the threads that evaluate transactions concurrently, e.g. in the daemon.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries: Dict[Hashable, Tuple[Any, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, o: Any, convert: Callable[[], Any]) -> Any:
+        key = (key, id(o))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[1]
+        # converted without the lock, conversions may use other caches
+        converted = convert()
+        with self._lock:
+            self.entries[key] = (o, converted)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return converted
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+datum_hashes = IdentityCache()
+tx_in_infos = IdentityCache()
+
 
 def to_staking_credential(
     sk: Union[
@@ -26,9 +75,9 @@ def to_staking_hash(
     if isinstance(sk, pycardano.PointerAddress):
         return StakingPtr(sk.slot, sk.tx_index, sk.cert_index)
     if isinstance(sk, pycardano.VerificationKeyHash):
-        return StakingHash(PubKeyCredential(sk.payload))
+        return StakingHash(_pub_key_credential(sk.payload))
     if isinstance(sk, pycardano.ScriptHash):
-        return StakingHash(ScriptCredential(sk.payload))
+        return StakingHash(_script_credential(sk.payload))
     raise NotImplementedError(f"Unknown stake key type {type(sk)}")
 
 
@@ -69,38 +118,60 @@ def to_dcert(c: pycardano.Certificate) -> DCert:
     raise NotImplementedError("Can not convert certificates yet")
 
 
-def multiasset_to_value(ma: pycardano.MultiAsset) -> Value:
+def multiasset_to_value(ma: Optional[pycardano.MultiAsset]) -> Value:
+    if ma is None:
+        return {}
     return {
-        PolicyId(policy_id): {
-            TokenName(asset_name): quantity for asset_name, quantity in asset
+        PolicyId(policy_id.payload): {
+            TokenName(asset_name.payload): quantity
+            for asset_name, quantity in asset.items()
         }
-        for policy_id, asset in ma.to_shallow_primitive().items()
+        for policy_id, asset in ma.items()
     }
 
 
 def value_to_value(v: pycardano.Value):
-    ma = multiasset_to_value(v.multi_asset)
-    ma[b""][b""] = v.coin
-    return ma
+    # the ledger always lists lovelace first
+    return {b"": {b"": v.coin}, **multiasset_to_value(v.multi_asset)}
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _pub_key_credential(payload: bytes) -> PubKeyCredential:
+    return PubKeyCredential(PubKeyHash(payload))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _script_credential(payload: bytes) -> ScriptCredential:
+    return ScriptCredential(ValidatorHash(payload))
 
 
 def to_payment_credential(
     c: Union[pycardano.VerificationKeyHash, pycardano.ScriptHash]
 ):
     if isinstance(c, pycardano.VerificationKeyHash):
-        return PubKeyCredential(PubKeyHash(c.to_primitive()))
+        return _pub_key_credential(c.payload)
     if isinstance(c, pycardano.ScriptHash):
-        return ScriptCredential(ValidatorHash(c.to_primitive()))
+        return _script_credential(c.payload)
     raise NotImplementedError(f"Unknown payment key type {type(c)}")
 
 
-def to_address(a: pycardano.Address):
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _to_address(address: bytes) -> Address:
+    a = pycardano.Address.from_primitive(address)
     return Address(
         to_payment_credential(a.payment_part),
         to_staking_credential(a.staking_part),
     )
 
 
+def to_address(a: pycardano.Address):
+    return _to_address(bytes(a))
+
+
+def to_datum_hash(d: pycardano.Datum) -> bytes:
+    return datum_hashes.get(None, d, lambda: pycardano.datum_hash(d).payload)
+
+
 def to_tx_out(o: pycardano.TransactionOutput):
     if o.datum is not None:
         output_datum = SomeOutputDatum(o.datum)
@@ -111,7 +182,7 @@ def to_tx_out(o: pycardano.TransactionOutput):
     if o.script is None:
         script = NoScriptHash()
     else:
-        script = SomeScriptHash(o.script.hash().to_primitive())
+        script = SomeScriptHash(pycardano.plutus_script_hash(o.script).payload)
     return TxOut(
         to_address(o.address),
         value_to_value(o.amount),
@@ -128,40 +199,128 @@ def to_tx_out_ref(i: pycardano.TransactionInput):
 
 
 def to_tx_in_info(i: pycardano.TransactionInput, o: pycardano.TransactionOutput):
-    return TxInInfo(
-        to_tx_out_ref(i),
-        to_tx_out(o),
+    """
+    The resolved input, converted once for all transactions spending or referencing it
+    """
+    return tx_in_infos.get(
+        (i.transaction_id.payload, i.index),
+        o,
+        lambda: TxInInfo(to_tx_out_ref(i), to_tx_out(o)),
     )
 
 
+class RedeemerTargets:
+    """
+    The inputs, policies and withdrawals of a transaction in the order that redeemers index them
+    """
+
+    def __init__(self, tx_body: pycardano.TransactionBody):
+        self.inputs = sorted(
+            tx_body.inputs, key=lambda i: (i.transaction_id.payload, i.index)
+        )
+        self.policy_ids = sorted((tx_body.mint or {}).keys(), key=lambda p: p.payload)
+        self.reward_addresses = sorted((tx_body.withdraws or {}).keys())
+
+    def purpose(self, r: pycardano.Redeemer):
+        if r.tag == pycardano.RedeemerTag.SPEND:
+            return Spending(to_tx_out_ref(self.inputs[r.index]))
+        if r.tag == pycardano.RedeemerTag.MINT:
+            return Minting(PolicyId(self.policy_ids[r.index].payload))
+        if r.tag == pycardano.RedeemerTag.REWARD:
+            return Rewarding(
+                to_staking_hash(
+                    pycardano.Address.from_primitive(
+                        self.reward_addresses[r.index]
+                    ).staking_part
+                )
+            )
+        raise NotImplementedError(f"Can not convert redeemer tag {r.tag} yet")
+
+
+def to_script_purpose(
+    r: pycardano.Redeemer,
+    tx_body: pycardano.TransactionBody,
+):
+    return RedeemerTargets(tx_body).purpose(r)
+
+
+def to_redeemer_data(d: Any) -> Redeemer:
+    if isinstance(d, list):
+        return pycardano.IndefiniteList([to_redeemer_data(x) for x in d])
+    return d
+
+
+class LazyTxInfo(TxInfo):
+    """
+    TxInfo whose fields are converted when they are first accessed,
+    i.e. when the script context is serialized
+    """
+
+    @classmethod
+    def from_converters(cls, converters: Dict[str, Callable[[], Any]]) -> "LazyTxInfo":
+        tx_info = cls.__new__(cls)
+        tx_info.__dict__["_converters"] = converters
+        return tx_info
+
+    def __getattr__(self, name: str):
+        converters = self.__dict__.get("_converters", {})
+        if name not in converters:
+            raise AttributeError(name)
+        value = converters.pop(name)()
+        setattr(self, name, value)
+        return value
+
+
 def to_tx_info(
     tx: pycardano.Transaction,
     resolved_inputs: List[pycardano.TransactionOutput],
     resolved_reference_inputs: List[pycardano.TransactionOutput],
-):
+    tx_id: Optional[pycardano.TransactionId] = None,
+) -> TxInfo:
+    """
+    The TxInfo of the transaction, converted lazily
+    :param tx_id: the id of the transaction, if it is known, instead of the hash of its body
+    """
     tx_body = tx.transaction_body
-    return TxInfo(
-        [to_tx_in_info(i, o) for i, o in zip(tx_body.inputs, resolved_inputs)],
-        [
-            to_tx_in_info(i, o)
-            for i, o in zip(tx_body.reference_inputs, resolved_reference_inputs)
-        ],
-        [to_tx_out(o) for o in tx_body.outputs],
-        value_to_value(pycardano.Value(tx_body.fee)),
-        multiasset_to_value(tx_body.mint),
-        [to_dcert(c) for c in tx_body.certificates],
-        to_wdrl(tx_body.withdraws),
-        to_valid_range(tx_body.validity_start, tx_body.ttl),
-        [to_pubkeyhash(s) for s in tx_body.required_signers],
-        {
-            pycardano.datum_hash(d): d
+    redeemers = tx.transaction_witness_set.redeemer or []
+
+    def redeemer_map():
+        targets = RedeemerTargets(tx_body)
+        return {targets.purpose(r): to_redeemer_data(r.data) for r in redeemers}
+
+    def datums():
+        return {
+            to_datum_hash(d): d
             for d in [
                 o.datum
                 for o in tx_body.outputs + resolved_inputs + resolved_reference_inputs
                 if o.datum is not None
             ]
-            + tx.transaction_witness_set.plutus_data
-        },
-        {pycardano.datum_hash(r): r for r in tx.transaction_witness_set.redeemer},
-        to_tx_id(tx_body.id),
+            + (tx.transaction_witness_set.plutus_data or [])
+        }
+
+    return LazyTxInfo.from_converters(
+        {
+            "inputs": lambda: [
+                to_tx_in_info(i, o) for i, o in zip(tx_body.inputs, resolved_inputs)
+            ],
+            "reference_inputs": lambda: [
+                to_tx_in_info(i, o)
+                for i, o in zip(
+                    tx_body.reference_inputs or [], resolved_reference_inputs
+                )
+            ],
+            "outputs": lambda: [to_tx_out(o) for o in tx_body.outputs],
+            "fee": lambda: value_to_value(pycardano.Value(tx_body.fee)),
+            "mint": lambda: multiasset_to_value(tx_body.mint),
+            "dcert": lambda: [to_dcert(c) for c in tx_body.certificates or []],
+            "wdrl": lambda: to_wdrl(tx_body.withdraws),
+            "valid_range": lambda: to_valid_range(tx_body.validity_start, tx_body.ttl),
+            "signatories": lambda: [
+                to_pubkeyhash(s) for s in tx_body.required_signers or []
+            ],
+            "redeemers": redeemer_map,
+            "data": datums,
+            "id": lambda: to_tx_id(tx_id if tx_id is not None else tx_body.id),
+        }
     )